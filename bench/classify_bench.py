@@ -0,0 +1,254 @@
+"""
+Scaling benchmark of the mail classification stage (src/extraction.py).
+
+Synthetic inbox frames in the `EMAIL_COLUMNS` schema are classified for every
+(rows x rules) case; each stage is timed separately and the peak RSS of the
+case is reported. Every case runs in a fresh process so peaks do not leak
+from one case into the next.
+
+    python -m bench.classify_bench --rows 10000 100000 1000000 --rules 4 20 100 --json classify.json
+"""
+from __future__ import annotations
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import datetime as dt
+import multiprocessing as mp
+
+from typing import Dict, List, Optional, Any
+
+try :
+    import resource
+
+except ImportError :  # Windows
+    resource = None
+
+
+# src.config needs a full environment at import time; it does not influence the engine
+from bench.graph_bench import BENCH_ENV
+
+
+def _peak_rss_mb () -> Optional[float] :
+    """
+    Peak resident set size of this process in MB (None when not available).
+    """
+    if resource is None :
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # bytes on macOS, kilobytes elsewhere
+    return round(peak / (1 << 20 if sys.platform == "darwin" else 1 << 10), 1)
+
+
+def build_rules (count : int) -> Dict[str, Dict] :
+    """
+    `count` counterparty rules shaped like the configured ones.
+    """
+    return {
+
+        f"CP{i}" : {
+            "emails" : {f"ops@cp{i}.example"},
+            "subject" : f"Cp{i} Daily;Statement{i}",
+            "filenames" : {f"cp{i}_pos"},
+        }
+        for i in range(count)
+
+    }
+
+
+def build_inbox (rows : int, rules : int, match_rate : float = 0.2, seed : int = 0) :
+    """
+    Synthetic inbox frame (`EMAIL_COLUMNS` schema) generated with Polars expressions.
+
+    `match_rate` of the rows come from a counterparty: 70% from the rule's address,
+    the rest from another address of its domain; a tenth of those carry no matching
+    filename. The remaining rows are noise, half of them with attachments.
+    """
+    import polars as pl
+    from src.config import EMAIL_COLUMNS
+
+    idx = pl.int_range(0, rows, dtype=pl.UInt64)
+    draw = lambda salt : (idx.hash(seed + salt) % 1_000_000).cast(pl.Float64) / 1_000_000
+
+    cp = (idx.hash(seed + 1) % max(rules, 1)).cast(pl.Utf8)
+    matched = draw(2) < match_rate
+
+    df = pl.select(
+
+        idx.cast(pl.Utf8).alias("Id"),
+
+        pl.when(matched)
+          .then(pl.concat_str(pl.lit("Cp"), cp, pl.lit(" Daily "), idx.cast(pl.Utf8)))
+          .otherwise(pl.concat_str(pl.lit("Newsletter "), (idx % 1000).cast(pl.Utf8)))
+          .alias("Subject"),
+
+        pl.when(matched & (draw(3) < 0.7))
+          .then(pl.concat_str(pl.lit("ops@cp"), cp, pl.lit(".example")))
+          .when(matched)
+          .then(pl.concat_str(pl.lit("desk@cp"), cp, pl.lit(".example")))
+          .otherwise(pl.concat_str(pl.lit("user"), (idx % 997).cast(pl.Utf8), pl.lit("@noise"), (idx % 50).cast(pl.Utf8), pl.lit(".example")))
+          .alias("From"),
+
+        pl.lit("2025-03-03T08:00:00Z").alias("Received DateTime"),
+        (matched | (draw(4) < 0.5)).alias("Attachments"),
+        pl.lit(BENCH_ENV["SHARED_MAIL_1"]).alias("Shared Email"),
+        pl.lit(None, dtype=EMAIL_COLUMNS["Attachments Meta"]).alias("Attachments Meta"),
+
+        pl.when(matched & (draw(5) < 0.9))
+          .then(pl.concat_list(pl.concat_str(pl.lit("CP"), cp, pl.lit("_POS.xlsx")), pl.lit("notes.pdf")))
+          .when(matched)
+          .then(pl.concat_list(pl.lit("notes.pdf")))
+          .otherwise(pl.concat_list(pl.lit("brochure.pdf")))
+          .alias("Attachment Names"),
+
+    )
+
+    return df.select([pl.col(name).cast(dtype) for name, dtype in EMAIL_COLUMNS.items()])
+
+
+def run_case (rows : int, rules : int, match_rate : float, seed : int = 0) -> Dict[str, Any] :
+    """
+    Time each classification stage for one (rows x rules) case.
+    """
+    for key, value in BENCH_ENV.items() :
+        os.environ.setdefault(key, value)
+
+    from src import extraction as ex
+
+    timings : Dict[str, float] = {}
+
+    def timed (name : str, func) :
+
+        start = time.perf_counter()
+        out = func()
+        timings[name] = round(time.perf_counter() - start, 4)
+
+        return out
+
+    rule_set = build_rules(rules)
+
+    df = timed("generate_s", lambda : build_inbox(rows, rules, match_rate, seed))
+    rss_data = _peak_rss_mb()
+
+    ex._COMPILED.clear()
+
+    df2 = timed("filter_s", lambda : ex._filter_attachments_only(df))
+    compiled = timed("compile_s", lambda : ex.compile_rules(rule_set))
+
+    work = timed("extract_s", lambda : ex._extract_sender_columns(df2))
+    work = timed("attachments_s", lambda : ex._normalize_attachments(work, "Attachment Names"))
+    work = timed("assign_s", lambda : ex._assign(work, compiled))
+    buckets = timed("materialize_s", lambda : ex._materialize_buckets(work, df2, list(compiled.names)))
+
+    timings["stages_s"] = round(sum(v for k, v in timings.items() if k != "generate_s"), 4)
+
+    # End to end with a warm ruleset, as on every date after the first
+    timed("split_total_s", lambda : ex.split_by_counterparty(df, rule_set))
+
+    return {
+
+        "rows" : rows,
+        "rules" : rules,
+        "match_rate" : match_rate,
+        "with_attachments" : df2.height,
+        "matched" : df2.height - buckets["UNMATCHED"].height,
+        **timings,
+        "rows_per_s" : round(rows / timings["stages_s"]) if timings["stages_s"] else None,
+        "rss_after_generate_mb" : rss_data,
+        "peak_rss_mb" : _peak_rss_mb(),
+
+    }
+
+
+def _child (queue, rows : int, rules : int, match_rate : float, seed : int) -> None :
+
+    try :
+        queue.put(run_case(rows, rules, match_rate, seed))
+
+    except Exception as e :
+        queue.put({"rows" : rows, "rules" : rules, "match_rate" : match_rate, "error" : f"{type(e).__name__}: {e}"})
+
+
+def run_isolated (rows : int, rules : int, match_rate : float, seed : int = 0) -> Dict[str, Any] :
+    """
+    `run_case` in a fresh process, so its peak RSS is its own.
+    """
+    ctx = mp.get_context("spawn")
+    queue = ctx.Queue()
+
+    proc = ctx.Process(target=_child, args=(queue, rows, rules, match_rate, seed))
+    proc.start()
+
+    result = queue.get()
+    proc.join()
+
+    return result
+
+
+def main (argv : Optional[List[str]] = None) -> Dict[str, Any] :
+
+    parser = argparse.ArgumentParser(description="Scaling benchmark of split_by_counterparty")
+
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000, 5_000_000], help="Inbox sizes")
+    parser.add_argument("--rules", type=int, nargs="+", default=[4, 20, 100], help="Numbers of counterparty rules")
+    parser.add_argument("--match-rate", type=float, nargs="+", default=[0.2], help="Share of counterparty mail")
+    parser.add_argument("--seed", type=int, default=0, help="Generator seed")
+    parser.add_argument("--in-process", action="store_true", help="Run every case in this process (peak RSS then accumulates)")
+    parser.add_argument("--json", default=None, help="Write the results to this JSON file")
+
+    args = parser.parse_args(argv)
+
+    import polars as pl
+
+    cases = []
+
+    for rows in args.rows :
+
+        for rules in args.rules :
+
+            for rate in args.match_rate :
+
+                run = run_case if args.in_process else run_isolated
+                result = run(rows, rules, rate, args.seed)
+                cases.append(result)
+
+                if "error" in result :
+
+                    print(f"[-] rows={rows:>9,} rules={rules:>3} : {result['error']}")
+                    continue
+
+                print(
+                    f"[*] rows={rows:>9,} rules={rules:>3} match={rate:.2f}  "
+                    f"extract {result['extract_s']:7.3f}s  assign {result['assign_s']:7.3f}s  "
+                    f"buckets {result['materialize_s']:7.3f}s  total {result['stages_s']:7.3f}s  "
+                    f"({result['rows_per_s'] or 0:>11,} rows/s)  peak {result['peak_rss_mb']} MB"
+                )
+
+    report = {
+
+        "created_at" : dt.datetime.now().isoformat(timespec="seconds"),
+        "python" : platform.python_version(),
+        "polars" : pl.__version__,
+        "platform" : platform.platform(),
+        "cpus" : os.cpu_count(),
+        "cases" : cases,
+
+    }
+
+    if args.json :
+
+        with open(args.json, "w", encoding="utf-8") as f :
+            json.dump(report, f, indent=2)
+
+        print(f"\n[+] Results saved at {args.json}")
+
+    return report
+
+
+if __name__ == "__main__" :
+    main()
@@ -0,0 +1,417 @@
+from __future__ import annotations
+
+import re
+import json
+import time
+import uuid
+import base64
+import random
+import threading
+import datetime as dt
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, urlencode, unquote
+from typing import Dict, List, Optional, Any, Tuple
+
+
+# -------------------- Synthetic mailboxes --------------------
+
+def _first (values, default : str = "") -> str :
+
+    values = sorted(values or [])
+    return values[0] if values else default
+
+
+def build_mailboxes (
+
+        mailboxes : List[str],
+        start_date : dt.date,
+        end_date : dt.date,
+
+        per_day : int = 100,
+        match_rate : float = 0.2,
+        rules : Optional[Dict[str, Dict]] = None,
+
+        attachment_size : int = 64 << 10,
+        large_rate : float = 0.0,
+        large_size : int = 20 << 20,
+
+        seed : int = 0,
+
+    ) -> Dict[str, List[Dict[str, Any]]] :
+    """
+    Synthetic Inbox content: `per_day` messages per mailbox and day, of which
+    `match_rate` come from a counterparty of `rules` (sender, subject words and
+    filename token taken from the rule). Every matching message carries one
+    workbook attachment (`large_rate` of them `large_size` bytes) and an inline
+    signature image; the rest is plain noise mail.
+    """
+    rng = random.Random(seed)
+    rules = rules or {}
+    names = sorted(rules)
+
+    out : Dict[str, List[Dict[str, Any]]] = {}
+
+    for mailbox in mailboxes :
+
+        messages = []
+        day = start_date
+
+        while day <= end_date :
+
+            for i in range(per_day) :
+
+                received = dt.datetime.combine(day, dt.time(6)) + dt.timedelta(seconds=int(i * 43200 / max(per_day, 1)))
+                msg_id = f"{mailbox.split('@')[0]}-{day:%Y%m%d}-{i:05d}"
+
+                if names and rng.random() < match_rate :
+
+                    name = names[i % len(names)]
+                    rule = rules[name]
+
+                    subject_words = str(rule.get("subject", "")).split(";")[0].strip() or name
+                    token = _first(rule.get("filenames"), name)
+                    size = large_size if rng.random() < large_rate else attachment_size
+
+                    message = {
+                        "id" : msg_id,
+                        "subject" : f"{subject_words} {day:%d/%m/%Y}",
+                        "from" : _first(rule.get("emails"), f"ops@{name.lower()}.example"),
+                        "receivedDateTime" : received.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                        "attachments" : [
+                            {"id" : f"{msg_id}-a0", "name" : f"{token}_{day:%Y%m%d}.xlsx", "size" : size, "isInline" : False,
+                             "contentType" : "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"},
+                            {"id" : f"{msg_id}-a1", "name" : "image001.png", "size" : 4 << 10, "isInline" : True,
+                             "contentType" : "image/png"},
+                        ],
+                    }
+
+                else :
+
+                    message = {
+                        "id" : msg_id,
+                        "subject" : f"Newsletter {i}",
+                        "from" : f"noreply{i % 7}@news.example",
+                        "receivedDateTime" : received.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                        "attachments" : [],
+                    }
+
+                messages.append(message)
+
+            day += dt.timedelta(days=1)
+
+        out[mailbox] = messages
+
+    return out
+
+
+def _content (attachment_id : str, size : int) -> bytes :
+    """
+    Deterministic attachment bytes.
+    """
+    seed = attachment_id.encode()
+    block = (seed * (1024 // max(len(seed), 1) + 1))[:1024]
+
+    return (block * (size // 1024 + 1))[:size]
+
+
+# -------------------- Server --------------------
+
+class FakeGraph :
+    """
+    Local stand-in for the Graph endpoints used by src/msal.py:
+
+      POST /{tenant}/oauth2/v2.0/token
+      GET  /v1.0/users/{upn}/mailFolders/Inbox/messages   ($filter, $top, $expand, nextLink; 400 on endswith(from))
+      GET  /v1.0/users/{upn}/messages/{id}/attachments    (+ /{attachment id}, + /$value)
+      POST /v1.0/$batch
+
+    with injectable latency, 429 throttling and request/byte counters.
+    """
+
+    def __init__ (
+
+            self,
+            mailboxes : Dict[str, List[Dict[str, Any]]],
+
+            latency : float = 0.0,
+            jitter : float = 0.0,
+            throttle_rate : float = 0.0,
+            retry_after : float = 1.0,
+
+            host : str = "127.0.0.1",
+            port : int = 0,
+
+        ) -> None :
+
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+
+        self._lock = threading.Lock()
+        self._rng = random.Random(1)
+
+        self.stats = {"requests" : 0, "throttled" : 0, "bytes_out" : 0}
+        self.load(mailboxes)
+
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+
+    def load (self, mailboxes : Dict[str, List[Dict[str, Any]]]) -> None :
+        """
+        Replace the served mailboxes (see `build_mailboxes`).
+        """
+        self.mailboxes = mailboxes
+        self._index = {(upn, m["id"]) : m for upn, messages in mailboxes.items() for m in messages}
+
+
+    @property
+    def base_url (self) -> str :
+
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+    @property
+    def graph_base (self) -> str :
+        return f"{self.base_url}/v1.0"
+
+
+    def token_endpoint (self, tenant : str = "tenant") -> str :
+        return f"{self.base_url}/{tenant}/oauth2/v2.0/token"
+
+
+    def start (self) -> "FakeGraph" :
+
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+
+        return self
+
+
+    def stop (self) -> None :
+
+        self.server.shutdown()
+        self.server.server_close()
+
+
+    def reset_stats (self) -> None :
+
+        with self._lock :
+            self.stats = {"requests" : 0, "throttled" : 0, "bytes_out" : 0}
+
+
+    # -------------------- Behaviour --------------------
+
+    def _count (self, nbytes : int = 0, throttled : bool = False) -> None :
+
+        with self._lock :
+
+            self.stats["requests"] += 1
+            self.stats["bytes_out"] += nbytes
+            self.stats["throttled"] += int(throttled)
+
+
+    def _should_throttle (self) -> bool :
+
+        with self._lock :
+            return self.throttle_rate > 0 and self._rng.random() < self.throttle_rate
+
+
+    def _sleep (self) -> None :
+
+        if self.latency or self.jitter :
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+
+
+    @staticmethod
+    def _attachment_json (att : Dict[str, Any], with_content : bool, select : Optional[List[str]] = None) -> Dict[str, Any] :
+
+        out = {"@odata.type" : "#microsoft.graph.fileAttachment"}
+        out.update({k : v for k, v in att.items() if select is None or k in select})
+
+        if with_content :
+            out["contentBytes"] = base64.b64encode(_content(att["id"], att["size"])).decode()
+
+        return out
+
+
+    def _message_json (self, m : Dict[str, Any], expand : bool) -> Dict[str, Any] :
+
+        out = {
+            "id" : m["id"],
+            "subject" : m["subject"],
+            "from" : {"emailAddress" : {"address" : m["from"]}},
+            "receivedDateTime" : m["receivedDateTime"],
+            "hasAttachments" : bool(m["attachments"]),
+        }
+
+        if expand :
+            out["attachments"] = [self._attachment_json(a, False) for a in m["attachments"]]
+
+        return out
+
+
+    def _matches_filter (self, m : Dict[str, Any], flt : str) -> bool :
+
+        for op, value in re.findall(r"receivedDateTime (ge|lt) (\S+)", flt) :
+
+            if op == "ge" and m["receivedDateTime"] < value :
+                return False
+
+            if op == "lt" and m["receivedDateTime"] >= value :
+                return False
+
+        if "hasAttachments eq true" in flt and not m["attachments"] :
+            return False
+
+        exact = [v.lower() for v in re.findall(r"address eq '([^']*)'", flt)]
+
+        if exact and m["from"].lower() not in exact :
+            return False
+
+        return True
+
+
+    def dispatch (self, method : str, path : str, query : Dict[str, str], body : Optional[Dict] = None) -> Tuple[int, Dict[str, str], bytes] :
+        """
+        Route one (sub-)request; returns (status, headers, body bytes).
+        """
+        def as_json (status : int, payload : Any) -> Tuple[int, Dict[str, str], bytes] :
+            return status, {"Content-Type" : "application/json"}, json.dumps(payload).encode()
+
+        if method == "POST" and path.endswith("/oauth2/v2.0/token") :
+            return as_json(200, {"token_type" : "Bearer", "expires_in" : 3600, "access_token" : f"fake-{uuid.uuid4().hex}"})
+
+        if method == "POST" and path == "/v1.0/$batch" :
+
+            responses = []
+
+            for sub in (body or {}).get("requests", []) :
+
+                parts = urlsplit(sub["url"])
+                sub_query = {k : v[0] for k, v in parse_qs(parts.query).items()}
+                status, headers, payload = self.dispatch(sub.get("method", "GET"), "/v1.0" + unquote(parts.path), sub_query)
+
+                if headers.get("Content-Type") == "application/json" :
+                    sub_body = json.loads(payload)
+                else :
+                    sub_body = base64.b64encode(payload).decode()
+
+                responses.append({"id" : sub["id"], "status" : status, "headers" : headers, "body" : sub_body})
+
+            return as_json(200, {"responses" : responses})
+
+        m = re.fullmatch(r"/v1\.0/users/([^/]+)/mailFolders/Inbox/messages", path)
+
+        if method == "GET" and m :
+
+            upn = unquote(m.group(1))
+            flt = query.get("$filter", "")
+
+            # Like Outlook, which does not support endswith on the sender
+            if "endswith(from/emailAddress/address" in flt :
+                return as_json(400, {"error" : {"code" : "ErrorInvalidUrlQueryFilter", "message" : "The query filter contains one or more invalid nodes."}})
+            top = int(query.get("$top", "10"))
+            skip = int(query.get("$skip", "0"))
+            expand = "attachments" in query.get("$expand", "")
+
+            hits = [msg for msg in self.mailboxes.get(upn, []) if self._matches_filter(msg, flt)]
+            page = hits[skip:skip + top]
+
+            payload = {"value" : [self._message_json(msg, expand) for msg in page]}
+
+            if skip + top < len(hits) :
+                payload["@odata.nextLink"] = f"{self.graph_base}/users/{upn}/mailFolders/Inbox/messages?" + urlencode(dict(query, **{"$skip" : str(skip + top)}))
+
+            return as_json(200, payload)
+
+        m = re.fullmatch(r"/v1\.0/users/([^/]+)/messages/([^/]+)/attachments(?:/([^/]+))?(/\$value)?", path)
+
+        if method == "GET" and m :
+
+            upn, msg_id, att_id, raw = unquote(m.group(1)), unquote(m.group(2)), m.group(3), m.group(4)
+            message = self._index.get((upn, msg_id))
+
+            if message is None :
+                return as_json(404, {"error" : {"code" : "ErrorItemNotFound"}})
+
+            if att_id is None :
+
+                select = query.get("$select")
+                select = select.split(",") if select else None
+
+                return as_json(200, {"value" : [self._attachment_json(a, select is None, select) for a in message["attachments"]]})
+
+            att = next((a for a in message["attachments"] if a["id"] == unquote(att_id)), None)
+
+            if att is None :
+                return as_json(404, {"error" : {"code" : "ErrorItemNotFound"}})
+
+            if raw :
+                return 200, {"Content-Type" : "application/octet-stream"}, _content(att["id"], att["size"])
+
+            return as_json(200, self._attachment_json(att, True))
+
+        return as_json(404, {"error" : {"code" : "NotFound", "message" : path}})
+
+
+    def _handler (self) :
+
+        fake = self
+
+        class Handler (BaseHTTPRequestHandler) :
+
+            protocol_version = "HTTP/1.1"
+
+            def log_message (self, *args) :
+                pass
+
+            def _serve (self, method : str) -> None :
+
+                length = int(self.headers.get("Content-Length") or 0)
+                raw_body = self.rfile.read(length) if length else b""
+
+                fake._sleep()
+
+                if fake._should_throttle() :
+
+                    fake._count(throttled=True)
+
+                    self.send_response(429)
+                    self.send_header("Retry-After", str(fake.retry_after))
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+
+                    return
+
+                parts = urlsplit(self.path)
+                query = {k : v[0] for k, v in parse_qs(parts.query).items()}
+
+                body = None
+
+                if raw_body and "json" in (self.headers.get("Content-Type") or "") :
+                    body = json.loads(raw_body)
+
+                status, headers, payload = fake.dispatch(method, parts.path, query, body)
+                fake._count(len(payload))
+
+                self.send_response(status)
+
+                for key, value in headers.items() :
+                    self.send_header(key, value)
+
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET (self) :
+                self._serve("GET")
+
+            def do_POST (self) :
+                self._serve("POST")
+
+        return Handler
@@ -0,0 +1,231 @@
+"""
+Throughput / latency benchmark of the Graph download path against the local
+Graph stand-in (bench/fake_graph.py), without a live tenant.
+
+    python -m bench.graph_bench --days 5 --per-day 200 --latency 0.02 --json out.json
+"""
+from __future__ import annotations
+
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import datetime as dt
+
+from typing import Dict, List, Optional, Any, Callable
+
+from bench.fake_graph import FakeGraph, build_mailboxes
+
+
+# Synthetic settings so src.config can be imported without a real .env
+BENCH_ENV = {
+
+    "TENANT_ID" : "tenant",
+    "APPLICATION_ID" : "bench-app",
+    "SECRET_VALUE_ID" : "bench-secret",
+    "SHARED_MAIL_1" : "ops1@fund.example",
+    "SHARED_MAIL_2" : "ops2@fund.example",
+    "HV" : "Heroics Volatility",
+    "WR" : "White Rock",
+
+    "MS_EMAILS" : "positions@ms.example", "MS_SUBJECT_WORDS" : "Morgan Stanley", "MS_FILENAMES" : "MSPositions",
+    "MS_ACCOUNT_HV" : "HV001", "MS_ACCOUNT_WR" : "WR001",
+    "GS_EMAILS" : "reports@gs.example", "GS_SUBJECT_WORDS" : "Goldman", "GS_FILENAMES" : "GSFX;GSEQ",
+    "GS_FX" : "GSFX", "GS_EQ" : "GSEQ", "GS_FX_SHEETS" : "Sheet1", "GS_EQ_SHEETS" : "Sheet1",
+    "SAXO_EMAILS" : "statements@saxo.example", "SAXO_SUBJECT_WORDS" : "Saxo", "SAXO_FILENAMES" : "SaxoTrades",
+    "UBS_EMAILS" : "custody@ubs.example", "UBS_SUBJECT_WORDS" : "UBS", "UBS_FILENAMES" : "UBSPositions",
+
+}
+
+
+def _setup_env (fake : FakeGraph, work_dir : str) -> None :
+    """
+    Point src.config at the stand-in and at throw-away folders (must run before importing src.*).
+    """
+    for key, value in BENCH_ENV.items() :
+        os.environ.setdefault(key, value)
+
+    os.environ["GRAPH_BASE"] = fake.graph_base
+    os.environ.pop("TOKEN_CACHE_ABS_PATH", None)
+
+    attachments = os.path.join(work_dir, "attachments")
+
+    for key, sub in (("RAW_DIR_ABS_PATH", "raw"), ("DATA_DIR_ABS_PATH", "data"), ("CACHE_DIR_ABS_PATH", "cache")) :
+        os.environ[key] = os.path.join(work_dir, sub)
+
+    os.environ["ATTACHMENT_DIR_ABS_PATH"] = attachments
+
+    for cpty in ("GS", "MS", "SAXO", "UBS") :
+        os.environ[f"{cpty}_ATTACHMENT_DIR_ABS_PATH"] = os.path.join(attachments, cpty)
+
+
+def _measure (fake : FakeGraph, name : str, func : Callable[[], Any]) -> Dict[str, Any] :
+    """
+    Run one scenario and report end-to-end time, requests/sec and bytes/sec seen by the stand-in.
+    """
+    fake.reset_stats()
+    start = time.perf_counter()
+
+    error = None
+
+    try :
+        func()
+
+    except Exception as e :
+        error = f"{type(e).__name__}: {e}"
+
+    elapsed = time.perf_counter() - start
+    stats = dict(fake.stats)
+
+    result = {
+
+        "scenario" : name,
+        "elapsed_s" : round(elapsed, 3),
+        "requests" : stats["requests"],
+        "throttled" : stats["throttled"],
+        "bytes" : stats["bytes_out"],
+        "requests_per_s" : round(stats["requests"] / elapsed, 1) if elapsed else None,
+        "bytes_per_s" : round(stats["bytes_out"] / elapsed) if elapsed else None,
+        "error" : error,
+
+    }
+
+    print(
+        f"[*] {name:<24} {elapsed:8.2f}s  {stats['requests']:6d} req  {result['requests_per_s'] or 0:8.1f} req/s  "
+        f"{stats['bytes_out'] / 1e6:9.1f} MB  {(result['bytes_per_s'] or 0) / 1e6:7.1f} MB/s"
+        + (f"  [-] {error}" if error else "")
+    )
+
+    return result
+
+
+def run (args : argparse.Namespace) -> List[Dict[str, Any]] :
+
+    work_dir = tempfile.mkdtemp(prefix="graph-bench-")
+
+    fake = FakeGraph({}, latency=args.latency, jitter=args.jitter, throttle_rate=args.throttle_rate, retry_after=args.retry_after).start()
+    _setup_env(fake, work_dir)
+
+    # Imported only now: src.config reads the environment at import time
+    from src.config import COUNTERPARTIES, SHARED_MAILS
+    from src.msal import TokenProvider, set_token_provider, get_inbox_messages_by_range, partition_by_received_date
+    from src.extraction import split_by_counterparty, select_attachments
+    from src.download import DownloadJob, download_jobs
+
+    # Tokens come from the stand-in instead of MSAL
+    set_token_provider(TokenProvider(token_endpoint=fake.token_endpoint(os.environ["TENANT_ID"])))
+
+    start_date = dt.date.fromisoformat(args.start_date)
+    end_date = start_date + dt.timedelta(days=args.days - 1)
+
+    fake.load(
+        build_mailboxes(
+            SHARED_MAILS, start_date, end_date + dt.timedelta(days=3),
+            per_day=args.per_day, match_rate=args.match_rate, rules=COUNTERPARTIES,
+            attachment_size=args.attachment_size, large_rate=args.large_rate, large_size=args.large_size,
+        )
+    )
+
+    results = []
+    inbox : Dict[str, Any] = {}
+
+    def listing () -> None :
+        inbox["df"] = get_inbox_messages_by_range(start_date, end_date, None, SHARED_MAILS, with_attach=True)
+
+    results.append(_measure(fake, "listing (range)", listing))
+
+    def build_jobs (selective : bool, out_root : str) -> List[DownloadJob] :
+
+        jobs = []
+
+        for date, df in partition_by_received_date(inbox.get("df")).items() :
+
+            for cpty, df_cp in split_by_counterparty(df).items() :
+
+                if cpty == "UNMATCHED" :
+                    continue
+
+                for row in df_cp.select("Id", "Shared Email", "Attachments Meta").to_dicts() :
+
+                    attachments = select_attachments(row["Attachments Meta"], COUNTERPARTIES[cpty].get("filenames")) if selective else None
+                    jobs.append(DownloadJob(row["Id"], row["Shared Email"], os.path.join(out_root, cpty), cpty, date, attachments))
+
+        return jobs
+
+    scenarios = {
+
+        "download (serial)" : dict(selective=False, batch=False, stream=False, workers=1),
+        "download (threads)" : dict(selective=False, batch=False, stream=False, workers=args.workers),
+        "download ($batch)" : dict(selective=False, batch=True, stream=False, workers=args.workers),
+        "download (stream)" : dict(selective=False, batch=True, stream=True, workers=args.workers),
+        "download (selective)" : dict(selective=True, batch=True, stream=True, workers=args.workers),
+
+    }
+
+    for name, opts in scenarios.items() :
+
+        out_root = os.path.join(work_dir, "bench", name.replace(" ", "_"))
+        jobs = build_jobs(opts["selective"], out_root)
+
+        results.append(
+            _measure(fake, name, lambda: download_jobs(jobs, max_workers=opts["workers"], batch=opts["batch"], stream=opts["stream"]))
+        )
+
+        shutil.rmtree(out_root, ignore_errors=True)
+
+    if args.main :
+
+        def run_main () -> None :
+
+            import main as entrypoint
+            entrypoint.main(start_date=start_date, end_date=end_date, yesterday=False)
+
+        results.append(_measure(fake, "main()", run_main))
+
+    fake.stop()
+
+    if not args.keep :
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return results
+
+
+def parse_args (argv : Optional[List[str]] = None) -> argparse.Namespace :
+
+    parser = argparse.ArgumentParser(description="Benchmark the Graph download path against a local stand-in")
+
+    parser.add_argument("--start-date", default="2025-03-03", help="First listed day (YYYY-MM-DD)")
+    parser.add_argument("--days", type=int, default=5, help="Number of listed days")
+    parser.add_argument("--per-day", type=int, default=200, help="Messages per mailbox and day")
+    parser.add_argument("--match-rate", type=float, default=0.2, help="Share of broker mail")
+
+    parser.add_argument("--attachment-size", type=int, default=64 << 10, help="Bytes per broker attachment")
+    parser.add_argument("--large-rate", type=float, default=0.0, help="Share of large attachments")
+    parser.add_argument("--large-size", type=int, default=20 << 20, help="Bytes per large attachment")
+
+    parser.add_argument("--latency", type=float, default=0.02, help="Server latency per request (s)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra random latency per request (s)")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of requests answered with 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After sent with 429 (s)")
+
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent downloads")
+    parser.add_argument("--main", action="store_true", help="Also run main() end to end")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary working folder")
+    parser.add_argument("--json", default=None, help="Write the results to this JSON file")
+
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__" :
+
+    args = parse_args()
+    results = run(args)
+
+    if args.json :
+
+        with open(args.json, "w", encoding="utf-8") as f :
+            json.dump({"args" : vars(args), "results" : results}, f, indent=2)
+
+        print(f"\n[+] Results saved at {args.json}")
@@ -8,26 +8,23 @@ import datetime as dt
 
 from typing import Optional, List, Dict
 
-from src.config import FUNDATIONS, COUNTERPARTIES, SHARED_MAILS, EMAIL_COLUMNS, RAW_DIR_ABS_PATH, ATTACHMENT_DIR_ABS_PATH, DATA_DIR_ABS_PATH, CACHE_DIR_ABS_PATH
-from src.msal import get_token, get_inbox_messages_by_date, download_attachments_for_message
+from src.config import (
+    FUNDATIONS, SHARED_MAILS, EMAIL_COLUMNS, RAW_DIR_ABS_PATH, ATTACHMENT_DIR_ABS_PATH, DATA_DIR_ABS_PATH, CACHE_DIR_ABS_PATH,
+    ATTACHMENT_MANIFEST_ABS_PATH, ATTACHMENT_STORE_DIR_ABS_PATH, MESSAGE_CACHE_DIR_ABS_PATH, RAW_EXCEL_DUMPS,
+    RUN_JOURNAL_ABS_PATH
+)
+from src.msal import get_token_provider, get_graph_client, get_inbox_messages_by_range, get_inbox_messages_delta, partition_by_received_date
+from src.download import DownloadJob, download_jobs, print_download_summary
+from src.parsing import ParseJob, parse_jobs
+from src.manifest import AttachmentManifest
+from src.message_cache import MessageCache
+from src.journal import RunJournal, run_key
 from src.utils import str_to_date, date_to_str, generate_dates, previous_business_day, generate_download_dates
-from src.extraction import split_by_counterparty
+from src.extraction import classify_messages, select_attachments
 from src.export import export_trade_reconciliation, save_trades_by_date_parquet
 
-from src.counterparties.ubs import ubs_trades
-from src.counterparties.gs import gs_trades
-from src.counterparties.saxo import saxo_trades
-from src.counterparties.ms import ms_trades
-
-
-COUNTERPARTIES = {
-
-    "GS"    : gs_trades,
-    "UBS"   : ubs_trades,
-    "SAXO"  : saxo_trades,
-    "MS"    : ms_trades,
-
-}
+# Counterparty parsers are registered by name and only imported when a run selects them
+from src.registry import PARSERS, load_parsers
 
 
 
@@ -40,7 +37,7 @@ def main (
         shared_emails: Optional[List[str]] = None,
 
         fundations : Optional[List[str]] = None,
-        counterparties : Optional[Dict[str]] = None,
+        counterparties : Optional[Dict[str] | List[str]] = None,
 
         schema_overrides : Optional[Dict] = None,
         yesterday : Optional[bool] = True,
@@ -50,6 +47,16 @@ def main (
         data_dir_abs : Optional[str] = None,
         cache_dir_abs : Optional[str] = None,
 
+        workers : Optional[int] = None,
+        batch : Optional[bool] = None,
+        delta : bool = False,
+        chunk_days : Optional[int] = None,
+        stream : Optional[bool] = None,
+        refresh : bool = False,
+        raw_excel : Optional[bool] = None,
+        resume : bool = False,
+        jobs : Optional[int] = None,
+
     ) :
     """
     Docstring for main
@@ -74,38 +81,140 @@ def main (
     download_dates = generate_download_dates(asked_dates)
 
     fundations = FUNDATIONS if fundations is None else [fundations]
-    counterparties = COUNTERPARTIES if counterparties is None else counterparties
+
+    # A list of names restricts the run to those parsers (None : every configured one)
+    if not isinstance(counterparties, dict) :
+        counterparties = load_parsers(counterparties)
 
     raw_dir_abs = RAW_DIR_ABS_PATH if raw_dir_abs is None else raw_dir_abs
     attch_dir_abs = ATTACHMENT_DIR_ABS_PATH if attch_dir_abs is None else attch_dir_abs
     data_dir_abs = DATA_DIR_ABS_PATH if data_dir_abs is None else data_dir_abs
     cache_dir_abs = CACHE_DIR_ABS_PATH if cache_dir_abs is None else cache_dir_abs
+    raw_excel = RAW_EXCEL_DUMPS if raw_excel is None else raw_excel
+
+    # The deltaLink moves past every message it returns: the ones outside the asked
+    # dates are only kept for a later run by the message cache
+    if delta and not MESSAGE_CACHE_DIR_ABS_PATH :
+        raise ValueError("--delta needs the message cache : set MESSAGE_CACHE_DIR_ABS_PATH (or CACHE_DIR_ABS_PATH)")
+
+    # Without an explicit token, every Graph helper pulls from the shared provider
+    token_provider = get_token_provider() if token is None else None
+
+    if token_provider is not None :
+        token_provider.start_background_refresh()
 
-    token = get_token() if token is None else token
     shared_emails = SHARED_MAILS if shared_emails is None else shared_emails
     schema_overrides = EMAIL_COLUMNS if schema_overrides is None else schema_overrides
 
 
-    # Set of dates for which we already called ensure_inputs_for_date
+    # Every completed unit (listing, download, parse) is checkpointed; `resume` skips the done ones
+    journal = RunJournal(
+
+        run_key(start=start_date, end=end_date, mailboxes=shared_emails, fundations=fundations, counterparties=list(counterparties)),
+        resume=resume
+
+    ) if RUN_JOURNAL_ABS_PATH else None
+
+    # Attachment downloads are collected for the whole run, then executed concurrently
+    downloads : List[DownloadJob] = []
+
+    # Listed mail is kept in an append-only cache with its counterparty assignment:
+    # days already fully listed for a mailbox are neither re-listed nor re-classified
+    cache = MessageCache() if MESSAGE_CACHE_DIR_ABS_PATH else None
+    listed : List[pl.DataFrame] = []
+
+    # Delta mode lists only what changed since the last sync, whatever the cache holds
+    if delta :
+
+        frames = [get_inbox_messages_delta(email, token, since=download_dates[0]) for email in shared_emails]
+        listed = [df for df in frames if isinstance(df, pl.DataFrame) and not df.is_empty()]
+
+        if cache is not None :
+
+            for df in listed :
+                cache.ingest(df)
+
+    else :
+
+        to_list = {
+
+            email : download_dates if cache is None or refresh else cache.missing_dates(email, download_dates)
+            for email in shared_emails
+
+        }
+
+        # Listings journaled by an interrupted run are served from the cache (today included)
+        if cache is not None and journal is not None and resume and not refresh :
+
+            listed_units = journal.done_units("listing")
+            to_list = {email : [d for d in dates if RunJournal.unit(email, d) not in listed_units] for email, dates in to_list.items()}
+
+        # Mailboxes missing the same span are listed together (one query each, concurrently)
+        spans : Dict[tuple, List[str]] = {}
+
+        for email, dates in to_list.items() :
+
+            if dates :
+                spans.setdefault((dates[0], dates[-1]), []).append(email)
+
+        for (start, end), emails in spans.items() :
+
+            try :
+                df = get_inbox_messages_by_range(start, end, token, emails, with_attach=True, chunk_days=chunk_days)
+
+            except Exception as e :
+
+                print(f"\n[-] Listing failed for {', '.join(emails)} from {start} to {end}: {e}")
+
+                if journal is not None :
+
+                    for email in emails :
+
+                        for date in to_list[email] :
+                            journal.record("listing", RunJournal.unit(email, date), f"{type(e).__name__}: {e}")
+
+                continue
+
+            if cache is not None :
+
+                cache.ingest(df)
+
+                for email in emails :
+                    cache.mark_covered(email, to_list[email])
+
+            if journal is not None :
+
+                for email in emails :
+
+                    for date in to_list[email] :
+                        journal.record("listing", RunJournal.unit(email, date))
+
+            listed.append(df)
+
+        print(f"\n[*] Listed {len(spans)} span(s) from Graph, {sum(1 for d in to_list.values() if not d)} mailbox(es) served from cache")
+
+    if cache is not None :
+        classified_all = cache.classified(shared_emails, download_dates[0], download_dates[-1])
+
+    else :
+
+        listed = [df for df in listed if not df.is_empty()]
+        classified_all = classify_messages(pl.concat(listed, how="vertical_relaxed")) if listed else None
+
+    inbox_by_date = partition_by_received_date(classified_all)
+
     for date in download_dates :
         
         print(f"\n[*] Donwloading date : {date_to_str(date)}\n")
 
-        inbox_df = pl.DataFrame(schema=schema_overrides)
-
-        for email in shared_emails :
-            
-            df = get_inbox_messages_by_date(date, token, email, with_attach=True)
-
-            if isinstance(df, pl.DataFrame) and not df.is_empty() :
-                inbox_df = pl.concat([inbox_df, df], how="vertical_relaxed")
+        inbox_df = inbox_by_date.get(date)
         
-        if inbox_df.is_empty() :
+        if inbox_df is None or inbox_df.is_empty() :
 
             print(f"\n[-] No inbox data on {date}.")
             continue
         
-        rules_map = split_by_counterparty(inbox_df)
+        rules_map = {key[0] : part for key, part in inbox_df.partition_by("Counterparty", as_dict=True).items()}
 
         # Here we will donwload all the files for seleceted dates
         for counterparty, df_cp in rules_map.items() :
@@ -113,16 +222,20 @@ def main (
             if counterparty == "UNMATCHED" or df_cp.is_empty() :
                 continue
             
-            os.makedirs(raw_dir_abs, exist_ok=True)
-            raw_out = os.path.join(raw_dir_abs, f"{counterparty.lower()}_{date_to_str(date)}.xlsx")
+            if raw_excel :
 
-            try :
-                df_cp.write_excel(raw_out)
-            
-            except Exception as e :
-                print(f"\n[-] Failed writing {raw_out}: {e}")
+                os.makedirs(raw_dir_abs, exist_ok=True)
+                raw_out = os.path.join(raw_dir_abs, f"{counterparty.lower()}_{date_to_str(date)}.xlsx")
+
+                try :
+                    df_cp.select([c for c, dtype in schema_overrides.items() if not isinstance(dtype, pl.List)]).write_excel(raw_out)
+                
+                except Exception as e :
+                    print(f"\n[-] Failed writing {raw_out}: {e}")
+
+            dest = os.path.join(attch_dir_abs, counterparty)
 
-            for row in df_cp.to_dicts() :
+            for row in df_cp.select("Id", "Shared Email", "Attachments Meta", "Counterparty Files").to_dicts() :
 
                 msg_id = row.get("Id")
                 origin = row.get("Shared Email")
@@ -130,35 +243,99 @@ def main (
                 if not msg_id :
                     continue
 
-                try :
+                # Only the attachments the classifier assigned to the counterparty, when the listing expanded them
+                attachments = select_attachments(row.get("Attachments Meta"), names=row.get("Counterparty Files"))
 
-                    dest = os.path.join(attch_dir_abs, counterparty)
-                    os.makedirs(dest, exist_ok=True)
+                if attachments is not None and not attachments :
+                    continue
 
-                    # avoid re-writing if same file already exists
-                    download_attachments_for_message(msg_id, token, dest, origin)
+                downloads.append(DownloadJob(msg_id, origin, dest, counterparty, date, attachments))
 
-                except Exception as e :
-                    print(f"\n[-] Attachment download failed for {counterparty} {date}: {e}")
+    # Attachments already in the manifest are linked into place without a network call
+    manifest = AttachmentManifest() if ATTACHMENT_MANIFEST_ABS_PATH and ATTACHMENT_STORE_DIR_ABS_PATH else None
+
+    def download_unit (job : DownloadJob) -> str :
+        return RunJournal.unit(job.mailbox, job.message_id, job.counterparty)
+
+    def checkpoint (result : Dict) -> None :
+        journal.record("download", download_unit(result["job"]), result["error"])
+
+    if journal is not None and resume :
+
+        downloaded = journal.done_units("download")
+        downloads = [job for job in downloads if download_unit(job) not in downloaded]
+
+    summary = download_jobs(
+
+        downloads, max_workers=workers, token=token, batch=batch, stream=stream, manifest=manifest,
+        on_result=checkpoint if journal is not None else None
+
+    )
+    print_download_summary(summary)
+
+    stats = get_graph_client().scheduler.stats()
+    print(
+        f"\n[*] Graph : {stats['requests']} requests, {stats['retries']} retries, "
+        f"{stats['throttled']} throttled, {stats['wait_seconds']:.1f}s waited (in-flight limit {stats['limit']})"
+    )
+
+    if manifest is not None :
+        manifest.close()
 
 
     # Here we normally have already donwload all email / files 
+    if token_provider is not None :
+        token_provider.stop_background_refresh()
         
-    trades_by_date = {}
+    # Every (date, fund, counterparty) report is an independent parse job; the structure is
+    # laid out first so the export keeps its order whatever order the jobs finish in
+    trades_by_date = {date : {fundation : {ctpy : None for ctpy in counterparties} for fundation in fundations} for date in asked_dates}
+    to_parse : List[ParseJob] = []
 
     for date in asked_dates :
 
-        trades = {}
-
         for fundation in fundations :
 
-            trades[fundation] = {
+            for ctpy in counterparties :
+
+                unit = RunJournal.unit(ctpy, date, fundation)
+
+                if journal is not None and resume and journal.is_done("parse", unit) :
+
+                    frames = journal.load_frames(unit)
 
-                ctpy : func(date, fundation)
-                for ctpy, func in counterparties.items()
-            }
+                    if frames is not None :
 
-        trades_by_date[date] = trades
+                        trades_by_date[date][fundation][ctpy] = frames
+                        continue
+
+                to_parse.append(ParseJob(ctpy, date, fundation))
+
+    def parsed (result : Dict) -> None :
+
+        job = result["job"]
+        unit = RunJournal.unit(job.counterparty, job.date, job.fundation)
+
+        if result["error"] is not None :
+
+            print(f"\n[-] Parsing failed for {job.counterparty} {date_to_str(job.date)} {job.fundation}: {result['error']}")
+
+            if journal is not None :
+                journal.record("parse", unit, result["error"])
+
+            return
+
+        trades_by_date[job.date][job.fundation][job.counterparty] = result["frames"]
+
+        if journal is not None :
+            journal.save_frames("parse", unit, result["frames"])
+
+    parse_summary = parse_jobs(to_parse, counterparties, max_workers=jobs, on_result=parsed)
+
+    print(
+        f"\n[*] Parsing : {parse_summary['ok']}/{parse_summary['jobs']} reports ok, {parse_summary['failed']} failed "
+        f"in {parse_summary['elapsed']:.1f}s ({parse_summary['workers']} process(es))"
+    )
 
     
     out_path = export_trade_reconciliation(trades_by_date=trades_by_date, asked_dates=asked_dates, output_dir=data_dir_abs,)
@@ -166,6 +343,22 @@ def main (
 
     save_trades_by_date_parquet(trades_by_date, cache_dir_abs)
 
+    if journal is not None :
+
+        report = journal.summary()
+        failed = sum(statuses.get("failed", 0) for statuses in report.values())
+
+        print(
+            "\n[*] Journal : " + ", ".join(
+                f"{kind} {statuses.get('done', 0)} done / {statuses.get('failed', 0)} failed" for kind, statuses in sorted(report.items())
+            )
+        )
+
+        if failed :
+            print("[-] Some units failed, rerun with --resume to retry only those.")
+
+        journal.close()
+
     return trades_by_date
 
 
@@ -194,6 +387,46 @@ if __name__ == "__main__" :
         "--fund", required=False, default=None, help="Fundation name initials."
     )
 
+    parser.add_argument(
+        "--workers", type=int, required=False, default=None, help="Concurrent attachment downloads (default: DOWNLOAD_WORKERS)"
+    )
+
+    parser.add_argument(
+        "--no-batch", action="store_true", required=False, help="Download message by message instead of through Graph $batch"
+    )
+
+    parser.add_argument(
+        "--delta", action="store_true", required=False, help="Incremental mailbox sync: only list mail added since the last run (needs the message cache)"
+    )
+
+    parser.add_argument(
+        "--chunk-days", type=int, required=False, default=None, help="Split the mailbox listing in chunks of N days (default: INBOX_CHUNK_DAYS, 0 = whole span)"
+    )
+
+    parser.add_argument(
+        "--stream", action="store_true", required=False, help="Stream attachments to disk through /$value instead of base64 JSON"
+    )
+
+    parser.add_argument(
+        "--refresh", action="store_true", required=False, help="Re-list the mailboxes even for days already in the message cache"
+    )
+
+    parser.add_argument(
+        "--raw-excel", action="store_true", required=False, help="Also dump the classified mail per counterparty and day to RAW_DIR as Excel"
+    )
+
+    parser.add_argument(
+        "--resume", action="store_true", required=False, help="Continue an interrupted run: skip the listings, downloads and parses already journaled as done"
+    )
+
+    parser.add_argument(
+        "--jobs", type=int, required=False, default=None, help="Parse the (date, fund, counterparty) reports on N processes (default: PARSE_JOBS)"
+    )
+
+    parser.add_argument(
+        "--counterparties", nargs="+", required=False, default=None, choices=list(PARSERS), help="Only parse these counterparties"
+    )
+
     args = parser.parse_args()
 
     main(
@@ -201,6 +434,16 @@ if __name__ == "__main__" :
         start_date=args.start_date,
         end_date=args.end_date,
         fundations=args.fund,
-        yesterday=args.yesterday
+        yesterday=args.yesterday,
+        workers=args.workers,
+        batch=False if args.no_batch else None,
+        delta=args.delta,
+        chunk_days=args.chunk_days,
+        stream=True if args.stream else None,
+        refresh=args.refresh,
+        raw_excel=True if args.raw_excel else None,
+        resume=args.resume,
+        jobs=args.jobs,
+        counterparties=args.counterparties,
     )
     
\ No newline at end of file
@@ -7,6 +7,19 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+
+def _env_str (name : str) -> str :
+    return (os.getenv(name) or "").strip()
+
+
+def _env_set (name : str, sep : str = ";") -> set :
+    return {e.strip() for e in (os.getenv(name) or "").split(sep) if e.strip()}
+
+
+def _env_list (name : str, sep : str = ";") -> list :
+    return [e.strip() for e in (os.getenv(name) or "").split(sep) if e.strip()]
+
+
 # -------- Application settings and values --------
 
 APPLICATION_ID=os.getenv("APPLICATION_ID")
@@ -19,11 +32,57 @@ SECRET_ID=os.getenv("SECRET_ID")
 
 # -------- Permissions + Scopes --------
 
-GRAPH_BASE = "https://graph.microsoft.com/v1.0"
+GRAPH_BASE = os.getenv("GRAPH_BASE", "https://graph.microsoft.com/v1.0")
 SCOPES = ["https://graph.microsoft.com/.default"]
+
+# HTTP connection pool shared by every Graph call (connections kept alive)
+GRAPH_POOL_SIZE = int(os.getenv("GRAPH_POOL_SIZE", "16"))
+GRAPH_TIMEOUT = float(os.getenv("GRAPH_TIMEOUT", "60"))
+
+# Throttling-aware scheduling: retries with Retry-After / jittered exponential backoff,
+# in-flight requests adapted with AIMD between 1 and GRAPH_MAX_IN_FLIGHT
+GRAPH_MAX_IN_FLIGHT = int(os.getenv("GRAPH_MAX_IN_FLIGHT", str(GRAPH_POOL_SIZE)))
+GRAPH_AIMD_STEP = float(os.getenv("GRAPH_AIMD_STEP", "1"))
+GRAPH_MAX_RETRIES = int(os.getenv("GRAPH_MAX_RETRIES", "6"))
+GRAPH_BACKOFF_BASE = float(os.getenv("GRAPH_BACKOFF_BASE", "1"))
+GRAPH_BACKOFF_MAX = float(os.getenv("GRAPH_BACKOFF_MAX", "60"))
+
+# Inbox listing page size ($top) and server-side counterparty pre-filter
+# (senders are only filtered for rules with explicit domains, see msal.build_counterparty_filter)
+GRAPH_PAGE_SIZE = int(os.getenv("GRAPH_PAGE_SIZE", "250"))
+INBOX_SERVER_FILTER = os.getenv("INBOX_SERVER_FILTER", "true").strip().lower() in ("1", "true", "yes")
+
+# Inbox listings over a date range: days per query (0 = one query for the whole span)
+INBOX_CHUNK_DAYS = int(os.getenv("INBOX_CHUNK_DAYS", "0"))
+
+# Graph JSON $batch accepts at most 20 sub-requests per call
+GRAPH_BATCH_LIMIT = 20
+
+# Stream file attachments through /$value (metadata-only listings) instead of base64 JSON
+ATTACHMENT_STREAM = os.getenv("ATTACHMENT_STREAM", "false").strip().lower() in ("1", "true", "yes")
+ATTACHMENT_CHUNK_SIZE = int(os.getenv("ATTACHMENT_CHUNK_SIZE", str(1 << 20)))
+
+# Number of attachment downloads in flight at once
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "8"))
+
+# Group attachment listings/fetches of several messages into Graph $batch calls
+DOWNLOAD_BATCH = os.getenv("DOWNLOAD_BATCH", "true").strip().lower() in ("1", "true", "yes")
+
+# Parallel parse processes, one (date, fund, counterparty) report per task (1 = serial, in process)
+PARSE_JOBS = int(os.getenv("PARSE_JOBS", "1"))
+
 AUTHORITY = f"https://login.microsoftonline.com/{TENANT_ID}"
 
 
+# -------- Token cache --------
+
+# Optional on-disk MSAL cache so short cron runs can skip the auth round trip
+TOKEN_CACHE_ABS_PATH = os.getenv("TOKEN_CACHE_ABS_PATH")
+
+# Seconds before `expires_in` at which a cached token is considered stale
+TOKEN_REFRESH_MARGIN = int(os.getenv("TOKEN_REFRESH_MARGIN", "300"))
+
+
 # -------- Shared emails --------
 
 SHARED_MAIL_1=os.getenv("SHARED_MAIL_1")
@@ -62,7 +121,26 @@ EMAIL_COLUMNS = {
     "From" : pl.Utf8,
     "Received DateTime" : pl.Utf8,#pl.Datetime,
     "Attachments" : pl.Boolean,
-    "Shared Email" : pl.Utf8
+    "Shared Email" : pl.Utf8,
+
+    # Expanded attachment metadata (null when the listing did not $expand attachments)
+    "Attachments Meta" : pl.List(
+
+        pl.Struct(
+            {
+                "id" : pl.Utf8,
+                "name" : pl.Utf8,
+                "contentType" : pl.Utf8,
+                "size" : pl.Int64,
+                "isInline" : pl.Boolean,
+                "odataType" : pl.Utf8,
+            }
+        )
+
+    ),
+
+    # Names of the non-inline attachments (null when the listing did not $expand attachments)
+    "Attachment Names" : pl.List(pl.Utf8),
 
 }
 
@@ -84,9 +162,9 @@ FREQUENCY_DATE_MAP = {
 # MS
 MS = {
 
-    "emails": {e.strip() for e in os.getenv("MS_EMAILS").split(";") if e.strip()},
-    "subject": os.getenv("MS_SUBJECT_WORDS").strip(),
-    "filenames": {f.strip() for f in os.getenv("MS_FILENAMES").split(";") if f.strip()},
+    "emails": _env_set("MS_EMAILS"),
+    "subject": _env_str("MS_SUBJECT_WORDS"),
+    "filenames": _env_set("MS_FILENAMES"),
 
 }
 
@@ -115,9 +193,9 @@ MS_ACCOUNTS = {
 # GS
 GS = {
 
-    "emails": {e.strip() for e in os.getenv("GS_EMAILS").split(";") if e.strip()},
-    "subject": os.getenv("GS_SUBJECT_WORDS").strip(),
-    "filenames": {f.strip() for f in os.getenv("GS_FILENAMES").split(";") if f.strip()}
+    "emails": _env_set("GS_EMAILS"),
+    "subject": _env_str("GS_SUBJECT_WORDS"),
+    "filenames": _env_set("GS_FILENAMES")
 
 }
 
@@ -144,17 +222,19 @@ GS_REQUIRED_COLUMNS = {
 
 }
 
-GS_STOCKS = [os.getenv("GS_FX"), os.getenv("GS_EQ")]
+# Unset stocks are left out (a None rule would match every file)
+GS_STOCKS = [stock for stock in (os.getenv("GS_FX"), os.getenv("GS_EQ")) if stock]
 
 GS_STOCKS_SHEETS = {
 
-    os.getenv("GS_FX") :  [e.strip() for e in os.getenv("GS_FX_SHEETS").split(";") if e.strip()],
-    os.getenv("GS_EQ") :  [e.strip() for e in os.getenv("GS_EQ_SHEETS").split(";") if e.strip()]
+    stock : sheets for stock, sheets in (
+        (os.getenv("GS_FX"), _env_list("GS_FX_SHEETS")),
+        (os.getenv("GS_EQ"), _env_list("GS_EQ_SHEETS")),
+    )
+    if stock
 
 }
 
-print(GS_STOCKS_SHEETS)
-
 GS_FILENAMES = os.getenv("GS_FILENAMES")
 GS_ENTITY = os.getenv("GS_ENTITY")
 
@@ -170,9 +250,9 @@ GS_ATTACHMENT_DIR_ABS_PATH = os.getenv("GS_ATTACHMENT_DIR_ABS_PATH")
 # SAXO
 SAXO = {
 
-    "emails": {e.strip() for e in os.getenv("SAXO_EMAILS").split(";") if e.strip()},
-    "subject": os.getenv("SAXO_SUBJECT_WORDS").strip(),
-    "filenames": {f.strip() for f in os.getenv("SAXO_FILENAMES").split(";") if f.strip()}
+    "emails": _env_set("SAXO_EMAILS"),
+    "subject": _env_str("SAXO_SUBJECT_WORDS"),
+    "filenames": _env_set("SAXO_FILENAMES")
 
 }
 
@@ -185,9 +265,9 @@ SAXO_ATTACHMENT_DIR_ABS_PATH = os.getenv("SAXO_ATTACHMENT_DIR_ABS_PATH")
 # UBS
 UBS = {
 
-    "emails": {e.strip() for e in os.getenv("UBS_EMAILS").split(";") if e.strip()},
-    "subject": os.getenv("UBS_SUBJECT_WORDS").strip(),
-    "filenames": {f.strip() for f in os.getenv("UBS_FILENAMES").split(";") if f.strip()}
+    "emails": _env_set("UBS_EMAILS"),
+    "subject": _env_str("UBS_SUBJECT_WORDS"),
+    "filenames": _env_set("UBS_FILENAMES")
 
 }
 
@@ -204,13 +284,18 @@ UBS_ATTACHMENT_DIR_ABS_PATH = os.getenv("UBS_ATTACHMENT_DIR_ABS_PATH")
 
 UBS_FILENAMES = os.getenv("UBS_FILENAMES")
 
-# Counterparties
+# Counterparties (mail classification rules; one without any configured rule is left out)
 COUNTERPARTIES = {
 
-    "MS" : MS,
-    "GS" : GS,
-    "SAXO" : SAXO,
-    "UBS" : UBS
+    name : rule for name, rule in {
+
+        "MS" : MS,
+        "GS" : GS,
+        "SAXO" : SAXO,
+        "UBS" : UBS
+
+    }.items()
+    if rule["emails"] or rule["subject"] or rule["filenames"]
 
 }
 
@@ -219,6 +304,42 @@ ATTACHMENT_DIR_ABS_PATH = os.getenv("ATTACHMENT_DIR_ABS_PATH")
 DATA_DIR_ABS_PATH = os.getenv("DATA_DIR_ABS_PATH")
 CACHE_DIR_ABS_PATH = os.getenv("CACHE_DIR_ABS_PATH")
 
+# Download manifest (SQLite) and content-addressed attachment store
+ATTACHMENT_MANIFEST_ABS_PATH = os.getenv("ATTACHMENT_MANIFEST_ABS_PATH") or (
+    os.path.join(ATTACHMENT_DIR_ABS_PATH, ".manifest.sqlite") if ATTACHMENT_DIR_ABS_PATH else None
+)
+ATTACHMENT_STORE_DIR_ABS_PATH = os.getenv("ATTACHMENT_STORE_DIR_ABS_PATH") or (
+    os.path.join(ATTACHMENT_DIR_ABS_PATH, ".store") if ATTACHMENT_DIR_ABS_PATH else None
+)
+
+# Persisted Graph deltaLinks (one per shared mailbox folder) for incremental sync
+DELTA_STATE_DIR_ABS_PATH = os.getenv("DELTA_STATE_DIR_ABS_PATH") or (
+    os.path.join(CACHE_DIR_ABS_PATH, "delta") if CACHE_DIR_ABS_PATH else None
+)
+
+# Append-only Parquet cache of listed messages + their counterparty assignment
+MESSAGE_CACHE_DIR_ABS_PATH = os.getenv("MESSAGE_CACHE_DIR_ABS_PATH") or (
+    os.path.join(CACHE_DIR_ABS_PATH, "messages") if CACHE_DIR_ABS_PATH else None
+)
+MESSAGE_CACHE_MAX_PARTS = int(os.getenv("MESSAGE_CACHE_MAX_PARTS", "64"))
+
+# Run journal (SQLite) + persisted parse results, used by `--resume`
+RUN_JOURNAL_ABS_PATH = os.getenv("RUN_JOURNAL_ABS_PATH") or (
+    os.path.join(CACHE_DIR_ABS_PATH, "journal", "journal.sqlite") if CACHE_DIR_ABS_PATH else None
+)
+
+# Parquet cache of parsed broker files, keyed by (path, size, mtime, parser version)
+PARSE_CACHE_DIR_ABS_PATH = os.getenv("PARSE_CACHE_DIR_ABS_PATH") or (
+    os.path.join(CACHE_DIR_ABS_PATH, "parsed") if CACHE_DIR_ABS_PATH else None
+)
+PARSE_CACHE_MAX_MB = float(os.getenv("PARSE_CACHE_MAX_MB", "1024"))
+
+# Excel readers tried in order (see src/readers.py) : "calamine" (Rust, through pl.read_excel) then "pandas"
+EXCEL_ENGINES = [e.strip() for e in os.getenv("EXCEL_ENGINES", "calamine;pandas").split(";") if e.strip()]
+
+# Per counterparty / day Excel dumps of the classified mail (a debugging view, off by default)
+RAW_EXCEL_DUMPS = os.getenv("RAW_EXCEL_DUMPS", "false").strip().lower() in ("1", "true", "yes")
+
 
 # Forex Pairs
 PAIRS = ["EURUSD=X", "EURCHF=X", "EURGBP=X", "EURJPY=X", "EURAUD=X"]
\ No newline at end of file
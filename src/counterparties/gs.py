@@ -2,14 +2,19 @@ from __future__ import annotations
 
 import os
 import polars as pl
-import pandas as pd
 import datetime as dt
 
-from PyPDF2 import PdfReader
-from typing import Optional, Dict, Tuple
+from typing import Optional, Dict, Tuple, List
 
 from src.config import *
 from src.utils import date_to_str, str_to_date, get_full_name_fundation
+from src.file_index import get_file_index
+from src.parse_cache import get_parse_cache
+from src.readers import read_excel_sheets, truncate_at_first_null, apply_schema
+
+
+# Bump when the parsed output of this module changes (invalidates the parse cache)
+PARSER_VERSION = 3
 
 
 def gs_trades (
@@ -43,7 +48,7 @@ def gs_trades (
     dir_abs_path = GS_ATTACHMENT_DIR_ABS_PATH if dir_abs_path is None else dir_abs_path
     os.makedirs(dir_abs_path, exist_ok=True)
 
-    dataframes = process_file(date, fundation, filenames, dir_abs_path)
+    dataframes = process_file(date, fundation, filenames, dir_abs_path, schema_overrides=schema_overrides)
     
     return dataframes
 
@@ -67,7 +72,6 @@ def find_files_by_date_n_fundation (
     """
 
     date_obj = str_to_date(date)
-    date_format = date_to_str(date, d_format)
 
     dir_abs_path = GS_ATTACHMENT_DIR_ABS_PATH if dir_abs_path is None else dir_abs_path
     rules = GS_STOCKS if rules is None else rules
@@ -76,17 +80,14 @@ def find_files_by_date_n_fundation (
     fund_words = [w for w in full_fundation.upper().split() if w]
 
     filenames = {}
+    index = get_file_index()
 
     for rule in rules :
 
-        for entry in os.listdir(dir_abs_path) :
-
-            if date_format in entry and rule in entry : # and fund_words[0] in entry :
+        for entry in index.lookup(dir_abs_path, date_obj, d_format, tokens=[rule], extensions=extensions) : # and fund_words[0] in entry :
 
-                if entry.lower().endswith(extensions) : 
-
-                    print(f"\n[+] [GS] File found for {date} and for {full_fundation} : {entry}")
-                    filenames[rule] = os.path.join(dir_abs_path, entry)
+            print(f"\n[+] [GS] File found for {date} and for {full_fundation} : {entry}")
+            filenames[rule] = os.path.join(dir_abs_path, entry)
           
     return filenames
 
@@ -99,7 +100,7 @@ def process_file (
         filenames : Optional[str] = None,
         dir_abs_path : Optional[str] = None,
 
-        #schema_overrides : Optional[Dict] = None,
+        schema_overrides : Optional[Dict] = None,
         stocks_sheets : Optional[Dict] = None,
         skip_rows : int = 2
 
@@ -111,7 +112,7 @@ def process_file (
     date = str_to_date(date)
     
     dir_abs_path = GS_ATTACHMENT_DIR_ABS_PATH if dir_abs_path is None else dir_abs_path
-    #schema_overrides = GS_REQUIRED_COLUMNS if schema_overrides is None else schema_overrides
+    schema_overrides = GS_REQUIRED_COLUMNS if schema_overrides is None else schema_overrides
     stocks_sheets = GS_STOCKS_SHEETS if stocks_sheets is None else stocks_sheets
 
     filenames = find_files_by_date_n_fundation(date, fundation ) if filenames is None else filenames
@@ -122,34 +123,65 @@ def process_file (
     #full_path = os.path.join(dir_abs_path, filenames)
     #dfs = {stock : [] for stock in stocks_sheets.keys()}
     dfs = []
+    cache = get_parse_cache()
 
     for stock, filename in filenames.items() :
         
-        sheets = stocks_sheets.get(stock)
+        sheets = stocks_sheets.get(stock) or []
 
-        for sheet in sheets :
+        try :
+            # Every sheet of the workbook in one open / decode (cached sheets are not read again)
+            frames = cache.load_many(
+                filename, "gs", PARSER_VERSION, list(sheets),
+                lambda missing : _read_sheets(filename, stock, missing, skip_rows, schema_overrides),
+                skip_rows=skip_rows, schema=schema_overrides,
+            )
 
-            try :
-                dataframe = pd.read_excel(filename, sheet_name=sheet, skiprows=skip_rows, engine="xlrd", dtype=str) #, usecols=)
+        except Exception as e :
 
-                mask_account_nan = dataframe["Account"].isna()
+            print(f"Error processing file for stock {stock} : {e}")
+            continue
 
-                if mask_account_nan.any() :
+        # Sheets hold different subsets of the required columns: only report the ones no sheet has
+        found = {c for df in frames.values() for c in df.columns}
+        absent = [c for c in schema_overrides if c not in found]
 
-                    first_nan_position = mask_account_nan.to_numpy().argmax()
-                    dataframe = dataframe.iloc[:first_nan_position]
-                
-                dataframe = pl.from_pandas(dataframe, include_index=False)  #, schema_overrides=schema_overrides)
-                dataframe = dataframe.slice(1)  # drop first row
-                
-                dfs.append(dataframe)
+        if frames and absent :
+            print(f"[-] [GS] {stock} : missing column(s) {', '.join(absent)}")
 
-            except Exception as e :
-
-                print(f"Error processing file for stock {stock} : {e}")
-                continue
+        dfs.extend(frames.values())
     
     return dfs
 
 
+def _read_sheets (
+
+        filename : str,
+        stock : str,
+        sheets : List[str],
+        skip_rows : int = 2,
+        schema_overrides : Optional[Dict] = None,
 
+    ) -> Dict[str, pl.DataFrame] :
+    """
+    Position sheets of one workbook, each cut at the first row without an Account (the footer),
+    header row dropped, then projected on the required columns with their dtypes.
+    """
+    schema = {"Account" : pl.Utf8, **(GS_REQUIRED_COLUMNS if schema_overrides is None else schema_overrides)}
+
+    # Read as text: the row under the header holds labels in numeric columns
+    raw = read_excel_sheets(filename, sheets, header_row=skip_rows, as_str=True, columns=list(schema))
+    dataframes = {}
+
+    for sheet, dataframe in raw.items() :
+
+        try :
+            dataframe = truncate_at_first_null(dataframe, "Account").slice(1)  # drop first row
+            dataframes[sheet] = apply_schema(dataframe, schema, label=f"[GS] {stock} {sheet}", fill_missing=False)
+
+        except Exception as e :
+
+            print(f"Error processing file for stock {stock} : {e}")
+            continue
+
+    return dataframes
@@ -2,14 +2,19 @@ from __future__ import annotations
 
 import os
 import polars as pl
-import pandas as pd
 import datetime as dt
 
-from PyPDF2 import PdfReader
 from typing import Optional, Dict, Tuple
 
 from src.config import *
 from src.utils import date_to_str, str_to_date, get_full_name_fundation
+from src.file_index import get_file_index
+from src.parse_cache import get_parse_cache
+from src.readers import read_excel_sheet
+
+
+# Bump when the parsed output of this module changes (invalidates the parse cache)
+PARSER_VERSION = 2
 
 
 def ms_trades (
@@ -61,25 +66,23 @@ def find_files_by_date_n_fundation (
     """
 
     date_obj = date_to_str(date)
-    date_format = date_to_str(date, d_format)
 
     dir_abs_path = MS_ATTACHMENT_DIR_ABS_PATH if dir_abs_path is None else dir_abs_path
     rules = MS_FILENAMES if rules is None else rules
 
     full_fundation = get_full_name_fundation(fundation)
-    account = MS_ACCOUNTS.get(fundation, "HV")
+    account = MS_ACCOUNTS.get(fundation)
 
-    entries = []
-    
-    for entry in os.listdir(dir_abs_path) :
+    # Without its account the fund would pick up every account's files
+    if not account :
 
-        if "Collateral" in entry :
-            continue
-
-        if rules in entry and account in entry and date_format in entry :
+        print(f"\n[-] [MS] No account configured for {full_fundation} (set MS_ACCOUNT_{fundation}), skipped")
+        return []
 
-            print(f"\n[+] [MS] File found for {date_obj} and for {full_fundation} : {entry}")
-            entries.append(entry)
+    entries = get_file_index().lookup(dir_abs_path, date_obj, d_format, tokens=[rules, account], exclude=["Collateral"])
+    
+    for entry in entries :
+        print(f"\n[+] [MS] File found for {date_obj} and for {full_fundation} : {entry}")
             
     return entries
 
@@ -109,12 +112,14 @@ def process_file (
 
     for full_path in full_paths :
         
-        dataframe = pd.read_excel(full_path)
+        dataframe = get_parse_cache().load(
+            full_path, "ms", PARSER_VERSION,
+            lambda : read_excel_sheet(full_path),
+        )
 
         if dataframe is None :
             continue
         
-        dataframe = pl.from_pandas(dataframe)
         dataframes.append(dataframe)
 
     return dataframes
@@ -2,14 +2,18 @@ from __future__ import annotations
 
 import os
 import polars as pl
-import pandas as pd
 import datetime as dt
 
-from PyPDF2 import PdfReader
 from typing import Optional, Dict, Tuple
 
 from src.config import *
 from src.utils import date_to_str, str_to_date, get_full_name_fundation
+from src.file_index import get_file_index
+from src.parse_cache import get_parse_cache
+
+
+# Bump when the parsed output of this module changes (invalidates the parse cache)
+PARSER_VERSION = 1
 
 
 def saxo_trades (
@@ -64,21 +68,16 @@ def find_files_by_date_n_fundation (
     """
 
     date = date_to_str(date)
-    date_format = date_to_str(date, d_format)
 
     dir_abs_path = SAXO_ATTACHMENT_DIR_ABS_PATH if dir_abs_path is None else dir_abs_path
     rules = SAXO_FILENAMES if rules is None else rules
 
     full_fundation = get_full_name_fundation(fundation)
 
-    entries = []
+    entries = get_file_index().lookup(dir_abs_path, date, d_format, tokens=[rules])
     
-    for entry in os.listdir(dir_abs_path) :
-
-        if rules in entry and date_format in entry :
-
-            print(f"\n[+] [SAXO] File found for {date} and for {full_fundation} : {entry}")
-            entries.append(entry)
+    for entry in entries :
+        print(f"\n[+] [SAXO] File found for {date} and for {full_fundation} : {entry}")
             
     return entries
 
@@ -110,7 +109,11 @@ def process_file (
 
     for full_path in full_paths :
         
-        dataframe = pl.read_csv(full_path, separator=separator)
+        dataframe = get_parse_cache().load(
+            full_path, "saxo", PARSER_VERSION,
+            lambda : pl.read_csv(full_path, separator=separator),
+            separator=separator,
+        )
 
         if dataframe is None :
             continue
@@ -2,13 +2,19 @@ from __future__ import annotations
 
 import os
 import polars as pl
-import pandas as pd
 import datetime as dt
 
 from typing import Optional, Dict, Tuple, List
 
 from src.config import *
 from src.utils import date_to_str, str_to_date, get_full_name_fundation
+from src.file_index import get_file_index
+from src.parse_cache import get_parse_cache
+from src.readers import read_csv_typed
+
+
+# Bump when the parsed output of this module changes (invalidates the parse cache)
+PARSER_VERSION = 2
 
 
 def ubs_trades (
@@ -69,14 +75,12 @@ def find_files_by_date_n_fundation (
 
     full_fundation = get_full_name_fundation(fundation)
 
-    for entry in os.listdir(dir_abs_path) :
+    entries = get_file_index().lookup(dir_abs_path, str_to_date(date, d_format), d_format, tokens=[rules], extensions=extensions)
 
-        if entry.lower().endswith(extensions) and rules in entry :
-            
-            if date in entry :
+    for entry in entries :
 
-                print(f"\n[+] [UBS] File found for {date} and for {full_fundation} : {entry}")
-                return entry
+        print(f"\n[+] [UBS] File found for {date} and for {full_fundation} : {entry}")
+        return entry
             
     return None
 
@@ -109,7 +113,15 @@ def process_file (
     
     full_path = os.path.join(dir_abs_path, filename)
 
-    dataframe = pl.read_csv(full_path, has_header=True, truncate_ragged_lines=True)
+    # Only the required columns are parsed, typed on the fly (mismatches are reported)
+    dataframe = get_parse_cache().load(
+        full_path, "ubs", PARSER_VERSION,
+        lambda : read_csv_typed(
+            full_path, schema_overrides, skip_rows, label=f"[UBS] {filename}",
+            has_header=True, truncate_ragged_lines=True,
+        ),
+        schema=schema_overrides, skip_rows=skip_rows,
+    )
 
     return dataframe
 
@@ -0,0 +1,291 @@
+from __future__ import annotations
+
+import os
+import time
+import datetime as dt
+
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, List, Optional, Any, Iterable, Callable
+
+from src.config import DOWNLOAD_WORKERS, DOWNLOAD_BATCH, GRAPH_BATCH_LIMIT
+from src.msal import (
+
+    GraphClient, get_graph_client,
+    download_attachments_for_message, download_attachments_for_messages, download_streamed_attachment,
+
+)
+from src.manifest import AttachmentManifest
+
+
+@dataclass(frozen=True)
+class DownloadJob :
+    """
+    One message whose attachments must land in `out_dir`.
+    """
+    message_id : str
+    mailbox : str
+    out_dir : str
+
+    counterparty : Optional[str] = None
+    date : Optional[dt.date] = None
+
+    # Expanded attachment metadata to fetch (None: list the message's attachments)
+    attachments : Optional[List[Dict[str, Any]]] = None
+
+
+def _run_job (
+        
+        job : DownloadJob,
+        token : Optional[str] = None,
+        client : Optional[GraphClient] = None,
+        stream : Optional[bool] = None,
+        manifest : Optional[AttachmentManifest] = None,
+    
+    ) -> Dict[str, Any] :
+    """
+    Download a single job and report its outcome instead of raising.
+    Attachments to stream are left in "deferred" (see `_run_stream`).
+    """
+    start = time.perf_counter()
+    deferred : List[Dict[str, Any]] = []
+
+    try :
+
+        os.makedirs(job.out_dir, exist_ok=True)
+        saved = download_attachments_for_message(
+
+            job.message_id, token, job.out_dir, job.mailbox,
+            client=client, stream=stream, manifest=manifest, attachments=job.attachments, deferred=deferred
+        
+        )
+
+        return {"job" : job, "saved" : saved or [], "deferred" : deferred, "error" : None, "elapsed" : time.perf_counter() - start}
+    
+    except Exception as e :
+        return {"job" : job, "saved" : [], "deferred" : [], "error" : f"{type(e).__name__}: {e}", "elapsed" : time.perf_counter() - start}
+
+
+def _run_stream (
+        
+        job : DownloadJob,
+        att : Dict[str, Any],
+        token : Optional[str] = None,
+        client : Optional[GraphClient] = None,
+        manifest : Optional[AttachmentManifest] = None,
+    
+    ) -> Dict[str, Any] :
+    """
+    Stream one attachment of a job and report its outcome instead of raising.
+    """
+    try :
+
+        saved = download_streamed_attachment(job.message_id, att, job.out_dir, job.mailbox, token, client=client, manifest=manifest)
+        return {"job" : job, "attachment" : att, "saved" : saved, "error" : None}
+    
+    except Exception as e :
+        return {"job" : job, "attachment" : att, "saved" : [], "error" : f"{type(e).__name__}: {e}"}
+
+
+def _run_batch (
+        
+        jobs : List[DownloadJob],
+        token : Optional[str] = None,
+        client : Optional[GraphClient] = None,
+        stream : Optional[bool] = None,
+        manifest : Optional[AttachmentManifest] = None,
+    
+    ) -> List[Dict[str, Any]] :
+    """
+    Download a group of jobs (at most one $batch of listings) and report each job's outcome.
+    """
+    start = time.perf_counter()
+
+    try :
+        by_message = download_attachments_for_messages(
+
+            [(job.message_id, job.mailbox, job.out_dir) for job in jobs],
+            token=token,
+            client=client,
+            stream=stream,
+            manifest=manifest,
+            defer_streams=True
+
+        )
+    
+    except Exception as e :
+
+        error = f"{type(e).__name__}: {e}"
+        elapsed = time.perf_counter() - start
+
+        return [{"job" : job, "saved" : [], "deferred" : [], "error" : error, "elapsed" : elapsed} for job in jobs]
+
+    elapsed = time.perf_counter() - start
+    results = []
+
+    for job in jobs :
+
+        outcome = by_message.get((job.mailbox, job.message_id)) or {"saved" : [], "deferred" : [], "error" : "missing batch response"}
+        results.append({"job" : job, "saved" : outcome["saved"], "deferred" : outcome["deferred"], "error" : outcome["error"], "elapsed" : elapsed})
+
+    return results
+
+
+def download_jobs (
+        
+        jobs : Iterable[DownloadJob],
+        max_workers : Optional[int] = None,
+
+        token : Optional[str] = None,
+        client : Optional[GraphClient] = None,
+
+        batch : Optional[bool] = None,
+        stream : Optional[bool] = None,
+        manifest : Optional[AttachmentManifest] = None,
+        on_result : Optional[Callable[[Dict[str, Any]], None]] = None,
+    
+    ) -> Dict[str, Any] :
+    """
+    Run every download job on a bounded thread pool (downloads are I/O bound).
+    With `batch`, jobs are grouped by GRAPH_BATCH_LIMIT and each group goes through Graph $batch
+    (jobs carrying their attachment metadata skip the listing and run one by one).
+    With `stream`, file attachments are streamed to disk through /$value. Streamed
+    attachments (and file attachments too large to inline) are scheduled on the pool
+    one by one, as soon as their message's listing is known; a job's result is
+    reported once all of them are done.
+    With `manifest`, messages already stored are linked into place before any network call.
+    `on_result` is called (from this thread) with each job's result as soon as it is known.
+
+    Returns a summary with per-job results and the failed jobs with their error.
+    """
+    jobs = list(jobs)
+    max_workers = DOWNLOAD_WORKERS if max_workers is None else max_workers
+    client = get_graph_client() if client is None else client
+    batch = DOWNLOAD_BATCH if batch is None else batch
+
+    start = time.perf_counter()
+    results : List[Dict[str, Any]] = []
+    skipped = 0
+
+    if manifest is not None :
+
+        remaining = []
+
+        for job in jobs :
+
+            ids = None if job.attachments is None else [att.get("id") for att in job.attachments]
+            placed = manifest.place_message(job.mailbox, job.message_id, job.out_dir, ids)
+
+            if placed is None :
+                remaining.append(job)
+                continue
+
+            skipped += 1
+            results.append({"job" : job, "saved" : placed, "error" : None, "elapsed" : 0.0})
+
+            if on_result is not None :
+                on_result(results[-1])
+
+        jobs = remaining
+
+    if batch :
+
+        listed = [job for job in jobs if job.attachments is None]
+
+        tasks = [(_run_batch, listed[i:i + GRAPH_BATCH_LIMIT]) for i in range(0, len(listed), GRAPH_BATCH_LIMIT)]
+        tasks += [(_run_job, job) for job in jobs if job.attachments is not None]
+    
+    else :
+        tasks = [(_run_job, job) for job in jobs]
+
+    def finish (result : Dict[str, Any]) -> None :
+
+        job = result["job"]
+
+        # Only messages downloaded whole are skipped by the next runs
+        if manifest is not None and result["error"] is None and result["deferred"] and job.attachments is None :
+            manifest.mark_message_done(job.mailbox, job.message_id)
+
+        result.pop("deferred", None)
+        results.append(result)
+
+        if on_result is not None :
+            on_result(result)
+
+    if tasks :
+
+        # Jobs waiting for their streamed attachments: (mailbox, message id) -> [result, started, left]
+        waiting : Dict[tuple, list] = {}
+
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool :
+
+            futures = {pool.submit(func, arg, token, client, stream, manifest) for func, arg in tasks}
+
+            while futures :
+
+                done, futures = wait(futures, return_when=FIRST_COMPLETED)
+
+                for future in done :
+
+                    outcome = future.result()
+
+                    if isinstance(outcome, dict) and "attachment" in outcome :
+
+                        entry = waiting[(outcome["job"].mailbox, outcome["job"].message_id)]
+                        result = entry[0]
+
+                        result["saved"].extend(outcome["saved"])
+                        result["error"] = result["error"] or outcome["error"]
+                        entry[2] -= 1
+
+                        if entry[2] == 0 :
+
+                            result["elapsed"] = time.perf_counter() - entry[1]
+                            finish(result)
+
+                        continue
+
+                    for result in (outcome if isinstance(outcome, list) else [outcome]) :
+
+                        job = result["job"]
+
+                        if not result["deferred"] :
+
+                            finish(result)
+                            continue
+
+                        waiting[(job.mailbox, job.message_id)] = [result, time.perf_counter() - result["elapsed"], len(result["deferred"])]
+
+                        futures |= {pool.submit(_run_stream, job, att, token, client, manifest) for att in result["deferred"]}
+
+    errors = [r for r in results if r["error"] is not None]
+
+    summary = {
+
+        "jobs" : len(results),
+        "ok" : len(results) - len(errors),
+        "skipped" : skipped,
+        "failed" : len(errors),
+        "files" : sum(len(r["saved"]) for r in results),
+        "elapsed" : time.perf_counter() - start,
+        "results" : results,
+        "errors" : errors,
+
+    }
+
+    return summary
+
+
+def print_download_summary (summary : Dict[str, Any]) -> None :
+    """
+    Print a short report of a `download_jobs` run.
+    """
+    print(
+        f"\n[*] Downloads : {summary['ok']}/{summary['jobs']} messages ok ({summary['skipped']} from the manifest), "
+        f"{summary['files']} files, {summary['failed']} failed in {summary['elapsed']:.1f}s"
+    )
+
+    for r in summary["errors"] :
+
+        job = r["job"]
+        print(f"\n[-] Attachment download failed for {job.counterparty} {job.date} ({job.message_id}): {r['error']}")
@@ -6,8 +6,6 @@ import datetime as dt
 from typing import Dict, List, Optional, Union, Any
 
 import polars as pl
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment
 
 from src.utils import date_to_str
 
@@ -39,6 +37,8 @@ def write_df (ws, df: pl.DataFrame, start_row: int, start_col: int = 1) -> int :
     """
     Write Polars DF at start_row; return next free row.
     """
+    from openpyxl.styles import Font
+
     if df is None or df.is_empty() :
         
         ws.cell(row=start_row, column=start_col, value="(Empty table - No data yet)")
@@ -80,6 +80,10 @@ def export_trade_reconciliation (
       - one sheet per fundation
       - per date block: title + counterparty sections
     """
+    # openpyxl is only loaded when a workbook is actually written
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, Alignment
+
     os.makedirs(output_dir, exist_ok=True)
     now = date_to_str(dt.datetime.now(), format=format)
 
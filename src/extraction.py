@@ -1,30 +1,47 @@
 from __future__ import annotations
 
 import re
+import json
+import hashlib
 import polars as pl
 
+from dataclasses import dataclass
+
 from src.config import COUNTERPARTIES
 from typing import Dict, List, Optional, Set, Tuple, Iterable
 
 
 # -------------------- Subject pattern --------------------
 
-def _compile_subject_pattern(subject: Iterable[str] | str) -> str:
+_KEYWORD_RX = re.compile(r"\w+(?: \w+)*")
+
+
+def _subject_words(subject: Iterable[str] | str) -> Optional[List[str]]:
     """
-    Return a case-insensitive regex usable by Polars .str.contains().
-    - If `subject` looks like a regex, use it as-is (prefix (?i) if missing).
-    - Else treat as list/semicolon-separated words and add word boundaries for each word.
+    Subject keywords of a rule (semicolon-separated string or iterable),
+    or None when `subject` is a string that looks like a regex.
     """
     if isinstance(subject, str):
         s = subject.strip()
         # looks like a regex if it contains any common meta
         if any(ch in s for ch in r".*+?[]()|{}^$\\"):
-            pat = s or r"^(?!)"
-        else:
-            words = [w.strip() for w in s.split(";") if w.strip()]
-            pat = "|".join(rf"\b{re.escape(w)}\b" for w in words) if words else r"^(?!)"
+            return None
+        return [w.strip() for w in s.split(";") if w.strip()]
+
+    return [str(w).strip() for w in subject if str(w).strip()]
+
+
+def _compile_subject_pattern(subject: Iterable[str] | str) -> str:
+    """
+    Return a case-insensitive regex usable by Polars .str.contains().
+    - If `subject` looks like a regex, use it as-is (prefix (?i) if missing).
+    - Else treat as list/semicolon-separated words and add word boundaries for each word.
+    """
+    words = _subject_words(subject)
+
+    if words is None:
+        pat = subject.strip() or r"^(?!)"
     else:
-        words = [str(w).strip() for w in subject if str(w).strip()]
         pat = "|".join(rf"\b{re.escape(w)}\b" for w in words) if words else r"^(?!)"
 
     if not pat.startswith("(?i)"):
@@ -32,6 +49,27 @@ def _compile_subject_pattern(subject: Iterable[str] | str) -> str:
     return pat
 
 
+def _keyword_form(word: str) -> Optional[str]:
+    """
+    Space-padded, lowercased keyword for the multi-pattern matcher, or None when
+    the word holds non-word characters (it then goes through the regex fallback).
+    """
+    w = word.strip().lower()
+    return f" {w} " if _KEYWORD_RX.fullmatch(w) else None
+
+
+def _keyword_haystack(col: pl.Expr) -> pl.Expr:
+    """
+    Subject in the keyword form: lowercased, punctuation turned into a ' | ' separator,
+    space-padded. A padded keyword found in it is a word-boundary match.
+    """
+    return pl.concat_str(
+        pl.lit(" "),
+        col.str.to_lowercase().str.replace_all(r"[^\w\s]", " | ").str.replace_all(r"\s+", " "),
+        pl.lit(" "),
+    )
+
+
 # -------------------- Rules normalization --------------------
 
 def _normalize_rules(rules: Optional[Dict[str, Dict]]) -> Dict[str, Dict]:
@@ -39,7 +77,7 @@ def _normalize_rules(rules: Optional[Dict[str, Dict]]) -> Dict[str, Dict]:
     Normalize a rules dict:
       - emails/domains lowercased sets
       - derive domains from emails if missing
-      - compile subject pattern to a case-insensitive regex string
+      - compile subject pattern to a case-insensitive regex string (+ keep the keywords)
       - filenames lowercased set
     """
     if not rules:
@@ -54,13 +92,15 @@ def _normalize_rules(rules: Optional[Dict[str, Dict]]) -> Dict[str, Dict]:
         if not domains:
             domains = {e.split("@", 1)[-1] for e in emails if "@" in e}
 
-        subj_pat = _compile_subject_pattern(rule.get("subject", []))
+        subject = rule.get("subject", [])
+        subj_pat = _compile_subject_pattern(subject)
         filenames = {str(f).strip().lower() for f in rule.get("filenames", set()) if str(f).strip()}
 
         out[name] = {
             "emails": emails,
             "domains": domains,
             "subject_re": subj_pat,
+            "subject_words": _subject_words(subject),
             "filenames": filenames,
         }
 
@@ -69,7 +109,7 @@ def _normalize_rules(rules: Optional[Dict[str, Dict]]) -> Dict[str, Dict]:
 
 # -------------------- DataFrame preparation --------------------
 
-def _extract_sender_columns(df: pl.DataFrame) -> pl.DataFrame:
+def _extract_sender_columns(df: pl.DataFrame | pl.LazyFrame) -> pl.DataFrame | pl.LazyFrame:
     """
     Add helper columns:
       _from_lc, _sender_email, _sender_domain, _subject (normalized spaces)
@@ -86,62 +126,38 @@ def _extract_sender_columns(df: pl.DataFrame) -> pl.DataFrame:
               .str.replace_all(r"\s+", " ")
               .alias("_subject"),
         )
+        # One regex pass: no match gives null, i.e. no sender
         .with_columns(
-            pl.when(pl.col("_from_lc").str.contains(email_rx))
-              .then(pl.col("_from_lc").str.extract(email_rx, 1))
-              .otherwise(pl.lit(""))
-              .alias("_sender_email")
+            pl.col("_from_lc").str.extract(email_rx, 1).fill_null("").alias("_sender_email")
         )
         .with_columns(
-            pl.when(pl.col("_sender_email").str.contains("@"))
-              .then(pl.col("_sender_email").str.split_exact("@", 2).struct.field("field_1"))
-              .otherwise(pl.lit(""))
-              .alias("_sender_domain")
+            pl.col("_sender_email").str.split_exact("@", 1).struct.field("field_1").fill_null("").alias("_sender_domain")
         )
     )
 
     return out
 
 
-def _normalize_attachments(df: pl.DataFrame, attachment_column: Optional[str]) -> pl.DataFrame :
+def _normalize_attachments(df: pl.DataFrame | pl.LazyFrame, attachment_column: Optional[str]) -> pl.DataFrame | pl.LazyFrame :
     """
-    Create _files as a lowercased list[str] (empty if none).
+    Create _files as a list[str] of attachment names (null when unknown).
     Works whether the column is already a list or a single string filename.
     """
-    if attachment_column and attachment_column in df.columns :
+    schema = df.collect_schema()
+
+    if attachment_column and attachment_column in schema :
 
         col = pl.col(attachment_column)
-        
-        return df.with_columns(
-            
-            pl.when(col.is_null())
-                .then(pl.lit([]))
-                .when(col.is_list())
-                .then(
-
-                    col.cast(pl.List(pl.Utf8)).list.eval(pl.element().cast(pl.Utf8).str.to_lowercase())
-                )
-                .otherwise(
-                    
-                    col.cast(pl.Utf8).str.to_lowercase().map_elements(lambda s: [s], return_dtype=pl.List(pl.Utf8))
-                
-                )
-                .alias("_files")
-            )
-    
-    return df.with_columns(pl.lit([]).alias("_files"))
 
+        if isinstance(schema[attachment_column], pl.List) :
+            files = col.cast(pl.List(pl.Utf8))
 
-def _init_assignment (df: pl.DataFrame) -> pl.DataFrame :
-    """
-    Add assignment columns: _assigned, _score.
-    """
-    return df.with_columns(
-        
-        pl.lit("UNMATCHED").alias("_assigned"),
-        pl.lit(-1).alias("_score"),
+        else :
+            files = pl.concat_list(col.cast(pl.Utf8)).list.drop_nulls()
+
+        return df.with_columns(files.alias("_files"))
     
-    )
+    return df.with_columns(pl.lit(None, dtype=pl.List(pl.Utf8)).alias("_files"))
 
 
 def _filter_attachments_only (df: pl.DataFrame, column : str = "Attachments") -> pl.DataFrame :
@@ -168,101 +184,346 @@ def _filter_attachments_only (df: pl.DataFrame, column : str = "Attachments") ->
 
 # -------------------- Assignment (email/domain AND subject) --------------------
 
-def _assign_by_emails (
-        
-        df: pl.DataFrame,
-        name: str,
-        emails: Set[str],
-        subject_re: str,
-        filenames: Set[str],
-    
-    ) -> pl.DataFrame :
+@dataclass(frozen=True)
+class CompiledRules :
+    """
+    Counterparty rules compiled for `_assign`.
+
+      senders  : _key (email or domain), _kind, _pos (priority), _rule, _name, _score, _filenames
+      keywords : _keyword (padded keyword form), _rule
+      patterns : rule index -> regex for the subject words the keyword matcher cannot take
+      files    : _rule, _token, _ext (filename tokens; '.xxx' tokens are extensions)
+
+    Priority follows the sequential engine: rules in order, and within a rule
+    the exact email (score=100) before the domain (score=80).
+    Rules without a usable subject pattern can never match and are left out.
     """
-    Assign when sender email matches AND subject contains the configured pattern.
-    If 'filenames' provided, require at least one filename match ONLY when the row has filenames.
+    names : Tuple[str, ...]
+    senders : pl.DataFrame
+    keywords : pl.DataFrame
+    patterns : Dict[int, str]
+    files : pl.DataFrame
+
+
+_COMPILED : Dict[str, CompiledRules] = {}
+
+# Bumped whenever the matching semantics change (invalidates cached assignments)
+ENGINE_VERSION = 2
+
+
+def rules_hash (rules : Optional[Dict[str, Dict]] = None) -> str :
     """
-    if not emails or not subject_re or subject_re in (r"^(?!)", r"(?!)") :
-        return df
+    Stable fingerprint of a counterparty rules dict (sets are order independent).
+    """
+    rules = COUNTERPARTIES if rules is None else rules
 
-    subj_hit = pl.col("_subject").str.contains(subject_re, literal=False, strict=False)
-    base = (pl.col("_assigned") == "UNMATCHED") & pl.col("_sender_email").is_in(sorted(emails)) & subj_hit
+    payload = json.dumps(
 
-    if filenames:
-        files_len = pl.col("_files").list.len()
-        fn_any = pl.col("_files").list.eval(
-            pl.element().cast(pl.Utf8).str.to_lowercase().is_in(sorted(filenames))
-        ).list.any()
-        cond = base & pl.when(files_len > 0).then(fn_any).otherwise(pl.lit(True))
-    else:
-        cond = base
+        {"engine" : ENGINE_VERSION, "rules" : rules}, sort_keys=True,
+        default=lambda o : sorted(map(str, o)) if isinstance(o, (set, frozenset, list, tuple)) else str(o)
 
-    return df.with_columns(
-        pl.when(cond).then(pl.lit(name)).otherwise(pl.col("_assigned")).alias("_assigned"),
-        pl.when(cond).then(pl.lit(100)).otherwise(pl.col("_score")).alias("_score"),
     )
 
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
 
-def _assign_by_domains(
-        
-        df: pl.DataFrame,
-        name: str,
-        domains: Set[str],
-        subject_re: str,
-        filenames: Set[str],
 
-    ) -> pl.DataFrame:
+def _compile_rules (nrules: Dict[str, Dict]) -> CompiledRules :
     """
-    Assign when sender domain matches AND subject contains the configured pattern.
-    If 'filenames' provided, require at least one filename match ONLY when the row has filenames.
+    Flatten normalized rules into the sender lookup table, the keyword table and the regex fallbacks.
     """
-    if not domains or not subject_re or subject_re in (r"^(?!)", r"(?!)"):
-        return df
+    senders, keywords, files = [], [], []
+    patterns : Dict[int, str] = {}
 
-    subj_hit = pl.col("_subject").str.contains(subject_re, literal=False, strict=False)
-    base = (pl.col("_assigned") == "UNMATCHED") & pl.col("_sender_domain").is_in(sorted(domains)) & subj_hit
+    for i, (name, rule) in enumerate(nrules.items()) :
 
-    if filenames:
-        files_len = pl.col("_files").list.len()
-        fn_any = pl.col("_files").list.eval(
-            pl.element().cast(pl.Utf8).str.to_lowercase().is_in(sorted(filenames))
-        ).list.any()
-        cond = base & pl.when(files_len > 0).then(fn_any).otherwise(pl.lit(True))
-    else:
-        cond = base
+        subject_re = rule["subject_re"]
+        words = rule["subject_words"]
+
+        if not subject_re or subject_re.endswith(r"^(?!)") :
+            continue
+
+        if words is None :
+            patterns[i] = subject_re
+
+        else :
+
+            forms = {w : _keyword_form(w) for w in words}
+            keywords.extend({"_keyword" : form, "_rule" : i} for form in set(forms.values()) if form is not None)
+
+            leftovers = [w for w, form in forms.items() if form is None]
+
+            if leftovers :
+                patterns[i] = _compile_subject_pattern(leftovers)
+
+        files.extend({"_rule" : i, "_token" : token, "_ext" : token.startswith(".")} for token in sorted(rule["filenames"]))
+
+        for kind, keys, offset, score in (("email", rule["emails"], 0, 100), ("domain", rule["domains"], 1, 80)) :
+
+            for key in sorted(keys) :
+
+                senders.append(
+                    {
+                        "_key" : key,
+                        "_kind" : kind,
+                        "_pos" : 2 * i + offset,
+                        "_rule" : i,
+                        "_name" : name,
+                        "_score" : score,
+                        "_filenames" : sorted(rule["filenames"]),
+                    }
+                )
+
+    return CompiledRules(
+
+        names=tuple(nrules.keys()),
+        senders=pl.DataFrame(
+            senders,
+            schema={
+                "_key" : pl.Utf8, "_kind" : pl.Utf8, "_pos" : pl.Int32, "_rule" : pl.Int32, "_name" : pl.Utf8,
+                "_score" : pl.Int32, "_filenames" : pl.List(pl.Utf8),
+            },
+        ),
+        keywords=pl.DataFrame(keywords, schema={"_keyword" : pl.Utf8, "_rule" : pl.Int32}),
+        patterns=patterns,
+        files=pl.DataFrame(files, schema={"_rule" : pl.Int32, "_token" : pl.Utf8, "_ext" : pl.Boolean}),
+
+    )
+
+
+def compile_rules (rules: Optional[Dict[str, Dict]] = None) -> CompiledRules :
+    """
+    Compiled ruleset for `rules` (default COUNTERPARTIES), built once per distinct config.
+    """
+    rules = COUNTERPARTIES if rules is None else rules
+    key = rules_hash(rules)
+
+    compiled = _COMPILED.get(key)
+
+    if compiled is None :
+
+        compiled = _compile_rules(_normalize_rules(rules))
+        _COMPILED[key] = compiled
+
+    return compiled
+
+
+def _subject_hits (subjects: pl.DataFrame, compiled: CompiledRules) -> pl.DataFrame :
+    """
+    (_rid, _rule) pairs whose subject matches the rule's keywords or fallback regex.
+
+    Keywords of every rule are matched together in one Aho-Corasick pass
+    (cost independent of the number of counterparties); only the few words
+    with punctuation go through a per-rule regex.
+    """
+    frames = []
+
+    if not compiled.keywords.is_empty() :
+
+        found = subjects.select(
+            "_rid",
+            _keyword_haystack(pl.col("_subject"))
+              .str.extract_many(compiled.keywords["_keyword"].unique().to_list(), overlapping=True)
+              .alias("_keyword"),
+        )
+
+        frames.append(
+            found.explode("_keyword")
+            .drop_nulls("_keyword")
+            .join(compiled.keywords, on="_keyword", how="inner")
+            .select("_rid", "_rule")
+        )
+
+    for rule, pattern in compiled.patterns.items() :
+
+        frames.append(
+            subjects.filter(pl.col("_subject").str.contains(pattern, strict=False).fill_null(False))
+            .select("_rid", pl.lit(rule, dtype=pl.Int32).alias("_rule"))
+        )
+
+    if not frames :
+        return pl.DataFrame(schema={"_rid" : pl.UInt32, "_rule" : pl.Int32})
+
+    return pl.concat(frames, how="vertical_relaxed").unique()
+
+
+def _assign (work: pl.DataFrame | pl.LazyFrame, compiled: CompiledRules) -> pl.DataFrame :
+    """
+    Cost independent of the number of rules:
+      - sender email / domain resolved against the lookup table with two joins
+      - subjects of the candidate rows matched once against every rule's keywords
+      - attachment names exploded and matched against the rules' filename tokens
+      - best candidate (lowest _pos) with a subject (+ filenames) hit per row,
+        folded into _assigned / _score / _assigned_files
+
+    If a rule has filenames, at least one must match ONLY when the row has filenames.
+    _assigned_files holds the attachments that belong to the assigned counterparty
+    (all of them when its rule has no filenames).
+    """
+    work = work.lazy().collect()
+
+    if compiled.senders.is_empty() :
+
+        return work.with_columns(
+            pl.lit("UNMATCHED").alias("_assigned"),
+            pl.lit(-1, dtype=pl.Int32).alias("_score"),
+            pl.lit(None, dtype=pl.List(pl.Utf8)).alias("_assigned_files"),
+        )
+
+    senders = work.lazy().select("_rid", "_sender_email", "_sender_domain", "_subject", "_files")
+    lookup = compiled.senders.lazy()
+
+    candidates = pl.concat(
+        [
+            senders.join(lookup.filter(pl.col("_kind") == "email"), left_on="_sender_email", right_on="_key", how="inner"),
+            senders.join(lookup.filter(pl.col("_kind") == "domain"), left_on="_sender_domain", right_on="_key", how="inner"),
+        ],
+        how="vertical_relaxed",
+    ).collect()
+
+    # Subjects are only scanned for rows a sender rule applies to
+    hits = _subject_hits(candidates.select("_rid", "_subject").unique("_rid"), compiled)
+
+    candidates = candidates.join(
+
+        compiled.files.group_by("_rule").len().rename({"len" : "_ntokens"}), on="_rule", how="left"
+
+    ).with_columns(
+
+        (pl.col("_ntokens").fill_null(0) > 0).alias("_has_tokens"),
+        (pl.col("_files").list.len() > 0).fill_null(False).alias("_has_files"),
 
-    return df.with_columns(
-        pl.when(cond).then(pl.lit(name)).otherwise(pl.col("_assigned")).alias("_assigned"),
-        pl.when(cond).then(pl.lit(80)).otherwise(pl.col("_score")).alias("_score"),
     )
 
+    # One row per (message, rule, attachment name) x token, kept when the name matches
+    matched = (
+        candidates.filter(pl.col("_has_tokens") & pl.col("_has_files"))
+        .select("_rid", "_rule", "_files")
+        .explode("_files")
+        .join(compiled.files, on="_rule", how="inner")
+        .filter(
+            pl.when(pl.col("_ext"))
+              .then(pl.col("_files").str.to_lowercase().str.ends_with(pl.col("_token")))
+              .otherwise(pl.col("_files").str.to_lowercase().str.contains(pl.col("_token"), literal=True))
+        )
+        .group_by("_rid", "_rule")
+        .agg(pl.col("_files").unique(maintain_order=True).alias("_matched"))
+    )
+
+    best = (
+        candidates
+        .join(hits, on=["_rid", "_rule"], how="semi")
+        .join(matched, on=["_rid", "_rule"], how="left")
+        .filter(~pl.col("_has_tokens") | ~pl.col("_has_files") | pl.col("_matched").is_not_null())
+        .with_columns(
+            pl.when(pl.col("_has_tokens") & pl.col("_has_files"))
+              .then(pl.col("_matched"))
+              .otherwise(pl.col("_files"))
+              .alias("_hit_files")
+        )
+        .group_by("_rid")
+        .agg(pl.col("_name", "_score", "_hit_files").sort_by("_pos").first())
+        .rename({"_name" : "_hit_name", "_score" : "_hit_score"})
+    )
 
-def _apply_rule (df: pl.DataFrame, name: str, rule: Dict) -> pl.DataFrame :
+    return (
+        work.join(best, on="_rid", how="left")
+        .with_columns(
+            pl.when(pl.col("_hit_name").is_not_null())
+              .then(pl.col("_hit_name"))
+              .otherwise(pl.lit("UNMATCHED"))
+              .alias("_assigned"),
+            pl.when(pl.col("_hit_name").is_not_null())
+              .then(pl.col("_hit_score"))
+              .otherwise(pl.lit(-1, dtype=pl.Int32))
+              .alias("_score"),
+            pl.col("_hit_files").alias("_assigned_files"),
+        )
+        .drop("_hit_name", "_hit_score", "_hit_files")
+        .sort("_rid")
+    )
+
+
+def _classify (df: pl.DataFrame, rules: Dict[str, Dict], attachment_column: Optional[str]) -> Tuple[pl.DataFrame, List[str]] :
     """
-    Require subject containment for both email- and domain-based assignment.
+    Run the compiled engine on an attachments-only frame.
+    Returns the working frame (with _assigned / _score) and the rule names in priority order.
     """
-    df = _assign_by_emails(df, name, rule["emails"], rule["subject_re"], rule["filenames"])
-    df = _assign_by_domains(df, name, rule["domains"], rule["subject_re"], rule["filenames"])
-    return df
+    compiled = compile_rules(rules)
+
+    work = _extract_sender_columns(df.lazy())
+    work = _normalize_attachments(work, attachment_column if attachment_column in df.columns else None)
+
+    return _assign(work, compiled), list(compiled.names)
 
 
 # -------------------- Output buckets --------------------
 
 def _materialize_buckets (dfw: pl.DataFrame, original: pl.DataFrame, names: List[str]) -> Dict[str, pl.DataFrame]:
     """
-    Build the output dict of matched buckets + UNMATCHED.
+    Build the output dict of matched buckets + UNMATCHED in one partition pass.
     Keep original column order, append any new columns at the end (helpers dropped).
     """
-    drops = ["_rid", "_from_lc", "_sender_email", "_sender_domain", "_subject", "_files", "_assigned", "_score"]
-    out: Dict[str, pl.DataFrame] = {}
+    drops = {"_rid", "_from_lc", "_sender_email", "_sender_domain", "_subject", "_files", "_assigned", "_score", "_assigned_files", "Counterparty Files"}
 
-    for name in names + ["UNMATCHED"]:
-        part = dfw.filter(pl.col("_assigned") == name).drop(drops, strict=False)
-        out[name] = part.select(
-            [c for c in original.columns if c in part.columns]
-            + [c for c in part.columns if c not in original.columns]
-        )
+    # Projection computed once, applied before the split
+    columns = (
+        [c for c in original.columns if c in dfw.columns and c not in drops]
+        + [c for c in dfw.columns if c not in original.columns and c not in drops]
+    )
 
-    return out
+    projected = dfw.select(columns + [pl.col("_assigned_files").alias("Counterparty Files"), "_assigned"])
+    parts = projected.partition_by("_assigned", as_dict=True, include_key=False, maintain_order=True)
+
+    # Counterparties without mail get a schema-only frame
+    empty = projected.drop("_assigned").clear()
+
+    return {name : parts.get((name,), empty) for name in names + ["UNMATCHED"]}
+
+
+# -------------------- Attachment selection --------------------
+
+def attachment_matches (name : Optional[str], filenames : Iterable[str]) -> bool :
+    """
+    True when an attachment name matches one of the configured filename tokens:
+    tokens starting with '.' are extensions, others are case-insensitive substrings.
+    No tokens means every name matches.
+    """
+    tokens = [str(f).strip().lower() for f in filenames or [] if str(f).strip()]
+
+    if not tokens :
+        return True
+
+    lname = (name or "").lower()
+
+    return any(lname.endswith(t) if t.startswith(".") else t in lname for t in tokens)
+
+
+def select_attachments (
+        
+        attachments : Optional[List[Dict]],
+        filenames : Optional[Iterable[str]] = None,
+        names : Optional[Iterable[str]] = None,
+    
+    ) -> Optional[List[Dict]] :
+    """
+    Keep the non-inline attachments (expanded metadata) whose name matches `filenames`,
+    or, when given, whose name is one of `names` (the classifier's "Counterparty Files").
+    Returns None when the metadata is unknown (the downloader then lists the message).
+    """
+    if attachments is None :
+        return None
+
+    if names is not None :
+
+        names = set(names)
+        return [att for att in attachments if not att.get("isInline") and att.get("name") in names]
+
+    return [
+
+        att for att in attachments
+        if not att.get("isInline") and attachment_matches(att.get("name"), filenames)
+    
+    ]
 
 
 # -------------------- Public API --------------------
@@ -271,7 +532,7 @@ def split_by_counterparty (
         
         df: pl.DataFrame,
         rules: Optional[Dict[str, Dict]] = None,
-        attachment_column: Optional[str] = None,
+        attachment_column: Optional[str] = "Attachment Names",
     
     ) -> Dict[str, pl.DataFrame] :
     """
@@ -282,6 +543,10 @@ def split_by_counterparty (
       (1) exact email  (score=100)  AND subject contains pattern (+ optional filenames)
       (2) domain       (score=80)   AND subject contains pattern (+ optional filenames)
 
+    Filename tokens match attachment names of `attachment_column` as case-insensitive
+    substrings ('.xxx' tokens as extensions). Buckets carry "Counterparty Files":
+    the attachments that belong to the counterparty (null when names are unknown).
+
     Returns a dict with matched buckets + an "UNMATCHED" bucket.
     """
     rules = COUNTERPARTIES if rules is None else rules
@@ -296,13 +561,51 @@ def split_by_counterparty (
         # Nothing to classify; still return a single UNMATCHED bucket for consistency
         return {"UNMATCHED": df2}
 
-    nrules = _normalize_rules(rules)
+    work, names = _classify(df2, rules, attachment_column)
+
+    return _materialize_buckets(work, df2, names)
+
 
-    work = _extract_sender_columns(df2)
-    work = _normalize_attachments(work, attachment_column)
-    work = _init_assignment(work)
+def classify_messages (
+
+        df: pl.DataFrame,
+        rules: Optional[Dict[str, Dict]] = None,
+        attachment_column: Optional[str] = "Attachment Names",
+
+    ) -> pl.DataFrame :
+    """
+    Same rules as `split_by_counterparty`, but keeps every row and adds
+    "Counterparty" / "Score" (UNMATCHED / -1 for mail without attachments or no rule hit)
+    and "Counterparty Files".
+    """
+    rules = COUNTERPARTIES if rules is None else rules
 
-    for name, rule in nrules.items() :
-        work = _apply_rule(work, name, rule)
+    if df is None :
+        return pl.DataFrame(schema={"Counterparty" : pl.Utf8, "Score" : pl.Int32, "Counterparty Files" : pl.List(pl.Utf8)})
 
-    return _materialize_buckets(work, df2, list(nrules.keys()))
+    keyed = df.drop(["Counterparty", "Score", "Counterparty Files"], strict=False).with_row_index("_cid")
+    df2 = _filter_attachments_only(keyed)
+
+    if df2.is_empty() :
+        assigned = pl.DataFrame(schema={"_cid" : pl.UInt32, "Counterparty" : pl.Utf8, "Score" : pl.Int32, "Counterparty Files" : pl.List(pl.Utf8)})
+
+    else :
+
+        work, _ = _classify(df2, rules, attachment_column)
+
+        assigned = work.select(
+            "_cid",
+            pl.col("_assigned").alias("Counterparty"),
+            pl.col("_score").cast(pl.Int32).alias("Score"),
+            pl.col("_assigned_files").alias("Counterparty Files"),
+        )
+
+    return (
+        keyed.join(assigned, on="_cid", how="left")
+        .with_columns(
+            pl.col("Counterparty").fill_null("UNMATCHED"),
+            pl.col("Score").fill_null(-1),
+        )
+        .sort("_cid")
+        .drop("_cid")
+    )
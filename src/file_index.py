@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+import os
+import re
+import threading
+import datetime as dt
+
+from typing import Dict, List, Optional, Tuple, Iterable
+
+from src.utils import str_to_date
+
+
+# strftime directives the index can turn into a regex (anything else falls back to a scan)
+_DIRECTIVES = {
+
+    "%Y" : r"\d{4}",
+    "%y" : r"\d{2}",
+    "%m" : r"\d{2}",
+    "%d" : r"\d{2}",
+    "%b" : r"[A-Za-z]{3}",
+
+}
+
+
+def _format_regex (d_format : str) -> Optional[re.Pattern] :
+    """
+    Overlapping-match regex for dates written with `d_format` (None if unsupported).
+    """
+    parts = re.split(r"(%.)", d_format)
+    out = []
+
+    for part in parts :
+
+        if not part :
+            continue
+
+        if part.startswith("%") :
+
+            if part not in _DIRECTIVES :
+                return None
+
+            out.append(_DIRECTIVES[part])
+
+        else :
+            out.append(re.escape(part))
+
+    # Lookahead capture: every window is found, as `date_str in name` would
+    return re.compile(f"(?=({''.join(out)}))")
+
+
+class _Directory :
+    """
+    Listing of one directory + its per-format date buckets, rebuilt when the directory mtime changes.
+    """
+
+    def __init__ (self, path : str) -> None :
+
+        self.path = path
+        self.mtime_ns : Optional[int] = None
+        self.entries : List[str] = []
+        self.by_date : Dict[str, Dict[dt.date, List[str]]] = {}
+
+
+    def refresh (self) -> None :
+
+        try :
+            mtime_ns = os.stat(self.path).st_mtime_ns
+
+        except FileNotFoundError :
+
+            self.mtime_ns, self.entries, self.by_date = None, [], {}
+            return
+
+        if mtime_ns == self.mtime_ns :
+            return
+
+        with os.scandir(self.path) as it :
+            self.entries = sorted(entry.name for entry in it if entry.is_file())
+
+        self.mtime_ns = mtime_ns
+        self.by_date = {}
+
+
+    def bucket (self, d_format : str) -> Optional[Dict[dt.date, List[str]]] :
+        """
+        {date : names containing it written as `d_format`}, built on first use per format.
+        """
+        if d_format in self.by_date :
+            return self.by_date[d_format]
+
+        rx = _format_regex(d_format)
+
+        if rx is None :
+            return None
+
+        index : Dict[dt.date, List[str]] = {}
+
+        for name in self.entries :
+
+            seen = set()
+
+            for match in rx.finditer(name) :
+
+                try :
+                    day = dt.datetime.strptime(match.group(1), d_format).date()
+
+                except ValueError :
+                    continue
+
+                if day not in seen :
+
+                    seen.add(day)
+                    index.setdefault(day, []).append(name)
+
+        self.by_date[d_format] = index
+
+        return index
+
+
+class FileIndex :
+    """
+    Shared index of the attachment directories.
+
+    Each directory is listed once and only listed again when its mtime changes
+    (a file was added, removed or renamed); file names are bucketed by every date
+    they contain for each date format asked for, so a (counterparty, date, fund)
+    lookup is a dict hit followed by a token filter over that day's few files.
+    """
+
+    def __init__ (self) -> None :
+
+        self._lock = threading.Lock()
+        self._dirs : Dict[str, _Directory] = {}
+
+
+    def _directory (self, dir_abs_path : str) -> _Directory :
+
+        path = os.path.abspath(dir_abs_path)
+        directory = self._dirs.get(path)
+
+        if directory is None :
+
+            directory = _Directory(path)
+            self._dirs[path] = directory
+
+        directory.refresh()
+
+        return directory
+
+
+    def entries (self, dir_abs_path : str) -> List[str] :
+        """
+        Sorted file names of the directory.
+        """
+        with self._lock :
+            return list(self._directory(dir_abs_path).entries)
+
+
+    def lookup (
+
+            self,
+            dir_abs_path : str,
+            date : str | dt.datetime | dt.date,
+            d_format : str = "%Y%m%d",
+
+            tokens : Iterable[Optional[str]] = (),
+            exclude : Iterable[str] = (),
+            extensions : Optional[Tuple[str, ...]] = None,
+
+        ) -> List[str] :
+        """
+        Names holding `date` written as `d_format`, every token in `tokens`, none of
+        `exclude`, and ending with one of `extensions` (case-insensitive).
+
+        A None or empty token (typically an unset setting) matches no file, rather than
+        being dropped and widening the match.
+        """
+        day = str_to_date(date)
+        tokens = list(tokens)
+
+        if not all(tokens) :
+            return []
+
+        with self._lock :
+
+            directory = self._directory(dir_abs_path)
+            bucket = directory.bucket(d_format)
+
+            if bucket is not None :
+                names = list(bucket.get(day, []))
+
+            else :
+
+                date_str = day.strftime(d_format)
+                names = [name for name in directory.entries if date_str in name]
+
+        return [
+
+            name for name in names
+            if all(t in name for t in tokens)
+            and not any(x in name for x in exclude)
+            and (extensions is None or name.lower().endswith(tuple(extensions)))
+
+        ]
+
+
+_FILE_INDEX : Optional[FileIndex] = None
+
+
+def get_file_index () -> FileIndex :
+    """
+    Process-wide `FileIndex` (one per run).
+    """
+    global _FILE_INDEX
+
+    if _FILE_INDEX is None :
+        _FILE_INDEX = FileIndex()
+
+    return _FILE_INDEX
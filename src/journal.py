@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import os
+import json
+import glob
+import shutil
+import sqlite3
+import hashlib
+import threading
+import polars as pl
+import datetime as dt
+
+from typing import Dict, List, Optional, Any
+
+from src.config import RUN_JOURNAL_ABS_PATH
+
+
+def run_key (**params : Any) -> str :
+    """
+    Stable identifier of a run from its parameters (dates, mailboxes, funds, counterparties...).
+    """
+    payload = json.dumps(params, sort_keys=True, default=lambda o : sorted(map(str, o)) if isinstance(o, (set, list, tuple)) else str(o))
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class RunJournal :
+    """
+    Checkpoint journal of a `main()` run.
+
+    Every unit of work (listing of a mailbox day, download of a message, parse of a
+    counterparty / date / fund) is recorded as done or failed under the run key as
+    soon as it completes. A resumed run skips the done units and retries the failed
+    ones; parse outputs are persisted next to the journal so skipped parses still
+    feed the export.
+    """
+
+    def __init__ (
+
+            self,
+            key : str,
+            db_path : Optional[str] = None,
+            resume : bool = False,
+
+        ) -> None :
+
+        self.key = key
+        self.db_path = RUN_JOURNAL_ABS_PATH if db_path is None else db_path
+        self.results_dir = os.path.join(os.path.dirname(os.path.abspath(self.db_path)), "results", key)
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+
+        with self._lock, self._conn :
+
+            self._conn.execute("PRAGMA journal_mode=WAL")
+
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS units (
+                    run_key TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    unit TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    error TEXT,
+                    updated_at TEXT,
+                    PRIMARY KEY (run_key, kind, unit)
+                )
+                """
+            )
+
+            # A fresh (non resumed) run starts from a clean slate
+            if not resume :
+                self._conn.execute("DELETE FROM units WHERE run_key = ?", (key,))
+
+        if not resume :
+            shutil.rmtree(self.results_dir, ignore_errors=True)
+
+
+    def close (self) -> None :
+
+        with self._lock :
+            self._conn.close()
+
+
+    @staticmethod
+    def unit (*parts : Any) -> str :
+        return "|".join("" if p is None else str(p) for p in parts)
+
+
+    # -------------------- Status --------------------
+
+    def is_done (self, kind : str, unit : str) -> bool :
+
+        with self._lock :
+
+            row = self._conn.execute(
+                "SELECT status FROM units WHERE run_key = ? AND kind = ? AND unit = ?", (self.key, kind, unit)
+            ).fetchone()
+
+        return row is not None and row[0] == "done"
+
+
+    def done_units (self, kind : str) -> set :
+
+        with self._lock :
+
+            rows = self._conn.execute(
+                "SELECT unit FROM units WHERE run_key = ? AND kind = ? AND status = 'done'", (self.key, kind)
+            ).fetchall()
+
+        return {row[0] for row in rows}
+
+
+    def record (self, kind : str, unit : str, error : Optional[str] = None) -> None :
+        """
+        Mark a unit done (no error) or failed (with its error).
+        """
+        with self._lock, self._conn :
+
+            self._conn.execute(
+                "INSERT OR REPLACE INTO units VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    self.key, kind, unit, "done" if error is None else "failed", error,
+                    dt.datetime.now().isoformat(timespec="seconds")
+                )
+            )
+
+
+    def summary (self) -> Dict[str, Dict[str, int]] :
+        """
+        {kind : {status : count}} for this run.
+        """
+        with self._lock :
+
+            rows = self._conn.execute(
+                "SELECT kind, status, COUNT(*) FROM units WHERE run_key = ? GROUP BY kind, status", (self.key,)
+            ).fetchall()
+
+        out : Dict[str, Dict[str, int]] = {}
+
+        for kind, status, count in rows :
+            out.setdefault(kind, {})[status] = count
+
+        return out
+
+
+    # -------------------- Parse outputs --------------------
+
+    def _result_dir (self, unit : str) -> str :
+        return os.path.join(self.results_dir, hashlib.sha1(unit.encode("utf-8")).hexdigest()[:20])
+
+
+    def save_frames (self, kind : str, unit : str, dfs : Any) -> None :
+        """
+        Persist a parse output (DataFrame, list of DataFrames or None) and mark the unit done.
+        """
+        out_dir = self._result_dir(unit)
+
+        shutil.rmtree(out_dir, ignore_errors=True)
+        os.makedirs(out_dir, exist_ok=True)
+
+        frames = [dfs] if isinstance(dfs, pl.DataFrame) else [df for df in dfs or [] if isinstance(df, pl.DataFrame)]
+
+        for i, df in enumerate(frames) :
+            df.write_parquet(os.path.join(out_dir, f"df_{i}.parquet"))
+
+        self.record(kind, unit)
+
+
+    def load_frames (self, unit : str) -> Optional[List[pl.DataFrame]] :
+        """
+        Parse output saved by `save_frames`, or None when it is not available.
+        """
+        out_dir = self._result_dir(unit)
+
+        if not os.path.isdir(out_dir) :
+            return None
+
+        paths = sorted(glob.glob(os.path.join(out_dir, "df_*.parquet")), key=lambda p : int(p.rsplit("_", 1)[-1].split(".")[0]))
+
+        return [pl.read_parquet(path) for path in paths]
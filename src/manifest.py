@@ -0,0 +1,258 @@
+from __future__ import annotations
+
+import os
+import shutil
+import sqlite3
+import hashlib
+import threading
+import datetime as dt
+
+from typing import Dict, List, Optional, Any
+
+from src.config import ATTACHMENT_MANIFEST_ABS_PATH, ATTACHMENT_STORE_DIR_ABS_PATH
+
+
+class AttachmentManifest :
+    """
+    Download manifest + content-addressed attachment store.
+
+    Every saved attachment is keyed by (mailbox, message id, attachment id) and
+    recorded with its size, sha256 and final path. The bytes live once in
+    `store_dir/<sha[:2]>/<sha>` and are hard-linked into the per-counterparty
+    folders, so identical resends never take disk space twice and known
+    messages are served without any network call.
+    """
+
+    def __init__ (
+
+            self,
+            db_path : Optional[str] = None,
+            store_dir : Optional[str] = None,
+
+        ) -> None :
+
+        self.db_path = ATTACHMENT_MANIFEST_ABS_PATH if db_path is None else db_path
+        self.store_dir = ATTACHMENT_STORE_DIR_ABS_PATH if store_dir is None else store_dir
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        os.makedirs(self.store_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+
+        with self._lock, self._conn :
+
+            self._conn.execute("PRAGMA journal_mode=WAL")
+
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS attachments (
+                    mailbox TEXT NOT NULL,
+                    message_id TEXT NOT NULL,
+                    attachment_id TEXT NOT NULL,
+                    name TEXT,
+                    size INTEGER,
+                    sha256 TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    created_at TEXT,
+                    PRIMARY KEY (mailbox, message_id, attachment_id)
+                )
+                """
+            )
+
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS messages (
+                    mailbox TEXT NOT NULL,
+                    message_id TEXT NOT NULL,
+                    completed_at TEXT,
+                    PRIMARY KEY (mailbox, message_id)
+                )
+                """
+            )
+
+
+    def close (self) -> None :
+
+        with self._lock :
+            self._conn.close()
+
+
+    def blob_path (self, sha256 : str) -> str :
+        return os.path.join(self.store_dir, sha256[:2], sha256)
+
+
+    # -------------------- Lookups --------------------
+
+    def message_done (self, mailbox : str, message_id : str) -> bool :
+        """
+        True when every attachment of this message was already stored.
+        """
+        with self._lock :
+
+            row = self._conn.execute(
+                "SELECT 1 FROM messages WHERE mailbox = ? AND message_id = ?", (mailbox, message_id)
+            ).fetchone()
+
+        return row is not None
+
+
+    def lookup (self, mailbox : str, message_id : str, attachment_id : str) -> Optional[Dict[str, Any]] :
+        """
+        Manifest entry of one attachment, or None.
+        """
+        with self._lock :
+
+            row = self._conn.execute(
+                "SELECT name, size, sha256, path FROM attachments WHERE mailbox = ? AND message_id = ? AND attachment_id = ?",
+                (mailbox, message_id, attachment_id)
+            ).fetchone()
+
+        if row is None :
+            return None
+
+        return {"name" : row[0], "size" : row[1], "sha256" : row[2], "path" : row[3]}
+
+
+    # -------------------- Placement --------------------
+
+    def _link (self, blob : str, path : str) -> None :
+        """
+        Hard-link `blob` to `path` (copy when links are not possible).
+        """
+        if os.path.exists(path) :
+
+            if os.path.samefile(blob, path) :
+                return
+
+            os.remove(path)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        try :
+            os.link(blob, path)
+
+        except OSError :
+            shutil.copy2(blob, path)
+
+
+    def place (self, mailbox : str, message_id : str, attachment_id : str, out_dir : str) -> Optional[str] :
+        """
+        Link a known attachment into `out_dir` without touching the network.
+        Returns the placed path, or None when it is unknown or its blob is gone.
+        """
+        entry = self.lookup(mailbox, message_id, attachment_id)
+
+        if entry is None :
+            return None
+
+        blob = self.blob_path(entry["sha256"])
+
+        if not os.path.exists(blob) :
+            return None
+
+        path = os.path.join(out_dir, entry["name"])
+        self._link(blob, path)
+
+        return path
+
+
+    def place_message (
+
+            self,
+            mailbox : str,
+            message_id : str,
+            out_dir : str,
+            attachment_ids : Optional[List[str]] = None,
+
+        ) -> Optional[List[str]] :
+        """
+        Link every stored attachment of a completed message into `out_dir`, or only
+        `attachment_ids` (a selective download) when each of them is stored.
+        Returns None when the message has to be downloaded again.
+        """
+        if attachment_ids is None :
+
+            if not self.message_done(mailbox, message_id) :
+                return None
+
+            with self._lock :
+
+                rows = self._conn.execute(
+                    "SELECT attachment_id FROM attachments WHERE mailbox = ? AND message_id = ?", (mailbox, message_id)
+                ).fetchall()
+
+            attachment_ids = [attachment_id for (attachment_id,) in rows]
+
+        paths = []
+
+        for attachment_id in attachment_ids :
+
+            path = self.place(mailbox, message_id, attachment_id, out_dir)
+
+            if path is None :
+                return None
+
+            paths.append(path)
+
+        return paths
+
+
+    # -------------------- Recording --------------------
+
+    def ingest (self, mailbox : str, message_id : str, attachment_id : str, path : str) -> str :
+        """
+        Move a freshly written file into the store and hard-link it back to `path`.
+        """
+        digest = hashlib.sha256()
+        size = 0
+
+        with open(path, "rb") as f :
+
+            for chunk in iter(lambda: f.read(1 << 20), b"") :
+
+                digest.update(chunk)
+                size += len(chunk)
+
+        sha256 = digest.hexdigest()
+        blob = self.blob_path(sha256)
+
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+
+        if os.path.exists(blob) :
+            self._link(blob, path)
+
+        else :
+
+            try :
+
+                os.link(path, blob)
+
+            except OSError :
+                shutil.copy2(path, blob)
+
+        with self._lock, self._conn :
+
+            self._conn.execute(
+                "INSERT OR REPLACE INTO attachments VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    mailbox, message_id, attachment_id, os.path.basename(path), size, sha256,
+                    os.path.abspath(path), dt.datetime.now().isoformat(timespec="seconds")
+                )
+            )
+
+        return path
+
+
+    def mark_message_done (self, mailbox : str, message_id : str) -> None :
+        """
+        Record that every attachment of the message is stored (never after a selective
+        download: other attachments may be selected once the filename rules change).
+        """
+
+        with self._lock, self._conn :
+
+            self._conn.execute(
+                "INSERT OR REPLACE INTO messages VALUES (?, ?, ?)",
+                (mailbox, message_id, dt.datetime.now().isoformat(timespec="seconds"))
+            )
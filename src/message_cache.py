@@ -0,0 +1,284 @@
+from __future__ import annotations
+
+import os
+import json
+import glob
+import uuid
+import polars as pl
+import datetime as dt
+
+from typing import Dict, List, Optional, Set, Iterable
+
+from src.config import EMAIL_COLUMNS, COUNTERPARTIES, MESSAGE_CACHE_DIR_ABS_PATH, MESSAGE_CACHE_MAX_PARTS
+from src.extraction import classify_messages, rules_hash
+
+
+CACHE_COLUMNS = {
+
+    **EMAIL_COLUMNS,
+    "Received Date" : pl.Date,
+    "Counterparty" : pl.Utf8,
+    "Score" : pl.Int32,
+    "Counterparty Files" : pl.List(pl.Utf8),
+    "Rules Hash" : pl.Utf8,
+    "Cached At" : pl.Datetime("us"),
+
+}
+
+
+class MessageCache :
+    """
+    Append-only Parquet store of listed messages keyed by (Shared Email, Id),
+    with the counterparty / score they were classified to.
+
+    Each ingest writes one `part-*.parquet`; reads keep the latest row per key,
+    so a re-listed message replaces the cached one.
+    A small coverage file records which (mailbox, day) were fully listed under the
+    current rules, so reruns over those days skip Graph and the classifier.
+    Changing the rules invalidates both the coverage and the stored assignments.
+    """
+
+    def __init__ (
+
+            self,
+            cache_dir : Optional[str] = None,
+            rules : Optional[Dict[str, Dict]] = None,
+            max_parts : Optional[int] = None,
+
+        ) -> None :
+
+        self.cache_dir = MESSAGE_CACHE_DIR_ABS_PATH if cache_dir is None else cache_dir
+        self.rules = COUNTERPARTIES if rules is None else rules
+        self.max_parts = MESSAGE_CACHE_MAX_PARTS if max_parts is None else max_parts
+
+        self.rules_hash = rules_hash(self.rules)
+        self.coverage_path = os.path.join(self.cache_dir, "coverage.json")
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self._coverage = self._load_coverage()
+
+
+    # -------------------- Coverage --------------------
+
+    def _load_coverage (self) -> Dict[str, Set[dt.date]] :
+
+        try :
+
+            with open(self.coverage_path, "r", encoding="utf-8") as f :
+                state = json.load(f)
+
+        except (OSError, ValueError) :
+            return {}
+
+        if state.get("rules_hash") != self.rules_hash :
+            return {}
+
+        return {
+
+            mailbox : {dt.date.fromisoformat(d) for d in dates}
+            for mailbox, dates in (state.get("mailboxes") or {}).items()
+
+        }
+
+
+    def _save_coverage (self) -> None :
+
+        state = {
+
+            "rules_hash" : self.rules_hash,
+            "mailboxes" : {mailbox : sorted(d.isoformat() for d in dates) for mailbox, dates in self._coverage.items()},
+
+        }
+
+        tmp = f"{self.coverage_path}.{uuid.uuid4().hex}.tmp"
+
+        with open(tmp, "w", encoding="utf-8") as f :
+            json.dump(state, f, indent=2)
+
+        os.replace(tmp, self.coverage_path)
+
+
+    def missing_dates (self, mailbox : str, dates : Iterable[dt.date]) -> List[dt.date] :
+        """
+        Days of `dates` not fully listed yet for `mailbox`.
+        """
+        covered = self._coverage.get(mailbox, set())
+        return sorted(d for d in dates if d not in covered)
+
+
+    def mark_covered (self, mailbox : str, dates : Iterable[dt.date]) -> None :
+        """
+        Record days as fully listed. Today (UTC) and later are never recorded: mail can still arrive.
+        """
+        today = dt.datetime.now(dt.timezone.utc).date()
+
+        self._coverage.setdefault(mailbox, set()).update(d for d in dates if d < today)
+        self._save_coverage()
+
+
+    # -------------------- Storage --------------------
+
+    def _parts (self) -> List[str] :
+        return sorted(glob.glob(os.path.join(self.cache_dir, "part-*.parquet")))
+
+
+    def _write_part (self, df : pl.DataFrame) -> str :
+
+        name = f"part-{dt.datetime.now(dt.timezone.utc).strftime('%Y%m%d%H%M%S%f')}-{uuid.uuid4().hex[:8]}.parquet"
+        path = os.path.join(self.cache_dir, name)
+        tmp = f"{path}.tmp"
+
+        df.write_parquet(tmp)
+        os.replace(tmp, path)
+
+        return path
+
+
+    @staticmethod
+    def _conform (df : pl.DataFrame) -> pl.DataFrame :
+        """
+        Cast a listing frame to `EMAIL_COLUMNS` (missing columns become null).
+        """
+        return df.select(
+
+            pl.col(name).cast(dtype, strict=False) if name in df.columns else pl.lit(None, dtype=dtype).alias(name)
+            for name, dtype in EMAIL_COLUMNS.items()
+
+        )
+
+
+    def load (
+
+            self,
+            mailboxes : Optional[Iterable[str]] = None,
+            start_date : Optional[dt.date] = None,
+            end_date : Optional[dt.date] = None,
+
+        ) -> pl.DataFrame :
+        """
+        Latest cached row per (Shared Email, Id), optionally restricted to mailboxes / received days.
+        """
+        parts = self._parts()
+
+        if not parts :
+            return pl.DataFrame(schema=CACHE_COLUMNS)
+
+        # Parts written before a column was added read it as null
+        lf = pl.scan_parquet(parts, schema=CACHE_COLUMNS, missing_columns="insert", extra_columns="ignore")
+
+        if mailboxes is not None :
+            lf = lf.filter(pl.col("Shared Email").is_in(list(mailboxes)))
+
+        if start_date is not None :
+            lf = lf.filter(pl.col("Received Date") >= start_date)
+
+        if end_date is not None :
+            lf = lf.filter(pl.col("Received Date") <= end_date)
+
+        return (
+            lf.sort("Cached At", maintain_order=True)
+            .unique(subset=["Shared Email", "Id"], keep="last", maintain_order=True)
+            .collect()
+        )
+
+
+    def compact (self) -> None :
+        """
+        Fold every part into one (latest row per key wins).
+        """
+        parts = self._parts()
+
+        if len(parts) <= 1 :
+            return
+
+        df = self.load()
+        self._write_part(df)
+
+        for path in parts :
+            os.remove(path)
+
+
+    # -------------------- Ingest --------------------
+
+    def ingest (self, df : Optional[pl.DataFrame]) -> int :
+        """
+        Classify the listed rows that are new, cached under other rules, or changed
+        since cached (`--refresh`, delta "updated"), and upsert them; unchanged rows
+        are left alone. Attachment metadata the listing lacks (not expanded) is kept
+        from the cached row before comparing.
+        Returns the number of newly classified messages.
+        """
+        if df is None or df.is_empty() :
+            return 0
+
+        listed = self._conform(df).unique(subset=["Shared Email", "Id"], keep="last", maintain_order=True)
+
+        known = self.load(mailboxes=listed["Shared Email"].unique().to_list())
+        known = known.select(
+
+            "Shared Email", "Id", "Rules Hash",
+            *[pl.col(name).alias(f"Cached {name}") for name in EMAIL_COLUMNS if name not in ("Shared Email", "Id")],
+
+        )
+
+        listed = listed.join(known, on=["Shared Email", "Id"], how="left").with_columns(
+
+            pl.coalesce("Attachments Meta", "Cached Attachments Meta").alias("Attachments Meta"),
+            pl.coalesce("Attachment Names", "Cached Attachment Names").alias("Attachment Names"),
+
+        )
+
+        fresh = listed.filter(
+
+            pl.col("Rules Hash").is_null()
+            | (pl.col("Rules Hash") != self.rules_hash)
+            | pl.any_horizontal(
+
+                pl.col(name).ne_missing(pl.col(f"Cached {name}"))
+                for name in EMAIL_COLUMNS if name not in ("Shared Email", "Id")
+
+            )
+
+        ).select(list(EMAIL_COLUMNS))
+
+        if fresh.is_empty() :
+            return 0
+
+        classified = classify_messages(fresh, self.rules).with_columns(
+
+            pl.col("Received DateTime").cast(pl.Utf8).str.slice(0, 10).str.strptime(pl.Date, "%Y-%m-%d", strict=False).alias("Received Date"),
+            pl.lit(self.rules_hash).alias("Rules Hash"),
+            pl.lit(dt.datetime.now()).cast(pl.Datetime("us")).alias("Cached At"),
+
+        )
+
+        # Appended after the cached rows, so `load` (latest "Cached At" per key) sees only these
+        self._write_part(classified.select(list(CACHE_COLUMNS)))
+
+        if len(self._parts()) > self.max_parts :
+            self.compact()
+
+        return classified.height
+
+
+    def classified (
+
+            self,
+            mailboxes : Iterable[str],
+            start_date : dt.date,
+            end_date : dt.date,
+
+        ) -> pl.DataFrame :
+        """
+        Cached messages of `mailboxes` over the span, with their current-rules assignment.
+        """
+        df = self.load(mailboxes, start_date, end_date)
+        stale = df.filter(pl.col("Rules Hash") != self.rules_hash)
+
+        if not stale.is_empty() :
+
+            self.ingest(stale)
+            df = self.load(mailboxes, start_date, end_date)
+
+        return df
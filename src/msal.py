@@ -1,171 +1,1399 @@
 from __future__ import annotations
 
 import os
+import re
 import requests
 import base64
-import msal
-import jwt
+import uuid
+import random
 import json
+import time
+import threading
+import hashlib
 import datetime as dt
 import polars as pl
 
-from typing import Dict, List, Optional, Any, Tuple, Union
+from typing import Dict, List, Optional, Any, Tuple, Union, Callable, Iterator
+from contextlib import contextmanager
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
 
 from src.config import (
     APPLICATION_ID, SECRET_VALUE_ID, AUTHORITY, SCOPES, GRAPH_BASE,
-    SHARED_MAILS, EMAIL_COLUMNS, SHARED_MAIL_1
+    SHARED_MAILS, EMAIL_COLUMNS, SHARED_MAIL_1, COUNTERPARTIES, GRAPH_PAGE_SIZE, INBOX_SERVER_FILTER,
+    TOKEN_CACHE_ABS_PATH, TOKEN_REFRESH_MARGIN, GRAPH_POOL_SIZE, GRAPH_TIMEOUT,
+    GRAPH_BATCH_LIMIT, DELTA_STATE_DIR_ABS_PATH, DOWNLOAD_WORKERS, INBOX_CHUNK_DAYS,
+    ATTACHMENT_STREAM, ATTACHMENT_CHUNK_SIZE, GRAPH_MAX_IN_FLIGHT, GRAPH_AIMD_STEP,
+    GRAPH_MAX_RETRIES, GRAPH_BACKOFF_BASE, GRAPH_BACKOFF_MAX
 )
-from src.utils import date_to_str
+from src.utils import date_to_str, str_to_date
+from src.manifest import AttachmentManifest
+
+
+# Attachment listing without contentBytes (content is then streamed through /$value)
+ATTACHMENT_METADATA_PARAMS = {"$select" : "id,name,contentType,size,isInline"}
+
+
+class TokenProvider :
+    """
+    Process-wide client-credentials token provider.
+
+    Reuses a single MSAL application and serves the cached access token until
+    `margin` seconds before it expires. The MSAL cache can optionally be
+    persisted to disk so that short-lived runs reuse a still valid token.
+
+    `token_endpoint` replaces MSAL by a plain client-credentials call to that URL;
+    it is never read from the configuration, only passed explicitly (the local
+    Graph stand-in of bench/ installs such a provider with `set_token_provider`).
+    """
+
+    def __init__ (
+            
+            self,
+            scopes : Optional[List] = None,
+            app_id : Optional[str] = None,
+            authority : Optional[str] = None,
+            secret : Optional[str] = None,
+
+            cache_path : Optional[str] = None,
+            margin : Optional[int] = None,
+            token_endpoint : Optional[str] = None,
+            scheduler : Optional[RequestScheduler] = None,
+        
+        ) -> None :
+
+        self.scopes = SCOPES if scopes is None else scopes
+
+        self.app_id = APPLICATION_ID if app_id is None else app_id
+        self.authority = AUTHORITY if authority is None else authority
+        self.secret = SECRET_VALUE_ID if secret is None else secret
+
+        self.cache_path = TOKEN_CACHE_ABS_PATH if cache_path is None else cache_path
+        self.margin = TOKEN_REFRESH_MARGIN if margin is None else margin
+        self.token_endpoint = token_endpoint
+
+        # Token calls get their own limit and backoff (another host than Graph)
+        self.scheduler = RequestScheduler() if scheduler is None else scheduler
+
+        self._lock = threading.RLock()
+        self._app = None
+        self._cache = None
+        self._timer = None
+
+        self._token : Optional[str] = None
+        self._expires_at : float = 0.0
+
+
+    def _get_app (self) :
+        """
+        Build the MSAL application once, loading the persisted cache if any.
+        """
+        if self._app is not None :
+            return self._app
+
+        # Imported here: runs served from a token endpoint or the caches never load MSAL
+        import msal
+
+        self._cache = msal.SerializableTokenCache()
+
+        if self.cache_path and os.path.exists(self.cache_path) :
+
+            try :
+
+                with open(self.cache_path, "r", encoding="utf-8") as f :
+                    self._cache.deserialize(f.read())
+            
+            except (OSError, ValueError) as e :
+                print(f"\n[-] Ignoring unreadable token cache {self.cache_path}: {e}")
+
+        self._app = msal.ConfidentialClientApplication(
+
+            client_id=self.app_id,
+            authority=self.authority,
+            client_credential=self.secret,
+            token_cache=self._cache
+
+        )
+
+        return self._app
+
+
+    def _persist_cache (self) -> None :
+        """
+        Write the MSAL cache to disk (atomically) when it changed.
+        """
+        if not self.cache_path or self._cache is None or not self._cache.has_state_changed :
+            return
+        
+        directory = os.path.dirname(self.cache_path)
+
+        if directory :
+            os.makedirs(directory, exist_ok=True)
+
+        tmp_path = f"{self.cache_path}.{uuid.uuid4().hex}.tmp"
+
+        # Holds live access and refresh tokens: readable by the owner only
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+
+        try :
+
+            with os.fdopen(fd, "w", encoding="utf-8") as f :
+                f.write(self._cache.serialize())
+
+            os.replace(tmp_path, self.cache_path)
+
+        except BaseException :
+
+            if os.path.exists(tmp_path) :
+                os.remove(tmp_path)
+
+            raise
+
+
+    def _drop_cached_access_tokens (self) -> None :
+        """
+        Remove access tokens from the MSAL cache so the next call hits the network.
+        """
+        if self._cache is None :
+            return
+
+        import msal
+
+        for at in list(self._cache.search(msal.TokenCache.CredentialType.ACCESS_TOKEN)) :
+            self._cache.remove_at(at)
+
+
+    def _acquire_from_endpoint (self) -> Dict[str, Any] :
+        """
+        Plain client-credentials grant against `token_endpoint` (no MSAL, no cache),
+        retried on throttling and transient failures by the provider's scheduler.
+        """
+        response = self.scheduler.execute(lambda : requests.post(
+
+            self.token_endpoint,
+            data={
+                "grant_type" : "client_credentials",
+                "client_id" : self.app_id,
+                "client_secret" : self.secret,
+                "scope" : " ".join(self.scopes),
+            },
+            timeout=GRAPH_TIMEOUT
+
+        ))
+
+        try :
+            return response.json()
+        
+        except ValueError :
+            return {"error" : response.status_code, "error_description" : response.text}
+
+
+    def _acquire (self, force_refresh : bool = False) -> str :
+        """
+        Acquire a token through MSAL (which serves its own cache first).
+        Raises when no token could be obtained.
+        """
+        if self.token_endpoint :
+            result = self._acquire_from_endpoint()
+
+        else :
+
+            app = self._get_app()
+
+            if force_refresh :
+                self._drop_cached_access_tokens()
+
+            result = app.acquire_token_for_client(scopes=self.scopes)
+
+            # MSAL may hand back a cached token that is already inside our margin
+            if "access_token" in result and int(result.get("expires_in", 0)) <= self.margin :
+
+                self._drop_cached_access_tokens()
+                result = app.acquire_token_for_client(scopes=self.scopes)
+
+        if "access_token" not in result :
+            raise Exception(f"Failed to acquire token ({result.get('error')}): {result.get('error_description')}")
+
+        if result.get("token_source") != "cache" :
+
+            print("\n[+] Token acquired successfully")
+            print(result["access_token"][:30] + "...")  # Print just token first 30 letters
+
+        self._token = result["access_token"]
+        self._expires_at = time.time() + int(result.get("expires_in", 0))
+
+        self._persist_cache()
+
+        return self._token
+
+
+    def get_token (self, force_refresh : bool = False) -> str :
+        """
+        Return a valid access token, acquiring a new one only when needed.
+        """
+        with self._lock :
+
+            if not force_refresh and self._token and time.time() < self._expires_at - self.margin :
+                return self._token
+
+            return self._acquire(force_refresh=force_refresh)
+
+
+    def start_background_refresh (self) -> None :
+        """
+        Keep the token fresh during long runs by refreshing it just before it goes stale.
+        """
+        with self._lock :
+
+            if self._timer is not None :
+                return
+
+            self.get_token()
+            self._schedule_refresh()
+
+
+    def stop_background_refresh (self) -> None :
+        """
+        Cancel the pending background refresh, if any.
+        """
+        with self._lock :
+
+            if self._timer is not None :
+                self._timer.cancel()
+            
+            self._timer = None
+
+
+    def _schedule_refresh (self) -> None :
+
+        delay = max(self._expires_at - self.margin - time.time(), 5.0)
+
+        self._timer = threading.Timer(delay, self._background_refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+
+    def _background_refresh (self) -> None :
+
+        with self._lock :
+
+            if self._timer is None :
+                return
+
+            try :
+                self.get_token()
+            
+            except Exception as e :
+                print(f"\n[-] Background token refresh failed: {e}")
+
+            self._schedule_refresh()
+
+
+
+_TOKEN_PROVIDERS : Dict[Tuple, TokenProvider] = {}
+_TOKEN_PROVIDERS_LOCK = threading.Lock()
+
+
+def _provider_key (scopes : List, app_id : str, authority : str, secret : str) -> Tuple :
+
+    # The secret itself is not kept in the key
+    return (app_id, authority, tuple(scopes), hashlib.sha256(str(secret).encode()).hexdigest())
+
+
+def set_token_provider (provider : TokenProvider) -> None :
+    """
+    Install `provider` as the shared provider of its credentials (e.g. one built
+    with the `token_endpoint` of a local Graph stand-in).
+    """
+    with _TOKEN_PROVIDERS_LOCK :
+        _TOKEN_PROVIDERS[_provider_key(provider.scopes, provider.app_id, provider.authority, provider.secret)] = provider
+
+
+def get_token_provider (
+        
+        scopes : Optional[List] = None,
+        app_id : Optional[str] =  None,
+        authority : Optional[str] = None,
+        secret :  Optional[str] = None
+    
+    ) -> TokenProvider :
+    """
+    Return the shared provider for these credentials, building it on first use
+    (a rotated secret gets a provider of its own).
+    """
+    scopes = SCOPES if scopes is None else scopes
+    
+    app_id = APPLICATION_ID if app_id is None else app_id
+    authority = AUTHORITY if authority is None else authority
+    secret = SECRET_VALUE_ID if secret is None else secret
+
+    key = _provider_key(scopes, app_id, authority, secret)
+
+    with _TOKEN_PROVIDERS_LOCK :
+
+        provider = _TOKEN_PROVIDERS.get(key)
+
+        if provider is None :
+
+            provider = TokenProvider(scopes=scopes, app_id=app_id, authority=authority, secret=secret)
+            _TOKEN_PROVIDERS[key] = provider
+    
+    return provider
 
 
 def get_token (
         
-        scopes : Optional[List] = None,
-        app_id : Optional[str] =  None,
-        authority : Optional[str] = None,
-        secret :  Optional[str] = None
+        scopes : Optional[List] = None,
+        app_id : Optional[str] =  None,
+        authority : Optional[str] = None,
+        secret :  Optional[str] = None,
+
+        force_refresh : bool = False
+    
+    ) -> str :
+    """
+    Function get token from the applcation (served from the shared, expiry-aware cache)
+    """
+    provider = get_token_provider(scopes, app_id, authority, secret)
+
+    return provider.get_token(force_refresh=force_refresh)
+
+
+# Status codes worth retrying, and the ones that mean "slow down"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+THROTTLE_STATUSES = {429, 503}
+
+
+def _retry_after_seconds (headers : Optional[Dict[str, Any]]) -> Optional[float] :
+    """
+    Parse a Retry-After header (delta-seconds or HTTP-date).
+    """
+    if not headers :
+        return None
+
+    value = None
+
+    for key, val in headers.items() :
+
+        if str(key).lower() == "retry-after" :
+            value = str(val).strip()
+
+    if not value :
+        return None
+
+    try :
+        return max(0.0, float(value))
+
+    except ValueError :
+        pass
+
+    try :
+
+        when = parsedate_to_datetime(value)
+        return max(0.0, (when - dt.datetime.now(dt.timezone.utc)).total_seconds())
+
+    except (TypeError, ValueError) :
+        return None
+
+
+class RequestScheduler :
+    """
+    Throttling-aware scheduler shared by every Graph call.
+
+    - retries 429/5xx and connection errors, honouring Retry-After, otherwise
+      with jittered exponential backoff
+    - bounds the requests in flight with AIMD: the limit grows by about `step`
+      per round trip of successes and is halved on throttling
+    - counts requests, retries, throttled responses and time spent waiting
+    """
+
+    def __init__ (
+
+            self,
+            max_in_flight : Optional[int] = None,
+            step : Optional[float] = None,
+            max_retries : Optional[int] = None,
+            backoff_base : Optional[float] = None,
+            backoff_max : Optional[float] = None,
+
+        ) -> None :
+
+        self.max_in_flight = GRAPH_MAX_IN_FLIGHT if max_in_flight is None else max_in_flight
+        self.step = GRAPH_AIMD_STEP if step is None else step
+        self.max_retries = GRAPH_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_base = GRAPH_BACKOFF_BASE if backoff_base is None else backoff_base
+        self.backoff_max = GRAPH_BACKOFF_MAX if backoff_max is None else backoff_max
+
+        self.limit = float(self.max_in_flight)
+
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._pause_until = 0.0
+        self._last_decrease = 0.0
+
+        self._stats = {"requests" : 0, "retries" : 0, "throttled" : 0, "errors" : 0, "wait_seconds" : 0.0}
+
+
+    def stats (self) -> Dict[str, Any] :
+        """
+        Snapshot of the counters plus the current concurrency limit.
+        """
+        with self._cond :
+            return dict(self._stats, limit=round(self.limit, 2), in_flight=self._in_flight)
+
+
+    def _acquire (self) -> None :
+
+        with self._cond :
+
+            while True :
+
+                now = time.monotonic()
+
+                if now < self._pause_until :
+                    self._cond.wait(self._pause_until - now)
+                
+                elif self._in_flight >= max(1, int(self.limit)) :
+                    self._cond.wait()
+
+                else :
+                    break
+
+            self._in_flight += 1
+            self._stats["requests"] += 1
+
+
+    def _release (self, throttled : bool = False, retry_after : Optional[float] = None) -> None :
+
+        with self._cond :
+
+            self._in_flight -= 1
+            now = time.monotonic()
+
+            if throttled :
+
+                self._stats["throttled"] += 1
+
+                # Halve at most once per burst of throttled responses
+                if now - self._last_decrease > 1.0 :
+
+                    self.limit = max(1.0, self.limit / 2)
+                    self._last_decrease = now
+
+                if retry_after :
+                    self._pause_until = max(self._pause_until, now + retry_after)
+
+            else :
+                self.limit = min(float(self.max_in_flight), self.limit + self.step / max(self.limit, 1.0))
+
+            self._cond.notify_all()
+
+
+    def backoff (self, attempt : int, retry_after : Optional[float] = None) -> float :
+        """
+        Delay before retry number `attempt` (0-based): Retry-After when given, else full jitter.
+        """
+        if retry_after is not None :
+            return min(retry_after, self.backoff_max)
+
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+
+    def wait (self, delay : float) -> None :
+        """
+        Sleep before a retry and account for it.
+        """
+        with self._cond :
+
+            self._stats["retries"] += 1
+            self._stats["wait_seconds"] += delay
+
+        time.sleep(delay)
+
+
+    def note_throttled (self, retry_after : Optional[float] = None) -> None :
+        """
+        Feed a throttling signal observed outside `execute` (e.g. a $batch sub-response).
+        """
+        with self._cond :
+            self._in_flight += 1
+
+        self._release(throttled=True, retry_after=retry_after)
+
+
+    def execute (self, send : Callable[[], requests.Response], hold : bool = False) -> requests.Response :
+        """
+        Run `send` under the concurrency limit, retrying throttled/transient failures.
+        The last response is returned as-is once retries are exhausted.
+
+        hold: keep the in-flight slot of the returned response (see `stream`)
+        """
+        attempt = 0
+
+        while True :
+
+            self._acquire()
+
+            try :
+                response = send()
+
+            except (requests.ConnectionError, requests.Timeout) :
+
+                self._release()
+
+                with self._cond :
+                    self._stats["errors"] += 1
+
+                if attempt >= self.max_retries :
+                    raise
+
+                self.wait(self.backoff(attempt))
+                attempt += 1
+
+                continue
+
+            retry_after = _retry_after_seconds(response.headers)
+            throttled = response.status_code in THROTTLE_STATUSES
+            done = response.status_code not in RETRY_STATUSES or attempt >= self.max_retries
+
+            if not (hold and done) :
+                self._release(throttled=throttled, retry_after=retry_after if throttled else None)
+
+            if done :
+                return response
+
+            response.close()
+
+            self.wait(self.backoff(attempt, retry_after))
+            attempt += 1
+
+
+    @contextmanager
+    def stream (self, send : Callable[[], requests.Response]) -> Iterator[requests.Response] :
+        """
+        `execute` for a response whose body is read by the caller (`stream=True`).
+
+        The in-flight slot is held until the block exits, so large downloads count
+        against the limit; a body read cut by the server or the network counts as
+        throttling. The response is closed on exit.
+        """
+        response = self.execute(send, hold=True)
+
+        throttled = response.status_code in THROTTLE_STATUSES
+        retry_after = _retry_after_seconds(response.headers) if throttled else None
+
+        try :
+            yield response
+
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) :
+
+            with self._cond :
+                self._stats["errors"] += 1
+
+            throttled = True
+            raise
+
+        finally :
+
+            response.close()
+            self._release(throttled=throttled, retry_after=retry_after)
+
+
+
+class GraphClient :
+    """
+    Shared Graph API client.
+
+    Holds one pooled, keep-alive `requests.Session` so that listing pages and
+    attachment calls reuse TCP/TLS connections instead of reconnecting, and
+    sends every request through a throttling-aware `RequestScheduler`.
+    """
+
+    def __init__ (
+            
+            self,
+            graph_base : Optional[str] = None,
+            pool_size : Optional[int] = None,
+            timeout : Optional[float] = None,
+            token_provider : Optional[TokenProvider] = None,
+            scheduler : Optional[RequestScheduler] = None,
+        
+        ) -> None :
+
+        self.graph_base = GRAPH_BASE if graph_base is None else graph_base
+        self.scheduler = RequestScheduler() if scheduler is None else scheduler
+        self.pool_size = GRAPH_POOL_SIZE if pool_size is None else pool_size
+        self.timeout = GRAPH_TIMEOUT if timeout is None else timeout
+        self.token_provider = token_provider
+
+        # Set once Graph rejects the counterparty $filter, so later listings skip it
+        self.server_filter_rejected = False
+
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.session.headers.update(
+
+            {
+                "Accept" : "application/json",
+                "Accept-Encoding" : "gzip, deflate",
+            }
+
+        )
+
+
+    def url (self, path : str) -> str :
+        """
+        Absolute URL for a Graph path (absolute URLs such as nextLink are kept as-is).
+        """
+        if path.startswith("http://") or path.startswith("https://") :
+            return path
+        
+        return f"{self.graph_base}/{path.lstrip('/')}"
+
+
+    def _auth_headers (self, token : Optional[str] = None) -> Dict[str, str] :
+
+        if token is None :
+            token = self.token_provider.get_token() if self.token_provider is not None else get_token()
+
+        return {"Authorization": f"Bearer {token}"}
+
+
+    def request (
+            
+            self,
+            method : str,
+            url : str,
+            token : Optional[str] = None,
+            headers : Optional[Dict[str, str]] = None,
+            **kwargs
+        
+        ) -> requests.Response :
+        """
+        Send a request through the pooled session with auth and the default timeout,
+        retried by the scheduler on throttling and transient failures.
+        Bodies read incrementally go through `stream` instead.
+        """
+        return self.scheduler.execute(self._sender(method, url, token, headers, **kwargs))
+
+
+    def stream (
+            
+            self,
+            url : str,
+            token : Optional[str] = None,
+            method : str = "GET",
+            headers : Optional[Dict[str, str]] = None,
+            **kwargs
+        
+        ) :
+        """
+        Context manager over a streamed response (`with client.stream(url) as r`):
+        the scheduler slot is held until the body is read and the block exits.
+        """
+        return self.scheduler.stream(self._sender(method, url, token, headers, stream=True, **kwargs))
+
+
+    def _sender (
+            
+            self,
+            method : str,
+            url : str,
+            token : Optional[str] = None,
+            headers : Optional[Dict[str, str]] = None,
+            **kwargs
+        
+        ) -> Callable[[], requests.Response] :
+
+        kwargs.setdefault("timeout", self.timeout)
+
+        def send () -> requests.Response :
+
+            # Resolved per attempt so a retry after a long wait gets a fresh token
+            all_headers = self._auth_headers(token)
+            all_headers.update(headers or {})
+
+            return self.session.request(method, self.url(url), headers=all_headers, **kwargs)
+
+        return send
+
+
+    def get (self, url : str, token : Optional[str] = None, **kwargs) -> requests.Response :
+        return self.request("GET", url, token=token, **kwargs)
+
+
+    def post (self, url : str, token : Optional[str] = None, **kwargs) -> requests.Response :
+        return self.request("POST", url, token=token, **kwargs)
+
+
+    def close (self) -> None :
+        self.session.close()
+
+
+
+_GRAPH_CLIENT : Optional[GraphClient] = None
+_GRAPH_CLIENT_LOCK = threading.Lock()
+
+
+def get_graph_client () -> GraphClient :
+    """
+    Return the process-wide Graph client, building it on first use.
+    """
+    global _GRAPH_CLIENT
+
+    with _GRAPH_CLIENT_LOCK :
+
+        if _GRAPH_CLIENT is None :
+            _GRAPH_CLIENT = GraphClient()
+    
+    return _GRAPH_CLIENT
+
+
+def decode_token (token : str) -> List[Dict[str, Any]] :
+
+    if token is None :
+        return None
+
+    import jwt
+    
+    decoded = jwt.decode(token, options={"verify_signature": False})
+    
+    print("\n[*] Token claims :")
+    print("\t[*] roles: ", decoded.get("roles"))
+    print("\t[*] App Id:", decoded.get("appid"))
+    
+    return decoded
+
+
+def _message_row (m : Dict[str, Any], email : str) -> Dict[str, Any] :
+    """
+    Flatten one Graph message into an `EMAIL_COLUMNS` row.
+    """
+    return {
+
+        "Id" : m.get("id"),
+        "Subject" : m.get("subject"),
+        "From" : (m.get("from") or {}).get("emailAddress", {}).get("address"),
+        "Received DateTime" : m.get("receivedDateTime"),
+        "Attachments" : m.get("hasAttachments"),
+        "Shared Email" : str(email),
+        "Attachments Meta" : None if "attachments" not in m else [
+
+            {
+                "id" : a.get("id"),
+                "name" : a.get("name"),
+                "contentType" : a.get("contentType"),
+                "size" : a.get("size"),
+                "isInline" : a.get("isInline"),
+                "odataType" : a.get("@odata.type"),
+            }
+
+            for a in m.get("attachments") or []
+        
+        ],
+        "Attachment Names" : None if "attachments" not in m else [
+
+            a.get("name") for a in m.get("attachments") or [] if not a.get("isInline")
+
+        ],
+    
+    }
+
+
+def _odata_quote (value : str) -> str :
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def build_counterparty_filter (rules : Optional[Dict[str, Dict]] = None) -> Optional[str] :
+    """
+    OData $filter clause keeping only mail a counterparty rule could match.
+
+    The classifier accepts any sender under a rule's domains, derived from its
+    addresses when `domains` is not configured (see `extraction._normalize_rules`).
+    Outlook only supports `eq` on the sender, not `endswith`, so:
+      - a rule relying on derived domains leaves the sender unfiltered
+        (`hasAttachments eq true` only), otherwise same-domain senders the
+        classifier would accept are never listed
+      - explicitly configured `domains` get an `endswith` clause; if Graph rejects
+        it the listing falls back to `hasAttachments eq true` (see `_list_messages`)
+    """
+    rules = COUNTERPARTIES if rules is None else rules
+
+    emails = set()
+    domains = set()
+
+    for rule in (rules or {}).values() :
+
+        rule_emails = {str(e).strip().lower() for e in rule.get("emails", set()) if str(e).strip()}
+        rule_domains = {str(d).strip().lower().lstrip("@") for d in rule.get("domains", set()) if str(d).strip()}
+
+        if rule_emails and not rule_domains :
+            return "hasAttachments eq true"
+
+        emails |= rule_emails
+        domains |= rule_domains
+
+    # Addresses already covered by their domain need no clause of their own
+    emails = {e for e in emails if e.split("@", 1)[-1] not in domains}
+
+    senders = [f"from/emailAddress/address eq {_odata_quote(e)}" for e in sorted(emails)]
+    senders += [f"endswith(from/emailAddress/address,{_odata_quote('@' + d)})" for d in sorted(domains)]
+
+    if not senders :
+        return "hasAttachments eq true"
+
+    return f"hasAttachments eq true and ({' or '.join(senders)})"
+
+
+def _list_messages (
+
+        client : GraphClient,
+        email : str,
+        start : str,
+        end : str,
+
+        token : Optional[str] = None,
+        graph_base : Optional[str] = None,
+        with_attach : bool = False,
+        server_filter : Optional[str] = None,
+
+    ) -> pl.DataFrame :
+    """
+    One filtered, paged Inbox listing for `start <= receivedDateTime < end`.
+
+    `server_filter` is AND-ed to the date range; if Graph rejects it, the listing
+    falls back to `hasAttachments eq true` only, and so do the client's later listings.
+    """
+    graph_base = client.graph_base if graph_base is None else graph_base
+
+    if server_filter and client.server_filter_rejected :
+        server_filter = "hasAttachments eq true"
+
+    # receivedDateTime must come first in $filter since it is the $orderby property
+    filter_str = f"receivedDateTime ge {start} and receivedDateTime lt {end}"
+
+    parameters = {
+        
+        "$orderby": "receivedDateTime ASC",
+        "$select": "id,subject,from,receivedDateTime,hasAttachments",
+        "$filter": filter_str if not server_filter else f"{filter_str} and {server_filter}",
+        "$top": str(GRAPH_PAGE_SIZE)
+
+    }
+
+    if with_attach is True :
+        
+        # Only metadata (id, name, contentType, size, isInline)
+        parameters["$expand"] = "attachments($select=id,name,contentType,size,isInline)"
+
+
+    url = f"{graph_base}/users/{email}/mailFolders/Inbox/messages"
+
+    rows: List[dict] = []
+    
+    while True :
+
+        response = client.get(url, token=token, params=parameters)
+
+        if response.status_code == 400 and server_filter and not rows and parameters is not None :
+
+            if not client.server_filter_rejected :
+                print(f"\n[-] Server-side filter rejected, keeping hasAttachments only for this run : {response.text[:200]}")
+
+            client.server_filter_rejected = True
+            server_filter = None
+            parameters["$filter"] = f"{filter_str} and hasAttachments eq true"
+            continue
+
+        if response.status_code != 200 :
+            raise Exception(f"Graph API error {response.status_code}: {response.text}")
+        
+        data = response.json()
+
+        for m in data.get("value", []) :
+
+            rows.append(_message_row(m, email))
+
+        next_link = data.get("@odata.nextLink")
+
+        if not next_link :
+            #print(f"Break here for {next_link}")
+            break
+        
+        url = next_link
+        parameters = None  # already encoded in nextLink
+
+    df_email = pl.DataFrame(rows, schema=EMAIL_COLUMNS)
+
+    return df_email
+
+
+def get_inbox_messages_by_date (
+
+        date : Optional[str | dt.datetime | dt.date] = None,
+        token : Optional[str] = None,
+        email : Optional[str] = None,
+        graph_base : Optional[str] = None,
+        with_attach : bool = False,
+        format : str = "",
+        client : Optional[GraphClient] = None,
+
+        counterparty_filter : Optional[bool] = None,
+        rules : Optional[Dict[str, Dict]] = None
+
+    ) :
+    """
+    counterparty_filter: let Graph drop mail no counterparty rule can match
+                         (no attachment, unknown sender) before it is transferred
+    """
+    client = get_graph_client() if client is None else client
+    email = SHARED_MAILS[0] if email is None else email
+    counterparty_filter = INBOX_SERVER_FILTER if counterparty_filter is None else counterparty_filter
+
+    date = date_to_str(date)
+    start, end = get_day_bounds(date)
+
+    server_filter = build_counterparty_filter(rules) if counterparty_filter else None
+
+    return _list_messages(client, email, start, end, token=token, graph_base=graph_base, with_attach=with_attach, server_filter=server_filter)
+
+
+def get_inbox_messages_by_range (
+
+        start_date : str | dt.datetime | dt.date,
+        end_date : str | dt.datetime | dt.date,
+        token : Optional[str] = None,
+        emails : Optional[List[str]] = None,
+
+        with_attach : bool = False,
+        chunk_days : Optional[int] = None,
+        max_workers : Optional[int] = None,
+
+        client : Optional[GraphClient] = None,
+
+        counterparty_filter : Optional[bool] = None,
+        rules : Optional[Dict[str, Dict]] = None
+
+    ) -> pl.DataFrame :
+    """
+    List every mailbox over [start_date, end_date] (both days included).
+
+    One filtered, paged query per mailbox for the whole span, or per `chunk_days`
+    chunk when given; mailboxes/chunks run concurrently and the frames are
+    concatenated once. Use `partition_by_received_date` to split per day.
+    With `counterparty_filter`, only mail with attachments from a configured
+    sender address/domain is transferred.
+    """
+    client = get_graph_client() if client is None else client
+    emails = SHARED_MAILS if emails is None else emails
+    chunk_days = INBOX_CHUNK_DAYS if chunk_days is None else chunk_days
+    max_workers = DOWNLOAD_WORKERS if max_workers is None else max_workers
+    counterparty_filter = INBOX_SERVER_FILTER if counterparty_filter is None else counterparty_filter
+
+    server_filter = build_counterparty_filter(rules) if counterparty_filter else None
+
+    if chunk_days :
+        chunks = build_chunks(start_date, end_date, days=chunk_days)
+    
+    else :
+        chunks = build_chunks(start_date, end_date, days=(str_to_date(end_date) - str_to_date(start_date)).days + 1)
+
+    tasks = [(email, start, end) for email in emails for start, end in chunks]
+    frames : List[pl.DataFrame] = []
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tasks)))) as pool :
+
+        futures = [
+
+            pool.submit(_list_messages, client, email, start, end, token, None, with_attach, server_filter)
+            for email, start, end in tasks
+
+        ]
+
+        for future in futures :
+
+            df = future.result()
+
+            if not df.is_empty() :
+                frames.append(df)
+
+    if not frames :
+        return pl.DataFrame(schema=EMAIL_COLUMNS)
+
+    return pl.concat(frames, how="vertical_relaxed")
+
+
+def _delta_state_path (email : str, folder : str, state_dir : str) -> str :
+
+    safe = re.sub(r"[^A-Za-z0-9._-]+", "_", f"{email}_{folder}")
+    return os.path.join(state_dir, f"delta_{safe}.json")
+
+
+def _load_delta_link (path : str) -> Optional[str] :
+
+    if not os.path.exists(path) :
+        return None
+
+    try :
+
+        with open(path, "r", encoding="utf-8") as f :
+            return json.load(f).get("deltaLink")
+    
+    except (OSError, ValueError) as e :
+
+        print(f"\n[-] Ignoring unreadable delta state {path}: {e}")
+        return None
+
+
+def _save_delta_link (path : str, delta_link : str) -> None :
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+
+    with open(tmp_path, "w", encoding="utf-8") as f :
+        json.dump({"deltaLink" : delta_link, "updated_at" : dt.datetime.now().isoformat(timespec="seconds")}, f, indent=2)
+
+    os.replace(tmp_path, path)
+
+
+def get_inbox_messages_delta (
+
+        email : Optional[str] = None,
+        token : Optional[str] = None,
+        since : Optional[str | dt.datetime | dt.date] = None,
+
+        folder : str = "Inbox",
+        state_dir : Optional[str] = None,
+        reset : bool = False,
+        
+        client : Optional[GraphClient] = None
+
+    ) -> pl.DataFrame :
+    """
+    Incremental listing of a shared mailbox folder through `messages/delta`.
+
+    The first sync (or `reset`) starts from `since` (receivedDateTime lower bound);
+    afterwards only messages added or changed since the stored deltaLink are returned.
+    The deltaLink is persisted in `state_dir` once the round is complete.
+
+    Returns the same `EMAIL_COLUMNS` frame as `get_inbox_messages_by_date`.
+    """
+    client = get_graph_client() if client is None else client
+    email = SHARED_MAILS[0] if email is None else email
+    state_dir = DELTA_STATE_DIR_ABS_PATH if state_dir is None else state_dir
+
+    state_path = _delta_state_path(email, folder, state_dir) if state_dir else None
+    delta_link = None if (reset or state_path is None) else _load_delta_link(state_path)
+
+    def initial_request () -> Tuple[str, Dict[str, str]] :
+
+        parameters = {"$select" : "id,subject,from,receivedDateTime,hasAttachments"}
+
+        if since is not None :
+            parameters["$filter"] = f"receivedDateTime ge {get_day_bounds(date_to_str(since))[0]}"
+
+        return f"/users/{email}/mailFolders/{folder}/messages/delta", parameters
+
+    if delta_link :
+        url, parameters = delta_link, None
+    
+    else :
+        url, parameters = initial_request()
+
+    headers = {"Prefer" : "odata.maxpagesize=200"}
+    rows : List[dict] = []
+
+    while True :
+
+        response = client.get(url, token=token, params=parameters, headers=headers)
+
+        # Expired / invalid sync state: start over with a full initial round
+        if response.status_code == 410 and delta_link :
+
+            print(f"\n[-] Delta state expired for {email}, resyncing from scratch")
+
+            delta_link = None
+            rows = []
+            url, parameters = initial_request()
+            continue
+
+        if response.status_code != 200 :
+            raise Exception(f"Graph API error {response.status_code}: {response.text}")
+        
+        data = response.json()
+
+        for m in data.get("value", []) :
+
+            # Deleted / moved out of the folder
+            if "@removed" in m :
+                continue
+
+            rows.append(_message_row(m, email))
+
+        next_link = data.get("@odata.nextLink")
+
+        if next_link :
+
+            url = next_link
+            parameters = None  # already encoded in nextLink
+            continue
+
+        new_delta_link = data.get("@odata.deltaLink")
+
+        if new_delta_link and state_path :
+            _save_delta_link(state_path, new_delta_link)
+
+        break
+
+    return pl.DataFrame(rows, schema=EMAIL_COLUMNS)
+
+
+def partition_by_received_date (
+        
+        df : pl.DataFrame,
+        column : str = "Received DateTime",
     
-    ) -> Optional[str] :
+    ) -> Dict[dt.date, pl.DataFrame] :
     """
-    Function get token from the applcation 
+    Split an inbox frame by the (UTC) day of its received timestamp.
     """
-    scopes = SCOPES if scopes is None else scopes
+    if df is None or df.is_empty() :
+        return {}
+    
+    keyed = df.with_columns(
 
-    app_id = APPLICATION_ID if app_id is None else app_id
-    authority = AUTHORITY if authority is None else authority
-    secret = SECRET_VALUE_ID if secret is None else secret
+        pl.col(column).cast(pl.Utf8).str.slice(0, 10).str.strptime(pl.Date, "%Y-%m-%d", strict=False).alias("_received_date")
     
-    app = msal.ConfidentialClientApplication(
+    )
 
-        client_id=app_id,
-        authority=authority,
-        client_credential=secret
+    parts = keyed.partition_by("_received_date", as_dict=True, include_key=False)
+
+    return {key[0] : part for key, part in parts.items() if key[0] is not None}
 
-    )
 
-    result = app.acquire_token_for_client(
+def _needs_fetch (att : Dict[str, Any]) -> bool :
+    """
+    True when the listing entry alone is not enough to save the attachment
+    (file attachments without inline bytes are streamed instead, see `_needs_stream`).
+    """
+    odata_type = att.get("@odata.type", "").lower()
 
-        scopes=scopes
+    if odata_type.endswith("fileattachment") :
+        return False
+    
+    return not odata_type.endswith("referenceattachment")
 
-    )
 
+def _needs_stream (att : Dict[str, Any]) -> bool :
+    """
+    True for file attachments listed without their content (metadata-only listing or too large).
+    """
+    odata_type = att.get("@odata.type", "").lower()
+
+    return odata_type.endswith("fileattachment") and not att.get("contentBytes")
+
+
+def _attachment_name (att : Dict[str, Any]) -> str :
+    return att.get("name") or att.get("contentType") or f"attachment-{att.get('id')}"
+
+
+def _stream_attachment (
         
-    if "access_token" in result :
+        client : GraphClient,
+        attachment_url : str,
+        out_dir : str,
+        name : str,
 
-        print("\n[+] Token acquired successfully")
-        print(result["access_token"][:30] + "...")  # Print just token first 30 letters
+        token : Optional[str] = None,
+        chunk_size : Optional[int] = None,
     
-    else :
+    ) -> str :
+    """
+    Stream the raw bytes of `attachment_url`/$value to `out_dir`/`name`.
 
-        print("\n[-] Failed to acquire token\n")
-        print(result.get("error_description"))
+    Chunks go to a temporary file in the same folder which is then renamed
+    atomically, so a reader never sees a half-written workbook.
+    """
+    chunk_size = ATTACHMENT_CHUNK_SIZE if chunk_size is None else chunk_size
+    path = os.path.join(out_dir, name)
 
-    return result.get("access_token", None)
+    # The scheduler slot is held while the body downloads
+    with client.stream(f"{attachment_url}/$value", token=token) as r :
 
+        r.raise_for_status()
 
-def decode_token (token : str) -> List[Dict[str, Any]] :
+        tmp_path = os.path.join(out_dir, f".{name}.{uuid.uuid4().hex}.part")
 
-    if token is None :
-        return None
-    
-    decoded = jwt.decode(token, options={"verify_signature": False})
-    
-    print("\n[*] Token claims :")
-    print("\t[*] roles: ", decoded.get("roles"))
-    print("\t[*] App Id:", decoded.get("appid"))
-    
-    return decoded
+        try :
 
+            with open(tmp_path, "xb") as f :
 
-def get_inbox_messages_by_date (
+                for chunk in r.iter_content(chunk_size=chunk_size) :
+                    f.write(chunk)
 
-        date : Optional[str | dt.datetime | dt.date] = None,
-        token : Optional[str] = None,
-        email : Optional[str] = None,
-        graph_base : Optional[str] = None,
-        with_attach : bool = False,
-        format : str = ""
+            os.replace(tmp_path, path)
 
-    ) :
+        except BaseException :
+
+            if os.path.exists(tmp_path) :
+                os.remove(tmp_path)
+
+            raise
+
+    print("[+] Saved (streamed) fileAttachment ->", path)
+
+    return path
+
+
+def _write_file (path : str, data : bytes | str) -> None :
     """
-    
+    Write `data` to `path` through a temporary file renamed into place.
+
+    `path` may be a hard link into the attachment store (see AttachmentManifest):
+    replacing the directory entry, instead of writing through it, leaves the
+    stored blob of an earlier message with the same file name untouched.
     """
-    token = get_token() if token is None else token
-    graph_base = GRAPH_BASE if graph_base is None else graph_base
-    email = SHARED_MAILS[0] if email is None else email
+    directory, name = os.path.split(path)
+    tmp_path = os.path.join(directory, f".{name}.{uuid.uuid4().hex}.part")
 
-    date = date_to_str(date)
-    start, end = get_day_bounds(date)
+    try :
 
-    filter_str = f"receivedDateTime ge {start} and receivedDateTime lt {end}"
+        if isinstance(data, bytes) :
 
-    parameters = {
-        
-        "$orderby": "receivedDateTime ASC",
-        "$select": "id,subject,from,receivedDateTime,hasAttachments",
-        "$filter": filter_str,
-        "$top": "10000"
+            with open(tmp_path, "xb") as f :
+                f.write(data)
 
-    }
+        else :
 
-    if with_attach is True :
-        
-        # Only metadata (id, name, contentType, size, isInline)
-        parameters["$expand"] = "attachments($select=id,name,contentType,size,isInline)"
+            with open(tmp_path, "x", encoding="utf-8") as f :
+                f.write(data)
 
+        os.replace(tmp_path, path)
 
-    headers = {
-    
-        "Authorization": f"Bearer {token}"
-        
-    }
+    except BaseException :
 
-    url = f"{graph_base}/users/{email}/mailFolders/Inbox/messages"
+        if os.path.exists(tmp_path) :
+            os.remove(tmp_path)
 
-    rows: List[dict] = []
+        raise
+
+
+def _save_attachment (
+        
+        att : Dict[str, Any],
+        out_dir : str,
+        full : Optional[Dict[str, Any]] = None
     
-    while True :
+    ) -> List[str] :
+    """
+    Write one attachment listing entry to `out_dir`.
+    `full` is the attachment fetched by id, when the listing did not carry the content.
+    """
+    att_id = att.get("id")
+    att_name = att.get("name") or att.get("contentType") or f"attachment-{att_id}"
+    odata_type = att.get("@odata.type", "")
 
-        response = requests.get(
-            
-            url=url,
-            headers=headers,
-            params=parameters
+    saved = []
 
-        )
+    # fileAttachment: contains contentBytes (base64)
+    if odata_type.lower().endswith("fileattachment") :
 
-        if response.status_code != 200 :
-            raise Exception(f"Graph API error {response.status_code}: {response.text}")
+        content_b64 = att.get("contentBytes")
         
-        data = response.json()
+        if content_b64 :
 
-        for m in data.get("value", []) :
+            data = base64.b64decode(content_b64)
+            path = os.path.join(out_dir, att_name)
+            
+            _write_file(path, data)
+
+            saved.append(path)
+            print("[*] Saved file Attachment at ", path)
+
+        else :
 
-            rows.append(
+            # fallback: full attachment fetched by id
+            full = full or {}
+            cb = full.get("contentBytes")
             
-                {
-                    "Id" : m.get("id"),
-                    "Subject" : m.get("subject"),
-                    "From" : m.get("from", {}).get("emailAddress", {}).get("address"),
-                    "Received DateTime" : m.get("receivedDateTime"),
-                    "Attachments" : m.get("hasAttachments"),
-                    "Shared Email" : str(email)
-                }
+            if cb :
+
+                path = os.path.join(out_dir, full.get("name", att_name))
+                
+                _write_file(path, base64.b64decode(cb))
+
+                saved.append(path)
+                print("[+] Saved (fetched) fileAttachment ->", path)
             
-            )
+            else :
+                print("[*] Attachment missing contentBytes:", att_id)
 
-        next_link = data.get("@odata.nextLink")
+    # itemAttachment: embedded message/event/contact (may contain an 'item' property)
+    elif odata_type.lower().endswith("itemattachment") :
 
-        if not next_link :
-            #print(f"Break here for {next_link}")
-            break
+        item = (full or {}).get("item")
         
-        url = next_link
-        params = None  # already encoded in nextLink
+        # Save the embedded item's subject/body as .eml or .json
+        fname = att.get("name") or f"embedded-{att_id}.json"
+        path = os.path.join(out_dir, fname)
+        
+        _write_file(path, json.dumps(item, ensure_ascii=False, indent=2))
+        
+        saved.append(path)
+        print("Saved itemAttachment (JSON) ->", path)
 
-    df_email = pl.DataFrame(rows, schema_overrides=EMAIL_COLUMNS)
+    # referenceAttachment: link to content in cloud (OneDrive/SharePoint etc.)
+    elif odata_type.lower().endswith("referenceattachment") :
 
-    return df_email
+        # referenceAttachment contains a 'sourceUrl' or other metadata
+        src = att.get("sourceUrl") or att.get("contentLocation")
+        
+        info_path = os.path.join(out_dir, f"reference-{att_id}.txt")
+        
+        _write_file(info_path, f"Reference attachment metadata:\n{att}\n\nSource URL: {src}\n")
+        
+        saved.append(info_path)
+        print("Saved referenceAttachment metadata ->", info_path)
+
+    else:
+        # Unknown type: keep the fetched metadata for inspection
+        _write_file(os.path.join(out_dir, f"unknown-{att_id}.json"), json.dumps(full, ensure_ascii=False, indent=2))
+        print("Saved unknown attachment metadata for inspection:", att_id)
+
+    return saved
+
+
+def _meta_to_listing (meta : Dict[str, Any]) -> Dict[str, Any] :
+    """
+    Turn an "Attachments Meta" entry back into a (metadata-only) listing entry.
+    """
+    att = {k : v for k, v in meta.items() if k != "odataType" and v is not None}
+    att["@odata.type"] = meta.get("odataType") or "#microsoft.graph.fileAttachment"
+
+    return att
+
+
+def _record (
+        
+        manifest : Optional[AttachmentManifest],
+        user_upn : str,
+        message_id : str,
+        att : Dict[str, Any],
+        paths : List[str]
+    
+    ) -> List[str] :
+    """
+    Move freshly saved attachment files into the manifest's content-addressed store.
+    """
+    if manifest is None :
+        return paths
+
+    return [manifest.ingest(user_upn, message_id, att.get("id"), path) for path in paths]
 
 
 def download_attachments_for_message (
@@ -174,147 +1402,337 @@ def download_attachments_for_message (
         token : Optional[str] = None,
         out_dir : Optional[str] = "attachments",
         user_upn: Optional[str] = None,
-        attachment : Optional[str] = "/attachments"
+        attachment : Optional[str] = "/attachments",
+        client : Optional[GraphClient] = None,
+        stream : Optional[bool] = None,
+        manifest : Optional[AttachmentManifest] = None,
+        attachments : Optional[List[Dict[str, Any]]] = None,
+        deferred : Optional[List[Dict[str, Any]]] = None,
     
     ) -> Optional[List] :
     """
     message_id: the Graph message id (string)
     user_upn: optional, e.g. 'alice@example.com'; when provided use /users/{user_upn}/messages/{id}
               otherwise uses /me/messages/{id}
+    stream: list metadata only and stream every file attachment through /$value
+    manifest: serve already stored attachments from it and record the new ones
+    attachments: metadata already known (the "Attachments Meta" entries to fetch);
+                 the listing request is skipped and only these are downloaded
+    deferred: when given, attachments to stream are appended to it instead of being
+              downloaded here (see `download_streamed_attachment`); a message with
+              deferred attachments is left for the caller to mark done
     """
-    token = get_token() if token is None else token
+    client = get_graph_client() if client is None else client
+    stream = ATTACHMENT_STREAM if stream is None else stream
     user_upn = SHARED_MAIL_1 if user_upn is None else user_upn
 
     os.makedirs(out_dir, exist_ok=True)
 
-    headers = {"Authorization": f"Bearer {token}"}
-    base = f"{GRAPH_BASE}/users/{user_upn}/messages/{message_id}"
+    base = f"/users/{user_upn}/messages/{message_id}"
 
-    # List attachments
     list_url = base + attachment
-    r = requests.get(
-    
-        list_url,
-        headers=headers
-    
-    )
 
-    r.raise_for_status()
-    
-    attachments = r.json().get("value", [])
+    # Only a message downloaded whole is marked done (see AttachmentManifest.mark_message_done)
+    selective = attachments is not None
+
+    if selective :
+        attachments = [_meta_to_listing(meta) for meta in attachments]
+
+    else :
+
+        # List attachments
+        r = client.get(list_url, token=token, params=ATTACHMENT_METADATA_PARAMS if stream else None)
+
+        r.raise_for_status()
+        
+        attachments = r.json().get("value", [])
 
     if not attachments :
 
         print("[-] No attachments found.")
+
+        if manifest is not None and not selective :
+            manifest.mark_message_done(user_upn, message_id)
+
         return []
 
     saved = []
 
     for att in attachments :
 
-        att_id = att.get("id")
-        att_name = att.get("name") or att.get("contentType") or f"attachment-{att_id}"
-        odata_type = att.get("@odata.type", "")
+        full = None
+        known = manifest.place(user_upn, message_id, att.get("id"), out_dir) if manifest is not None else None
 
-        # fileAttachment: contains contentBytes (base64)
-        if odata_type.lower().endswith("fileattachment") :
+        if known is not None :
 
-            content_b64 = att.get("contentBytes")
-            
-            if content_b64 :
+            saved.append(known)
+            continue
 
-                data = base64.b64decode(content_b64)
-                path = os.path.join(out_dir, att_name)
-                
-                with open(path, "wb") as f :
-                    f.write(data)
+        if _needs_stream(att) and deferred is not None :
 
-                saved.append(path)
-                print("[*] Saved file Attachment at ", path)
+            deferred.append(att)
+            continue
 
-            else :
+        if _needs_stream(att) :
+            paths = [_stream_attachment(client, f"{list_url}/{att.get('id')}", out_dir, _attachment_name(att), token=token)]
 
-                # fallback: fetch full attachment by id
-                get_url = f"{list_url}/{att_id}"
-                
-                rr = requests.get(
-                
-                    get_url,
-                    headers=headers
-                
-                )
+        else :
 
+            if _needs_fetch(att) :
+
+                rr = client.get(f"{list_url}/{att.get('id')}", token=token)
                 rr.raise_for_status()
-                
+
                 full = rr.json()
-                cb = full.get("contentBytes")
-                
-                if cb :
 
-                    path = os.path.join(out_dir, full.get("name", att_name))
-                    
-                    with open(path, "wb") as f :
-                        f.write(base64.b64decode(cb))
+            paths = _save_attachment(att, out_dir, full)
 
-                    saved.append(path)
-                    print("[+] Saved (fetched) fileAttachment ->", path)
-                
-                else :
-                    print("[*] Attachment missing contentBytes:", att_id)
+        saved.extend(_record(manifest, user_upn, message_id, att, paths))
 
-        # itemAttachment: embedded message/event/contact (may contain an 'item' property)
-        elif odata_type.lower().endswith("itemattachment") :
+    if manifest is not None and not deferred and not selective :
+        manifest.mark_message_done(user_upn, message_id)
 
-            # You can GET the attachment by id to inspect the embedded item
-            get_url = f"{list_url}/{att_id}"
-            
-            rr = requests.get(
-            
-                get_url,
-                headers=headers
-            
-            )
+    return saved
 
-            rr.raise_for_status()
-            item = rr.json().get("item")
-            
-            # Save the embedded item's subject/body as .eml or .json
-            fname = att.get("name") or f"embedded-{att_id}.json"
-            path = os.path.join(out_dir, fname)
-            
-            with open(path, "w", encoding="utf-8") as f :
-                json.dump(item, f, ensure_ascii=False, indent=2)
-            
-            saved.append(path)
-            print("Saved itemAttachment (JSON) ->", path)
 
-        # referenceAttachment: link to content in cloud (OneDrive/SharePoint etc.)
-        elif odata_type.lower().endswith("referenceattachment") :
+def download_streamed_attachment (
 
-            # referenceAttachment contains a 'sourceUrl' or other metadata
-            src = att.get("sourceUrl") or att.get("contentLocation")
-            
-            info_path = os.path.join(out_dir, f"reference-{att_id}.txt")
-            
-            with open(info_path, "w", encoding="utf-8") as f :
-                f.write(f"Reference attachment metadata:\n{att}\n\nSource URL: {src}\n")
-            
-            saved.append(info_path)
-            print("Saved referenceAttachment metadata ->", info_path)
+        message_id : str,
+        att : Dict[str, Any],
+        out_dir : str,
+        user_upn : Optional[str] = None,
 
-        else:
-            # Unknown type: try fetching by id
-            get_url = f"{list_url}/{att_id}"
-            
-            rr = requests.get(get_url, headers=headers)
-            rr.raise_for_status()
+        token : Optional[str] = None,
+        attachment : Optional[str] = "/attachments",
+        client : Optional[GraphClient] = None,
+        manifest : Optional[AttachmentManifest] = None,
+
+    ) -> List[str] :
+    """
+    Stream one file attachment through /$value (an attachment `deferred` by
+    `download_attachments_for_message(s)`), so each large transfer can be scheduled
+    on its own. The message is not marked done here.
+    """
+    client = get_graph_client() if client is None else client
+    user_upn = SHARED_MAIL_1 if user_upn is None else user_upn
+
+    os.makedirs(out_dir, exist_ok=True)
+
+    url = f"/users/{user_upn}/messages/{message_id}{attachment}/{att.get('id')}"
+    path = _stream_attachment(client, url, out_dir, _attachment_name(att), token=token)
+
+    return _record(manifest, user_upn, message_id, att, [path])
+
+
+def graph_batch (
+        
+        sub_requests : List[Dict[str, Any]],
+        token : Optional[str] = None,
+        client : Optional[GraphClient] = None,
+        batch_size : int = GRAPH_BATCH_LIMIT,
+    
+    ) -> Dict[str, Dict[str, Any]] :
+    """
+    Send sub-requests ({"id", "method", "url"}, urls relative to the Graph root)
+    through JSON $batch, at most `batch_size` (20 max) per round trip.
+
+    Throttled/transient sub-responses are re-sent (honouring their Retry-After)
+    until the scheduler's retry budget is spent.
+
+    Returns the sub-responses ({"status", "headers", "body"}) keyed by sub-request id.
+    """
+    client = get_graph_client() if client is None else client
+    batch_size = max(1, min(batch_size, GRAPH_BATCH_LIMIT))
+    scheduler = client.scheduler
+
+    responses : Dict[str, Dict[str, Any]] = {}
+
+    for i in range(0, len(sub_requests), batch_size) :
+
+        chunk = sub_requests[i:i + batch_size]
+        attempt = 0
+
+        while chunk :
+
+            r = client.post("/$batch", token=token, json={"requests": chunk})
+            r.raise_for_status()
+
+            for resp in r.json().get("responses", []) :
+                responses[str(resp.get("id"))] = resp
+
+            retry = [sub for sub in chunk if (responses.get(str(sub["id"])) or {}).get("status") in RETRY_STATUSES]
+
+            if not retry or attempt >= scheduler.max_retries :
+                break
+
+            waits = [_retry_after_seconds(responses[str(sub["id"])].get("headers")) for sub in retry]
+            retry_after = max([w for w in waits if w is not None], default=None)
+
+            if any(responses[str(sub["id"])].get("status") in THROTTLE_STATUSES for sub in retry) :
+                scheduler.note_throttled(retry_after)
+
+            scheduler.wait(scheduler.backoff(attempt, retry_after))
+
+            chunk = retry
+            attempt += 1
+
+    return responses
+
+
+def download_attachments_for_messages (
+
+        messages : List[Tuple[str, str, str]],
+        token : Optional[str] = None,
+        client : Optional[GraphClient] = None,
+        attachment : Optional[str] = "/attachments",
+        stream : Optional[bool] = None,
+        manifest : Optional[AttachmentManifest] = None,
+        defer_streams : bool = False,
+    
+    ) -> Dict[Tuple[str, str], Dict[str, Any]] :
+    """
+    Batched counterpart of `download_attachments_for_message`.
+
+    messages: list of (message_id, user_upn, out_dir)
+    Attachment listings, then the attachments that need a fetch by id, go through
+    Graph $batch; the sub-responses are routed back to each message's out_dir.
+
+    File attachments without inline bytes (or all of them with `stream`) are
+    streamed individually through /$value rather than batched as base64 JSON.
+    With `defer_streams` they are returned (under "deferred") instead, for the caller
+    to schedule one by one (see `download_streamed_attachment`), and messages with
+    deferred attachments are left for the caller to mark done.
+
+    Returns {(user_upn, message_id): {"saved": [...], "deferred": [...], "error": Optional[str]}}
+    """
+    client = get_graph_client() if client is None else client
+    stream = ATTACHMENT_STREAM if stream is None else stream
+    query = "?$select=" + ATTACHMENT_METADATA_PARAMS["$select"] if stream else ""
+    results : Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+    listing_requests = []
+
+    for i, (message_id, user_upn, out_dir) in enumerate(messages) :
+
+        user_upn = SHARED_MAIL_1 if user_upn is None else user_upn
+        results[(user_upn, message_id)] = {"saved": [], "deferred": [], "error": None}
+
+        listing_requests.append(
+
+            {
+                "id" : str(i),
+                "method" : "GET",
+                "url" : f"/users/{user_upn}/messages/{message_id}{attachment}{query}",
+            }
+
+        )
+
+    listings = graph_batch(listing_requests, token=token, client=client)
+
+    # (message index, attachment entry) still missing their content
+    pending : List[Tuple[int, Dict[str, Any]]] = []
+    streamed : List[Tuple[int, Dict[str, Any]]] = []
+    ready : List[Tuple[int, Dict[str, Any]]] = []
+
+    for i, (message_id, user_upn, out_dir) in enumerate(messages) :
+
+        user_upn = SHARED_MAIL_1 if user_upn is None else user_upn
+        resp = listings.get(str(i)) or {}
+
+        if resp.get("status") != 200 :
+
+            results[(user_upn, message_id)]["error"] = f"Graph API error {resp.get('status')}: {resp.get('body')}"
+            continue
+
+        attachments = (resp.get("body") or {}).get("value", [])
+
+        if not attachments :
+            print("[-] No attachments found.")
+
+        for att in attachments :
+
+            known = manifest.place(user_upn, message_id, att.get("id"), out_dir) if manifest is not None else None
+
+            if known is not None :
+                results[(user_upn, message_id)]["saved"].append(known)
+
+            elif _needs_stream(att) and defer_streams :
+                results[(user_upn, message_id)]["deferred"].append(att)
+
+            elif _needs_stream(att) :
+                streamed.append((i, att))
+
+            elif _needs_fetch(att) :
+                pending.append((i, att))
             
-            with open(os.path.join(out_dir, f"unknown-{att_id}.json"), "w", encoding="utf-8") as f:
-                import json
-                json.dump(rr.json(), f, ensure_ascii=False, indent=2)
-            print("Saved unknown attachment metadata for inspection:", att_id)
+            else :
+                ready.append((i, att))
 
-    return saved
+    listing_urls = [sub["url"][:len(sub["url"]) - len(query)] for sub in listing_requests]
+
+    fetch_requests = [
+
+        {
+            "id" : str(j),
+            "method" : "GET",
+            "url" : f"{listing_urls[i]}/{att.get('id')}",
+        }
+
+        for j, (i, att) in enumerate(pending)
+
+    ]
+
+    fetched = graph_batch(fetch_requests, token=token, client=client) if fetch_requests else {}
+
+    for j, (i, att) in enumerate(pending) :
+
+        resp = fetched.get(str(j)) or {}
+        message_id, user_upn, out_dir = messages[i]
+        key = (SHARED_MAIL_1 if user_upn is None else user_upn, message_id)
+
+        if resp.get("status") != 200 :
+
+            results[key]["error"] = f"Graph API error {resp.get('status')} on attachment {att.get('id')}: {resp.get('body')}"
+            continue
+
+        ready.append((i, dict(att, _full=resp.get("body"))))
+
+    for i, att in ready :
+
+        message_id, user_upn, out_dir = messages[i]
+        key = (SHARED_MAIL_1 if user_upn is None else user_upn, message_id)
+
+        try :
+
+            os.makedirs(out_dir, exist_ok=True)
+            full = att.pop("_full", None)
+            results[key]["saved"].extend(_record(manifest, key[0], message_id, att, _save_attachment(att, out_dir, full)))
+
+        except OSError as e :
+            results[key]["error"] = f"{type(e).__name__}: {e}"
+
+    for i, att in streamed :
+
+        message_id, user_upn, out_dir = messages[i]
+        key = (SHARED_MAIL_1 if user_upn is None else user_upn, message_id)
+
+        try :
+
+            os.makedirs(out_dir, exist_ok=True)
+            path = _stream_attachment(client, f"{listing_urls[i]}/{att.get('id')}", out_dir, _attachment_name(att), token=token)
+            results[key]["saved"].extend(_record(manifest, key[0], message_id, att, [path]))
+
+        except (OSError, requests.RequestException) as e :
+            results[key]["error"] = f"{type(e).__name__}: {e}"
+
+    if manifest is not None :
+
+        for (user_upn, message_id), outcome in results.items() :
+
+            if outcome["error"] is None and not outcome["deferred"] :
+                manifest.mark_message_done(user_upn, message_id)
+
+    return results
     
 
 def build_chunks(
@@ -325,29 +1743,31 @@ def build_chunks(
 
     ) -> List[Tuple[str, str]] :
     """
-    Return list of [start_iso, end_iso] for each chunk. End exclusive.
+    Return list of [start_iso, end_iso] for each chunk of `days` days, covering
+    start_date to end_date (both days included). End exclusive.
     """
-    s = date_to_str(start_date)
-    e = date_to_str(end_date)
+    s = str_to_date(start_date)
+    e = str_to_date(end_date)
     
     if s > e:
         s, e = e, s
     
     out: List[Tuple[str, str]] = []
-    step = dt.timedelta(days=days)
+    step = dt.timedelta(days=max(1, days))
+    stop = e + dt.timedelta(days=1)
 
     cur = s
 
-    while cur <= e :
+    while cur < stop :
 
-        nxt = min(cur + step - dt.timedelta(milliseconds=1), e)
+        nxt = min(cur + step, stop)
         
         out.append((
             cur.strftime("%Y-%m-%dT00:00:00Z"),
-            nxt.strftime("%Y-%m-%dT23:59:59.999Z"),
+            nxt.strftime("%Y-%m-%dT00:00:00Z"),
         ))
         
-        cur = (nxt + dt.timedelta(milliseconds=1))
+        cur = nxt
     
     return out
 
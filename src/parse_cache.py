@@ -0,0 +1,274 @@
+from __future__ import annotations
+
+import os
+import json
+import glob
+import uuid
+import hashlib
+import threading
+import polars as pl
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from src.config import PARSE_CACHE_DIR_ABS_PATH, PARSE_CACHE_MAX_MB
+
+
+class ParseCache :
+    """
+    Parquet store of parsed broker files shared by the counterparty modules.
+
+    An entry is keyed by (absolute path, size, mtime, parser, parser version, params):
+    a hit only needs a `stat` of the source file, never an open. A file that is
+    replaced or touched gets a new key, and bumping a module's `PARSER_VERSION`
+    invalidates everything it parsed before. Stale entries are never looked up
+    again and go away with the size-based (least recently used first) eviction,
+    run once per run by `parsing.parse_jobs` rather than on every `put` (it lists
+    and stats the whole cache).
+    """
+
+    def __init__ (
+
+            self,
+            cache_dir : Optional[str] = None,
+            max_mb : Optional[float] = None,
+
+        ) -> None :
+
+        self.cache_dir = PARSE_CACHE_DIR_ABS_PATH if cache_dir is None else cache_dir
+        self.max_bytes = int((PARSE_CACHE_MAX_MB if max_mb is None else max_mb) * (1 << 20))
+
+        self._lock = threading.Lock()
+
+        if self.cache_dir :
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+
+    @staticmethod
+    def key (
+
+            path : str,
+            parser : str,
+            version : int,
+            params : Optional[Dict[str, Any]] = None,
+
+        ) -> Optional[str] :
+        """
+        Cache key of `path` as parsed by `parser` (None if the file does not exist).
+        """
+        try :
+            stat = os.stat(path)
+
+        except OSError :
+            return None
+
+        payload = json.dumps(
+
+            [os.path.abspath(path), stat.st_size, stat.st_mtime_ns, parser, version, params or {}],
+            sort_keys=True, default=str,
+
+        )
+
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+    def _entry_path (self, key : str) -> str :
+        return os.path.join(self.cache_dir, key[:2], f"{key}.parquet")
+
+
+    def get (self, key : str) -> Optional[pl.DataFrame] :
+
+        entry = self._entry_path(key)
+
+        try :
+            df = pl.read_parquet(entry)
+
+        except (OSError, pl.exceptions.ComputeError) :
+            return None
+
+        # Hits refresh the entry's recency for eviction
+        try :
+            os.utime(entry)
+
+        except OSError :
+            pass
+
+        return df
+
+
+    def put (self, key : str, df : pl.DataFrame) -> None :
+
+        entry = self._entry_path(key)
+        tmp = f"{entry}.{uuid.uuid4().hex}.tmp"
+
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+
+        try :
+
+            df.write_parquet(tmp)
+            os.replace(tmp, entry)
+
+        except Exception as e :
+
+            print(f"[-] Parse cache : could not store {os.path.basename(entry)} : {e}")
+
+            if os.path.exists(tmp) :
+                os.remove(tmp)
+
+
+    def load (
+
+            self,
+            path : str,
+            parser : str,
+            version : int,
+            parse : Callable[[], Optional[pl.DataFrame]],
+            **params : Any,
+
+        ) -> Optional[pl.DataFrame] :
+        """
+        Parsed frame of `path`: from the cache when the file is unchanged, else `parse()` (and stored).
+        Parse errors propagate and nothing is cached for them.
+        """
+        if not self.cache_dir :
+            return parse()
+
+        key = self.key(path, parser, version, params)
+
+        if key is None :
+            return parse()
+
+        df = self.get(key)
+
+        if df is not None :
+            return df
+
+        df = parse()
+
+        if df is not None :
+            self.put(key, df)
+
+        return df
+
+
+    def load_many (
+
+            self,
+            path : str,
+            parser : str,
+            version : int,
+            parts : List[str],
+            parse : Callable[[List[str]], Dict[str, pl.DataFrame]],
+            **params : Any,
+
+        ) -> Dict[str, pl.DataFrame] :
+        """
+        Parsed frames of several parts of `path` (e.g. workbook sheets): cached parts are served
+        from the cache and the rest come from a single `parse(missing_parts)` call.
+        Parts `parse` does not return are left out (and not cached).
+        """
+        if not self.cache_dir :
+            return parse(list(parts))
+
+        keys = {part : self.key(path, parser, version, {**params, "part" : part}) for part in parts}
+        frames : Dict[str, pl.DataFrame] = {}
+
+        for part, key in keys.items() :
+
+            df = self.get(key) if key is not None else None
+
+            if df is not None :
+                frames[part] = df
+
+        missing = [part for part in parts if part not in frames]
+
+        if missing :
+
+            parsed = parse(missing)
+
+            for part in missing :
+
+                if parsed.get(part) is None :
+                    continue
+
+                frames[part] = parsed[part]
+
+                if keys[part] is not None :
+                    self.put(keys[part], parsed[part])
+
+        return {part : frames[part] for part in parts if part in frames}
+
+
+    def _entries (self) -> List[Tuple[float, int, str]] :
+
+        entries = []
+
+        for entry in glob.glob(os.path.join(self.cache_dir, "*", "*.parquet")) :
+
+            try :
+                stat = os.stat(entry)
+
+            except OSError :
+                continue
+
+            entries.append((stat.st_mtime, stat.st_size, entry))
+
+        return entries
+
+
+    def size (self) -> int :
+        """
+        Total size of the cached entries in bytes.
+        """
+        return sum(size for _, size, _ in self._entries())
+
+
+    def evict (self, max_bytes : Optional[int] = None) -> int :
+        """
+        Remove the least recently used entries until the cache fits in `max_bytes`. Returns the bytes freed.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+
+        if not self.cache_dir :
+            return 0
+
+        with self._lock :
+
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            freed = 0
+
+            for _, size, entry in entries :
+
+                if total - freed <= max_bytes :
+                    break
+
+                try :
+                    os.remove(entry)
+                    freed += size
+
+                except OSError :
+                    continue
+
+        return freed
+
+
+    def clear (self) -> None :
+        self.evict(0)
+
+
+_PARSE_CACHE : Optional[ParseCache] = None
+_PARSE_CACHE_LOCK = threading.Lock()
+
+
+def get_parse_cache () -> ParseCache :
+    """
+    Return the process-wide parse cache, building it on first use.
+    """
+    global _PARSE_CACHE
+
+    with _PARSE_CACHE_LOCK :
+
+        if _PARSE_CACHE is None :
+            _PARSE_CACHE = ParseCache()
+
+    return _PARSE_CACHE
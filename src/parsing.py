@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import time
+import datetime as dt
+import multiprocessing as mp
+
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Any, Iterable, Callable
+
+from src.config import PARSE_JOBS
+from src.parse_cache import get_parse_cache
+
+
+@dataclass(frozen=True)
+class ParseJob :
+    """
+    One counterparty report to parse for a date and a fundation.
+    """
+    counterparty : str
+    date : dt.date
+    fundation : str
+
+
+def _run_parse (func : Callable, job : ParseJob) -> Dict[str, Any] :
+    """
+    Parse a single job and report its outcome instead of raising.
+    """
+    start = time.perf_counter()
+
+    try :
+
+        frames = func(job.date, job.fundation)
+        return {"job" : job, "frames" : frames, "error" : None, "elapsed" : time.perf_counter() - start}
+
+    except Exception as e :
+        return {"job" : job, "frames" : None, "error" : f"{type(e).__name__}: {e}", "elapsed" : time.perf_counter() - start}
+
+
+def parse_jobs (
+
+        jobs : Iterable[ParseJob],
+        parsers : Dict[str, Callable],
+        max_workers : Optional[int] = None,
+        on_result : Optional[Callable[[Dict[str, Any]], None]] = None,
+
+    ) -> Dict[str, Any] :
+    """
+    Run every parse job, on a process pool when `max_workers` > 1 (parsing is CPU bound
+    Excel / CSV decoding). `parsers` maps a counterparty to its module-level parse function
+    (it is sent to the workers by reference). Workers are spawned, not forked, so they do not
+    inherit the Polars thread pool. `on_result` is called (from this process) with each job's
+    result as soon as it is known.
+
+    The parse cache is trimmed to its size limit once every job is done.
+
+    Returns a summary with per-job results and the failed jobs with their error.
+    """
+    jobs = list(jobs)
+    max_workers = PARSE_JOBS if max_workers is None else max_workers
+    max_workers = max(1, min(max_workers, len(jobs)))
+
+    start = time.perf_counter()
+    results : List[Dict[str, Any]] = []
+
+    def collect (result : Dict[str, Any]) -> None :
+
+        results.append(result)
+
+        if on_result is not None :
+            on_result(result)
+
+    if max_workers == 1 :
+
+        for job in jobs :
+            collect(_run_parse(parsers[job.counterparty], job))
+
+    elif jobs :
+
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp.get_context("spawn")) as pool :
+
+            futures = {pool.submit(_run_parse, parsers[job.counterparty], job) : job for job in jobs}
+
+            for future in as_completed(futures) :
+
+                try :
+                    collect(future.result())
+
+                # A worker that died (or an unpicklable result) only fails its own job
+                except Exception as e :
+
+                    job = futures[future]
+                    collect({"job" : job, "frames" : None, "error" : f"{type(e).__name__}: {e}", "elapsed" : None})
+
+    get_parse_cache().evict()
+
+    errors = [r for r in results if r["error"] is not None]
+
+    return {
+
+        "jobs" : len(results),
+        "ok" : len(results) - len(errors),
+        "failed" : len(errors),
+        "workers" : max_workers,
+        "elapsed" : time.perf_counter() - start,
+        "results" : results,
+        "errors" : errors,
+
+    }
@@ -0,0 +1,305 @@
+from __future__ import annotations
+
+import io
+import re
+import polars as pl
+
+from typing import Callable, Dict, List, Optional, Sequence
+
+from src.config import EXCEL_ENGINES
+
+
+# Sheet name used for "the first sheet" when no names are asked for
+FIRST_SHEET = None
+
+ExcelReader = Callable[[bytes, Optional[Sequence[str]], int, bool, Optional[Sequence[str]]], Dict[Optional[str], pl.DataFrame]]
+
+
+def _is_missing_sheet (e : Exception) -> bool :
+    return isinstance(e, ValueError) and ("no matching sheet" in str(e) or "not found" in str(e))
+
+
+def _is_missing_column (e : Exception) -> bool :
+    return type(e).__name__ == "ColumnNotFoundError"
+
+
+def _project (df : pl.DataFrame, columns : Optional[Sequence[str]]) -> pl.DataFrame :
+    """
+    The asked columns the frame has (missing ones are left to `apply_schema` to report).
+    """
+    return df if columns is None else df.select([c for c in columns if c in df.columns])
+
+
+def _pandas_names (df : pl.DataFrame) -> pl.DataFrame :
+    """
+    Name header-less columns like pandas does ("Unnamed: i"), so both readers give the same frame.
+    """
+    return df.rename({c : re.sub(r"^__UNNAMED__(\d+)$", r"Unnamed: \1", c) for c in df.columns if c.startswith("__UNNAMED__")})
+
+
+def _read_calamine (
+
+        data : bytes,
+        sheets : Optional[Sequence[str]] = None,
+        header_row : int = 0,
+        as_str : bool = False,
+        columns : Optional[Sequence[str]] = None,
+
+    ) -> Dict[Optional[str], pl.DataFrame] :
+    """
+    Rust (calamine) reader: the workbook is parsed once for all the asked sheets,
+    only the asked columns are decoded.
+    """
+    options = dict(
+
+        engine="calamine",
+        read_options={"header_row" : header_row},
+        infer_schema_length=0 if as_str else None,
+        drop_empty_rows=False,
+        drop_empty_cols=False,
+        raise_if_empty=False,
+
+    )
+
+    def read (**target) :
+
+        if columns is None :
+            return pl.read_excel(data, **target, **options)
+
+        try :
+            return pl.read_excel(data, **target, columns=list(columns), **options)
+
+        # A sheet lacks one of the columns: decode them all, the projection keeps what exists
+        except Exception as e :
+
+            if not _is_missing_column(e) :
+                raise
+
+            return pl.read_excel(data, **target, **options)
+
+    if not sheets :
+        return {FIRST_SHEET : _project(_pandas_names(read(sheet_id=1)), columns)}
+
+    try :
+        frames = read(sheet_name=list(sheets))
+
+    except ValueError as e :
+
+        if not _is_missing_sheet(e) :
+            raise
+
+        # One asked sheet is absent: read the others one by one (still from memory)
+        frames = {}
+
+        for sheet in sheets :
+
+            try :
+                frames[sheet] = read(sheet_name=sheet)
+
+            except ValueError as e :
+
+                if not _is_missing_sheet(e) :
+                    raise
+
+                print(f"[-] Sheet {sheet} not found")
+
+    return {sheet : _project(_pandas_names(df), columns) for sheet, df in frames.items()}
+
+
+def _read_pandas (
+
+        data : bytes,
+        sheets : Optional[Sequence[str]] = None,
+        header_row : int = 0,
+        as_str : bool = False,
+        columns : Optional[Sequence[str]] = None,
+
+    ) -> Dict[Optional[str], pl.DataFrame] :
+    """
+    pandas reader (xlrd / openpyxl): one `ExcelFile` for all the asked sheets.
+    """
+    import pandas as pd
+
+    frames = {}
+
+    with pd.ExcelFile(io.BytesIO(data)) as book :
+
+        for sheet in (sheets or [FIRST_SHEET]) :
+
+            if sheet is not FIRST_SHEET and sheet not in book.sheet_names :
+
+                print(f"[-] Sheet {sheet} not found")
+                continue
+
+            df = book.parse(
+
+                0 if sheet is FIRST_SHEET else sheet, skiprows=header_row, dtype=str if as_str else None,
+                usecols=None if columns is None else (lambda c : c in set(columns)),
+
+            )
+            frames[sheet] = _project(pl.from_pandas(df, include_index=False), columns)
+
+    return frames
+
+
+EXCEL_READERS : Dict[str, ExcelReader] = {
+
+    "calamine" : _read_calamine,
+    "pandas" : _read_pandas,
+
+}
+
+
+def read_excel_sheets (
+
+        path : str,
+        sheets : Optional[Sequence[str]] = None,
+        header_row : int = 0,
+        as_str : bool = False,
+        columns : Optional[Sequence[str]] = None,
+
+        engines : Optional[List[str]] = None,
+
+    ) -> Dict[Optional[str], pl.DataFrame] :
+    """
+    {sheet : frame} of a workbook, opened once and decoded once for every sheet.
+
+    `header_row` is the 0-based row holding the header (the rows above are skipped, as
+    pandas `skiprows`); `as_str` reads every cell as text; `columns` restricts the
+    decoding to those columns (the ones a sheet lacks are left out). Sheets absent from the
+    workbook are reported and left out. Readers of `engines` (default `EXCEL_ENGINES`)
+    are tried in order, the next one taking over when one is missing or fails.
+    """
+    engines = EXCEL_ENGINES if engines is None else engines
+
+    with open(path, "rb") as f :
+        data = f.read()
+
+    error : Optional[Exception] = None
+
+    for engine in engines :
+
+        reader = EXCEL_READERS.get(engine)
+
+        if reader is None :
+
+            print(f"[-] Unknown Excel engine {engine}")
+            continue
+
+        try :
+            return reader(data, sheets, header_row, as_str, columns)
+
+        except Exception as e :
+
+            print(f"[-] [{engine}] Could not read {path} : {e}")
+            error = e
+
+    raise error if error is not None else ValueError(f"No Excel engine available for {path}")
+
+
+def read_excel_sheet (
+
+        path : str,
+        sheet : Optional[str] = None,
+        header_row : int = 0,
+        as_str : bool = False,
+        columns : Optional[Sequence[str]] = None,
+
+        engines : Optional[List[str]] = None,
+
+    ) -> Optional[pl.DataFrame] :
+    """
+    One sheet of a workbook (the first one by default).
+    """
+    frames = read_excel_sheets(path, None if sheet is None else [sheet], header_row, as_str, columns, engines)
+    return frames.get(sheet)
+
+
+def truncate_at_first_null (df : pl.DataFrame, column : str) -> pl.DataFrame :
+    """
+    Rows above the first null of `column` (typically where a report's footer starts).
+    """
+    return df.filter(pl.col(column).is_null().cum_sum() == 0)
+
+
+def apply_schema (
+
+        df : pl.DataFrame,
+        schema : Dict[str, pl.DataType],
+        label : str = "",
+        fill_missing : bool = True,
+
+    ) -> pl.DataFrame :
+    """
+    `df` projected on the `schema` columns, cast to their dtypes.
+
+    Values that do not convert are set to null and reported (instead of leaving the
+    column as text). Columns the frame lacks are reported and added as nulls, unless
+    `fill_missing` is False: they are then left out and reporting is up to the caller.
+    """
+    missing = [name for name in schema if name not in df.columns]
+
+    if missing and fill_missing :
+        print(f"[-] {label} : missing column(s) {', '.join(missing)}")
+
+    exprs = []
+    checks = []
+
+    for name, dtype in schema.items() :
+
+        if name in missing :
+
+            if fill_missing :
+                exprs.append(pl.lit(None, dtype=dtype).alias(name))
+
+            continue
+
+        source = pl.col(name)
+
+        if df.schema[name] == pl.Utf8 :
+            source = source.str.strip_chars().replace("", None)
+
+        cast = source.cast(dtype, strict=False)
+        exprs.append(cast.alias(name))
+
+        if df.schema[name] != dtype :
+            checks.append((name, dtype, source.is_not_null() & cast.is_null()))
+
+    if checks :
+
+        failed = df.select([mask.alias(name) for name, _, mask in checks])
+
+        for name, dtype, _ in checks :
+
+            bad = failed[name]
+            count = int(bad.sum())
+
+            if count :
+
+                sample = df.filter(bad)[name].head(3).to_list()
+                print(f"[-] {label} : {count} value(s) of {name} are not {dtype} (e.g. {sample}), set to null")
+
+    return df.select(exprs)
+
+
+def read_csv_typed (
+
+        path : str,
+        schema : Dict[str, pl.DataType],
+        skip_rows : int = 0,
+        label : str = "",
+        **kwargs,
+
+    ) -> pl.DataFrame :
+    """
+    The `schema` columns of a CSV, typed while parsing. When the file does not match
+    (missing column, value of another type) it is read again as text and `apply_schema`
+    reports the mismatches.
+    """
+    try :
+        return pl.read_csv(path, skip_rows=skip_rows, columns=list(schema), schema_overrides=schema, **kwargs)
+
+    except (pl.exceptions.ColumnNotFoundError, pl.exceptions.ComputeError) :
+
+        df = pl.read_csv(path, skip_rows=skip_rows, infer_schema=False, **kwargs)
+        return apply_schema(df, schema, label)
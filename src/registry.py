@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import os
+import importlib
+
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Loads the .env before any parser configuration is checked
+import src.config  # noqa: F401
+
+
+@dataclass(frozen=True)
+class CounterpartyParser :
+    """
+    A counterparty parser, registered by name and imported the first time it is selected.
+    """
+    name : str
+    module : str
+    function : str
+
+    # Environment variables the parser cannot run without
+    env : Tuple[str, ...] = ()
+
+
+    def missing_env (self) -> List[str] :
+        return [name for name in self.env if not (os.getenv(name) or "").strip()]
+
+
+    def load (self) -> Callable :
+        """
+        Import the parser module and return its `(date, fundation)` function.
+        """
+        return getattr(importlib.import_module(self.module), self.function)
+
+
+PARSERS : Dict[str, CounterpartyParser] = {}
+
+
+def register (name : str, module : str, function : str, env : Iterable[str] = ()) -> CounterpartyParser :
+    """
+    Register (or replace) the parser of a counterparty.
+    """
+    PARSERS[name] = CounterpartyParser(name, module, function, tuple(env))
+    return PARSERS[name]
+
+
+def load_parsers (names : Optional[Iterable[str]] = None) -> Dict[str, Callable] :
+    """
+    {name : parse function} of the selected counterparties, importing only their modules.
+
+    Explicitly selected counterparties must be registered and configured (ValueError
+    otherwise); by default every registered counterparty runs, the unconfigured ones
+    are skipped with a notice.
+    """
+    explicit = names is not None
+    names = list(PARSERS) if names is None else list(names)
+
+    unknown = [name for name in names if name not in PARSERS]
+
+    if unknown :
+        raise ValueError(f"Unknown counterparty(ies) {', '.join(unknown)} (registered : {', '.join(PARSERS)})")
+
+    parsers = {}
+
+    for name in names :
+
+        parser = PARSERS[name]
+        missing = parser.missing_env()
+
+        if missing :
+
+            if explicit :
+                raise ValueError(f"{name} is not configured : set {', '.join(missing)}")
+
+            print(f"[-] [{name}] Skipped, not configured : set {', '.join(missing)}")
+            continue
+
+        parsers[name] = parser.load()
+
+    return parsers
+
+
+register("GS", "src.counterparties.gs", "gs_trades", env=("GS_ATTACHMENT_DIR_ABS_PATH",))
+register("UBS", "src.counterparties.ubs", "ubs_trades", env=("UBS_ATTACHMENT_DIR_ABS_PATH", "UBS_FILENAMES"))
+register("SAXO", "src.counterparties.saxo", "saxo_trades", env=("SAXO_ATTACHMENT_DIR_ABS_PATH", "SAXO_FILENAMES"))
+register("MS", "src.counterparties.ms", "ms_trades", env=("MS_ATTACHMENT_DIR_ABS_PATH", "MS_FILENAMES", "MS_ACCOUNT_HV", "MS_ACCOUNT_WR"))
@@ -0,0 +1,18 @@
+import os
+import sys
+import pytest
+
+# Tests import the application modules as `src.*`, like main.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def fake_graph () :
+    """
+    A running local Graph stand-in (see bench/fake_graph.py).
+    """
+    from bench.fake_graph import FakeGraph
+
+    fake = FakeGraph({}).start()
+    yield fake
+    fake.stop()
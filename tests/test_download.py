@@ -0,0 +1,99 @@
+import os
+import time
+
+from src.download import DownloadJob, download_jobs
+from src.manifest import AttachmentManifest
+from src.msal import GraphClient, RequestScheduler
+
+
+def _message (msg_id : str) -> dict :
+    return {
+        "id" : msg_id, "subject" : "Report", "from" : "reports@gs.example", "receivedDateTime" : "2026-01-05T08:00:00Z",
+        "attachments" : [
+            {"id" : f"{msg_id}-a{k}", "name" : f"{msg_id}-{k}.csv", "size" : 8, "isInline" : False, "contentType" : "text/csv"}
+            for k in range(2)
+        ],
+    }
+
+
+def test_streamed_attachments_of_a_batch_run_concurrently (fake_graph, tmp_path) :
+
+    fake_graph.load({"box@fund.example" : [_message(f"m{i}") for i in range(4)]})
+
+    client = GraphClient(graph_base=fake_graph.graph_base, scheduler=RequestScheduler(max_in_flight=8))
+    manifest = AttachmentManifest(db_path=str(tmp_path / "manifest.sqlite"), store_dir=str(tmp_path / "store"))
+    jobs = [DownloadJob(f"m{i}", "box@fund.example", str(tmp_path / "GS")) for i in range(4)]
+
+    # 1 $batch of listings + 8 streamed attachments, 0.2s each
+    fake_graph.latency = 0.2
+    start = time.perf_counter()
+
+    summary = download_jobs(jobs, max_workers=8, token="t", client=client, batch=True, stream=True, manifest=manifest)
+
+    elapsed = time.perf_counter() - start
+
+    assert summary["ok"] == 4 and summary["files"] == 8
+    assert sorted(os.listdir(tmp_path / "GS")) == sorted(f"m{i}-{k}.csv" for i in range(4) for k in range(2))
+    assert all(manifest.message_done("box@fund.example", f"m{i}") for i in range(4))
+
+    # One after another the streams alone would take 1.6s
+    assert elapsed < 1.2
+
+    manifest.close()
+
+
+def test_streamed_attachments_of_one_message_run_concurrently (fake_graph, tmp_path) :
+
+    message = _message("m0")
+    message["attachments"] += [dict(att, id=f"m0-b{k}", name=f"m0-b{k}.csv") for k, att in enumerate(message["attachments"])]
+
+    fake_graph.load({"box@fund.example" : [message]})
+
+    client = GraphClient(graph_base=fake_graph.graph_base, scheduler=RequestScheduler(max_in_flight=8))
+    meta = [{**att, "odataType" : "#microsoft.graph.fileAttachment"} for att in message["attachments"]]
+
+    jobs = [
+
+        DownloadJob("m0", "box@fund.example", str(tmp_path / "listed")),
+        DownloadJob("m0", "box@fund.example", str(tmp_path / "selective"), attachments=meta),
+
+    ]
+
+    fake_graph.latency = 0.2
+
+    for job in jobs :
+
+        start = time.perf_counter()
+        summary = download_jobs([job], max_workers=8, token="t", client=client, batch=False, stream=True)
+
+        assert summary["ok"] == 1 and summary["files"] == 4
+
+        # One after another the 4 streams alone would take 0.8s
+        assert time.perf_counter() - start < 0.7
+
+
+def test_selective_download_does_not_hide_newly_selected_attachments (fake_graph, tmp_path) :
+
+    message = _message("m0")
+    fake_graph.load({"box@fund.example" : [message]})
+
+    client = GraphClient(graph_base=fake_graph.graph_base)
+    manifest = AttachmentManifest(db_path=str(tmp_path / "manifest.sqlite"), store_dir=str(tmp_path / "store"))
+    meta = [{**att, "odataType" : "#microsoft.graph.fileAttachment"} for att in message["attachments"]]
+
+    def run (selected) :
+        return download_jobs([DownloadJob("m0", "box@fund.example", str(tmp_path / "GS"), attachments=selected)], token="t", client=client, manifest=manifest)
+
+    assert run(meta[:1])["files"] == 1
+    assert not manifest.message_done("box@fund.example", "m0")
+
+    # The filename rules changed: the second attachment is selected too
+    summary = run(meta)
+
+    assert summary["skipped"] == 0 and summary["files"] == 2
+    assert sorted(os.listdir(tmp_path / "GS")) == ["m0-0.csv", "m0-1.csv"]
+
+    # Everything selected is stored now
+    assert run(meta)["skipped"] == 1
+
+    manifest.close()
@@ -0,0 +1,88 @@
+import re
+import random
+import polars as pl
+
+from src.extraction import split_by_counterparty, attachment_matches, _compile_subject_pattern
+
+
+RULES = {
+
+    "MS" : {"emails" : {"positions@ms.example"}, "subject" : "Morgan Stanley;MS Daily", "filenames" : {"MSPositions"}},
+    "GS" : {"emails" : {"reports@gs.example"}, "subject" : "Goldman;GS-FX", "filenames" : {"GSFX", "GSEQ"}},
+    "SAXO" : {"emails" : {"statements@saxo.example"}, "domains" : {"saxo.example", "saxobank.example"}, "subject" : r"(?i)saxo\s+(trades|report)", "filenames" : {".csv"}},
+    "UBS" : {"emails" : {"custody@ubs.example"}, "subject" : ["UBS"], "filenames" : set()},
+
+}
+
+SENDERS = [
+
+    "positions@ms.example", "desk@ms.example", "reports@gs.example", "other@gs.example", "statements@saxo.example",
+    "ops@saxobank.example", "custody@ubs.example", "Custody Team <custody@ubs.example>", "noreply@news.example", "",
+
+]
+
+SUBJECTS = [
+
+    "Morgan Stanley positions", "MS Daily 05/01", "Goldman FX", "GS-FX trades", "GS FX", "Saxo  trades 05/01",
+    "saxo report", "UBS custody", "Re: UBS", "Newsletter", "Goldmanite", "",
+
+]
+
+FILES = [
+
+    None, [], ["MSPositions_HV001_20260105.xlsx"], ["GSFX_20260105.xlsx", "image001.png"], ["gseq_20260105.XLSX"],
+    ["SaxoTrades_20260105.csv"], ["SaxoTrades_20260105.xlsx"], ["report.pdf"],
+
+]
+
+
+def _regex_path (row : dict) -> str :
+    """
+    The per-row engine: rules in order, exact email before domain, subject regex, filename tokens.
+    """
+    sender = re.search(r"([A-Za-z0-9._%+\-]+@[A-Za-z0-9.\-]+\.[A-Za-z]{2,})", (row["From"] or "").lower())
+    sender = sender.group(1) if sender else ""
+    domain = sender.split("@", 1)[-1] if sender else ""
+    subject = re.sub(r"\s+", " ", (row["Subject"] or "").strip())
+
+    for name, rule in RULES.items() :
+
+        emails = {e.lower() for e in rule["emails"]}
+        domains = {d.lower() for d in rule.get("domains", set())} or {e.split("@", 1)[-1] for e in emails}
+
+        if not re.search(_compile_subject_pattern(rule["subject"]), subject) :
+            continue
+
+        files = row["Attachment Names"] or []
+
+        if rule["filenames"] and files and not any(attachment_matches(f, rule["filenames"]) for f in files) :
+            continue
+
+        if sender in emails or domain in domains :
+            return name
+
+    return "UNMATCHED"
+
+
+def test_buckets_match_the_regex_path () :
+
+    rng = random.Random(7)
+
+    rows = [
+
+        {
+            "Id" : f"m{i}", "From" : rng.choice(SENDERS), "Subject" : rng.choice(SUBJECTS),
+            "Attachments" : True, "Attachment Names" : rng.choice(FILES),
+        }
+        for i in range(600)
+
+    ]
+
+    df = pl.DataFrame(rows, schema={"Id" : pl.Utf8, "From" : pl.Utf8, "Subject" : pl.Utf8, "Attachments" : pl.Boolean, "Attachment Names" : pl.List(pl.Utf8)})
+    buckets = split_by_counterparty(df, RULES)
+
+    got = {row_id : name for name, bucket in buckets.items() for row_id in bucket["Id"].to_list()}
+    expected = {row["Id"] : _regex_path(row) for row in rows}
+
+    assert got == expected
+    assert len(set(expected.values())) == len(RULES) + 1
@@ -0,0 +1,55 @@
+import os
+
+from src.file_index import FileIndex
+
+
+def _touch_dir (path, step : int) -> None :
+
+    # Some filesystems keep a coarse mtime: move it on explicitly
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + step * 1_000_000_000))
+
+
+def test_rescans_when_the_directory_changes (tmp_path) :
+
+    index = FileIndex()
+    (tmp_path / "GSFX_20260105.xlsx").write_bytes(b"")
+
+    assert index.lookup(str(tmp_path), "2026-01-05", tokens=["GSFX"]) == ["GSFX_20260105.xlsx"]
+
+    (tmp_path / "GSFX_20260105_v2.xlsx").write_bytes(b"")
+    (tmp_path / "GSEQ_20260105.xlsx").write_bytes(b"")
+    _touch_dir(tmp_path, 1)
+
+    assert index.lookup(str(tmp_path), "2026-01-05", tokens=["GSFX"]) == ["GSFX_20260105.xlsx", "GSFX_20260105_v2.xlsx"]
+
+    os.remove(tmp_path / "GSFX_20260105.xlsx")
+    _touch_dir(tmp_path, 2)
+
+    assert index.lookup(str(tmp_path), "2026-01-05", tokens=["GSFX"]) == ["GSFX_20260105_v2.xlsx"]
+
+
+def test_unchanged_directory_is_not_listed_again (tmp_path, monkeypatch) :
+
+    index = FileIndex()
+    (tmp_path / "GSFX_20260105.xlsx").write_bytes(b"")
+
+    index.lookup(str(tmp_path), "2026-01-05")
+
+    def fail (*args, **kwargs) :
+        raise AssertionError("directory listed again")
+
+    monkeypatch.setattr(os, "scandir", fail)
+
+    assert index.lookup(str(tmp_path), "2026-01-05", exclude=["Collateral"]) == ["GSFX_20260105.xlsx"]
+
+
+def test_date_formats_and_missing_tokens (tmp_path) :
+
+    index = FileIndex()
+
+    for name in ("UBS_05.01.2026.csv", "UBS_20260105.csv", "UBS_05.01.2026.pdf") :
+        (tmp_path / name).write_bytes(b"")
+
+    assert index.lookup(str(tmp_path), "2026-01-05", "%d.%m.%Y", tokens=["UBS"], extensions=(".csv",)) == ["UBS_05.01.2026.csv"]
+    assert index.lookup(str(tmp_path), "2026-01-05", tokens=["UBS", None]) == []
@@ -0,0 +1,12 @@
+import pytest
+
+import main
+
+
+def test_delta_requires_the_message_cache (monkeypatch) :
+
+    monkeypatch.setattr(main, "MESSAGE_CACHE_DIR_ABS_PATH", None)
+    monkeypatch.setattr(main, "get_token_provider", lambda : pytest.fail("no Graph call expected"))
+
+    with pytest.raises(ValueError, match="message cache") :
+        main.main(delta=True, counterparties={})
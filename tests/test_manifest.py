@@ -0,0 +1,49 @@
+import os
+import base64
+
+from src.manifest import AttachmentManifest
+from src.msal import _save_attachment
+
+
+def _file_attachment (att_id : str, name : str, data : bytes) -> dict :
+    return {
+        "id" : att_id,
+        "name" : name,
+        "@odata.type" : "#microsoft.graph.fileAttachment",
+        "contentBytes" : base64.b64encode(data).decode("ascii"),
+    }
+
+
+def test_same_file_name_does_not_overwrite_stored_blob (tmp_path) :
+
+    manifest = AttachmentManifest(db_path=str(tmp_path / "manifest.sqlite"), store_dir=str(tmp_path / "store"))
+    out_dir = tmp_path / "GS"
+    out_dir.mkdir()
+
+    # Day 1: saved, then moved into the store and hard-linked back into the folder
+    (path,) = _save_attachment(_file_attachment("a1", "trades.csv", b"DAY1"), str(out_dir))
+    manifest.ingest("box", "msg1", "a1", path)
+    manifest.mark_message_done("box", "msg1")
+
+    # Day 2: same file name, written over the link left by day 1
+    (path,) = _save_attachment(_file_attachment("a2", "trades.csv", b"DAY2"), str(out_dir))
+    manifest.ingest("box", "msg2", "a2", path)
+    manifest.mark_message_done("box", "msg2")
+
+    blob1 = manifest.blob_path(manifest.lookup("box", "msg1", "a1")["sha256"])
+
+    with open(blob1, "rb") as f :
+        assert f.read() == b"DAY1"
+
+    day1_dir = tmp_path / "replay1"
+    (placed,) = manifest.place_message("box", "msg1", str(day1_dir))
+
+    with open(placed, "rb") as f :
+        assert f.read() == b"DAY1"
+
+    with open(os.path.join(out_dir, "trades.csv"), "rb") as f :
+        assert f.read() == b"DAY2"
+
+    assert not [name for name in os.listdir(out_dir) if name.endswith(".part")]
+
+    manifest.close()
@@ -0,0 +1,73 @@
+import polars as pl
+
+from src.config import EMAIL_COLUMNS
+from src.message_cache import MessageCache
+from src.msal import _message_row
+
+
+RULES = {"GS" : {"emails" : {"reports@gs.example"}, "subject" : ["Goldman"], "filenames" : {"GSFX"}}}
+
+
+def _listing (subject : str, attachments : bool = True) -> pl.DataFrame :
+
+    message = {
+
+        "id" : "m1", "subject" : subject, "receivedDateTime" : "2026-01-05T08:00:00Z", "hasAttachments" : True,
+        "from" : {"emailAddress" : {"address" : "reports@gs.example"}},
+
+    }
+
+    if attachments :
+        message["attachments"] = [{"id" : "a1", "name" : "GSFX_20260105.xlsx", "size" : 10, "isInline" : False}]
+
+    return pl.DataFrame([_message_row(message, "box@fund.example")], schema=EMAIL_COLUMNS)
+
+
+def test_relisted_message_replaces_cached_row (tmp_path) :
+
+    cache = MessageCache(cache_dir=str(tmp_path), rules=RULES)
+
+    # First seen through delta, without attachment metadata
+    cache.ingest(_listing("Goldman FX", attachments=False))
+    (row,) = cache.load().to_dicts()
+
+    assert row["Attachment Names"] is None
+    assert row["Counterparty Files"] in (None, [])
+
+    # Listed again (e.g. --refresh), changed and with its attachments
+    assert cache.ingest(_listing("Goldman FX (corrected)")) == 1
+    (row,) = cache.load().to_dicts()
+
+    assert row["Subject"] == "Goldman FX (corrected)"
+    assert row["Attachment Names"] == ["GSFX_20260105.xlsx"]
+    assert row["Counterparty"] == "GS"
+    assert row["Counterparty Files"] == ["GSFX_20260105.xlsx"]
+
+
+def test_relisting_without_metadata_keeps_cached_attachments (tmp_path) :
+
+    cache = MessageCache(cache_dir=str(tmp_path), rules=RULES)
+
+    assert cache.ingest(_listing("Goldman FX")) == 1
+    assert cache.ingest(_listing("Goldman FX", attachments=False)) == 0
+
+    (row,) = cache.load().to_dicts()
+
+    assert row["Attachment Names"] == ["GSFX_20260105.xlsx"]
+    assert row["Counterparty Files"] == ["GSFX_20260105.xlsx"]
+
+
+def test_unchanged_relisting_is_not_reclassified (tmp_path) :
+
+    cache = MessageCache(cache_dir=str(tmp_path), rules=RULES)
+
+    assert cache.ingest(_listing("Goldman FX")) == 1
+    parts = cache._parts()
+
+    assert cache.ingest(_listing("Goldman FX")) == 0
+    assert cache._parts() == parts
+
+    # Other rules: the cached assignment is stale
+    cache = MessageCache(cache_dir=str(tmp_path), rules={"GS" : dict(RULES["GS"], filenames={"GSEQ"})})
+
+    assert cache.ingest(_listing("Goldman FX")) == 1
@@ -0,0 +1,16 @@
+from src.counterparties import ms
+
+
+def test_fund_without_account_is_skipped (tmp_path, monkeypatch) :
+
+    for name in ("MSPositions_HV001_20260105.xlsx", "MSPositions_WR001_20260105.xlsx") :
+        (tmp_path / name).write_bytes(b"")
+
+    monkeypatch.setitem(ms.MS_ACCOUNTS, "HV", "HV001")
+    monkeypatch.setitem(ms.MS_ACCOUNTS, "WR", None)
+
+    hv = ms.find_files_by_date_n_fundation("2026-01-05", "HV", rules="MSPositions", dir_abs_path=str(tmp_path))
+    wr = ms.find_files_by_date_n_fundation("2026-01-05", "WR", rules="MSPositions", dir_abs_path=str(tmp_path))
+
+    assert hv == ["MSPositions_HV001_20260105.xlsx"]
+    assert wr == []
@@ -0,0 +1,203 @@
+import os
+import stat
+import pytest
+import requests
+import polars as pl
+
+from src.extraction import classify_messages
+
+from src.msal import (
+
+    GraphClient, RequestScheduler, TokenProvider, get_token_provider, set_token_provider,
+    build_counterparty_filter, _list_messages, _stream_attachment,
+
+)
+
+
+RULES = {
+
+    # Domain derived from the address by the classifier
+    "GS" : {"emails" : {"Reports@gs.example"}, "subject" : ["Goldman"]},
+    "UBS" : {"emails" : {"custody@ubs.example", "ops@ubs-mail.example"}, "domains" : {"ubs.example"}, "subject" : ["UBS"]},
+
+}
+
+
+def _message (msg_id : str, sender : str, received : str, subject : str = "Report") -> dict :
+    return {
+        "id" : msg_id, "subject" : subject, "from" : sender, "receivedDateTime" : received,
+        "attachments" : [{"id" : f"{msg_id}-a0", "name" : "trades.csv", "size" : 4, "isInline" : False, "contentType" : "text/csv"}],
+    }
+
+
+def test_counterparty_filter_with_configured_domains () :
+
+    flt = build_counterparty_filter({"UBS" : RULES["UBS"]})
+
+    assert flt == (
+        "hasAttachments eq true and (from/emailAddress/address eq 'ops@ubs-mail.example'"
+        " or endswith(from/emailAddress/address,'@ubs.example'))"
+    )
+
+
+def test_counterparty_filter_leaves_derived_domains_unfiltered () :
+    assert build_counterparty_filter(RULES) == "hasAttachments eq true"
+
+
+def test_same_domain_sender_is_listed_and_classified (fake_graph) :
+
+    fake_graph.load({"box@fund.example" : [
+
+        _message("m1", "desk@gs.example", "2026-01-05T08:00:00Z", subject="Goldman FX"),
+        _message("m2", "someone@news.example", "2026-01-05T09:00:00Z"),
+
+    ]})
+
+    rules = {"GS" : RULES["GS"]}
+    client = GraphClient(graph_base=fake_graph.graph_base)
+
+    df = _list_messages(
+
+        client, "box@fund.example", "2026-01-05T00:00:00Z", "2026-01-06T00:00:00Z",
+        token="t", with_attach=True, server_filter=build_counterparty_filter(rules),
+
+    )
+
+    classified = classify_messages(df, rules)
+
+    assert classified.filter(pl.col("Id") == "m1")["Counterparty"].to_list() == ["GS"]
+
+
+def test_rejected_filter_is_not_retried_for_the_run (fake_graph) :
+
+    fake_graph.load({"box@fund.example" : [
+
+        _message("m1", "custody@ubs.example", "2026-01-05T08:00:00Z"),
+        _message("m2", "someone@news.example", "2026-01-06T08:00:00Z"),
+
+    ]})
+
+    client = GraphClient(graph_base=fake_graph.graph_base)
+    server_filter = build_counterparty_filter({"UBS" : RULES["UBS"]})
+
+    day1 = _list_messages(client, "box@fund.example", "2026-01-05T00:00:00Z", "2026-01-06T00:00:00Z", token="t", server_filter=server_filter)
+    assert client.server_filter_rejected
+    assert fake_graph.stats["requests"] == 2
+
+    day2 = _list_messages(client, "box@fund.example", "2026-01-06T00:00:00Z", "2026-01-07T00:00:00Z", token="t", server_filter=server_filter)
+    assert fake_graph.stats["requests"] == 3
+
+    assert day1["Id"].to_list() == ["m1"]
+    assert day2["Id"].to_list() == ["m2"]
+
+
+def test_stream_holds_the_scheduler_slot_until_the_body_is_read (fake_graph, tmp_path) :
+
+    fake_graph.load({"box@fund.example" : [_message("m1", "reports@gs.example", "2026-01-05T08:00:00Z")]})
+
+    scheduler = RequestScheduler(max_in_flight=4)
+    client = GraphClient(graph_base=fake_graph.graph_base, scheduler=scheduler)
+    url = "users/box@fund.example/messages/m1/attachments/m1-a0/$value"
+
+    with client.stream(url, token="t") as r :
+
+        assert scheduler.stats()["in_flight"] == 1
+
+        # The fake serves `size` bytes of the attachment id, repeated
+        assert r.raw.read() == b"m1-a"
+
+    assert scheduler.stats()["in_flight"] == 0
+
+    path = _stream_attachment(client, "users/box@fund.example/messages/m1/attachments/m1-a0", str(tmp_path), "trades.csv", token="t")
+
+    with open(path, "rb") as f :
+        assert f.read() == b"m1-a"
+
+    assert scheduler.stats()["in_flight"] == 0
+
+
+def test_stream_body_failure_counts_as_throttling (fake_graph) :
+
+    fake_graph.load({"box@fund.example" : [_message("m1", "reports@gs.example", "2026-01-05T08:00:00Z")]})
+
+    scheduler = RequestScheduler(max_in_flight=4)
+    client = GraphClient(graph_base=fake_graph.graph_base, scheduler=scheduler)
+
+    with pytest.raises(requests.exceptions.ChunkedEncodingError) :
+
+        with client.stream("users/box@fund.example/messages/m1/attachments/m1-a0/$value", token="t") :
+            raise requests.exceptions.ChunkedEncodingError("connection reset mid-body")
+
+    stats = scheduler.stats()
+
+    assert stats["in_flight"] == 0
+    assert stats["throttled"] == 1
+    assert stats["limit"] == 2
+
+
+def test_token_request_is_retried_on_throttling (fake_graph) :
+
+    fake_graph.throttle_rate = 0.5
+    fake_graph.retry_after = 0.01
+
+    scheduler = RequestScheduler(max_retries=10, backoff_max=0.05)
+    provider = TokenProvider(app_id="app", secret="secret", token_endpoint=fake_graph.token_endpoint(), scheduler=scheduler)
+
+    assert provider.get_token().startswith("fake-")
+    assert scheduler.stats()["throttled"] >= 1
+
+
+def test_token_failure_raises (fake_graph) :
+
+    fake_graph.throttle_rate = 1.0
+    fake_graph.retry_after = 0.01
+
+    scheduler = RequestScheduler(max_retries=1, backoff_max=0.05)
+    provider = TokenProvider(app_id="app", secret="secret", token_endpoint=fake_graph.token_endpoint(), scheduler=scheduler)
+
+    with pytest.raises(Exception, match="Failed to acquire token") :
+        provider.get_token()
+
+
+def test_token_provider_is_cached_per_secret () :
+
+    old = get_token_provider(app_id="app", authority="https://login.example/tenant", secret="old")
+
+    assert get_token_provider(app_id="app", authority="https://login.example/tenant", secret="old") is old
+    assert get_token_provider(app_id="app", authority="https://login.example/tenant", secret="new") is not old
+
+
+def test_token_cache_is_private (tmp_path) :
+
+    class Cache :
+
+        has_state_changed = True
+
+        def serialize (self) :
+            return "{}"
+
+    provider = TokenProvider(app_id="app", secret="secret", cache_path=str(tmp_path / "token.json"))
+    provider._cache = Cache()
+
+    umask = os.umask(0o022)
+
+    try :
+        provider._persist_cache()
+
+    finally :
+        os.umask(umask)
+
+    assert stat.S_IMODE(os.stat(tmp_path / "token.json").st_mode) == 0o600
+    assert os.listdir(tmp_path) == ["token.json"]
+
+
+def test_token_endpoint_is_only_used_when_injected (fake_graph, monkeypatch) :
+
+    monkeypatch.setenv("TOKEN_ENDPOINT", fake_graph.token_endpoint())
+    assert TokenProvider(app_id="app", secret="secret").token_endpoint is None
+
+    provider = TokenProvider(app_id="app", authority="https://login.example/bench", secret="secret", token_endpoint=fake_graph.token_endpoint())
+    set_token_provider(provider)
+
+    assert get_token_provider(app_id="app", authority="https://login.example/bench", secret="secret") is provider
+    assert provider.get_token().startswith("fake-")
@@ -0,0 +1,77 @@
+import os
+import datetime as dt
+import polars as pl
+
+from src import parsing
+from src.parse_cache import ParseCache
+
+
+def _fill (cache : ParseCache, n : int) -> None :
+
+    for i in range(n) :
+        cache.put(f"{i:040x}", pl.DataFrame({"x" : list(range(100))}))
+
+
+def test_put_does_not_evict_and_parse_jobs_trims_once (tmp_path, monkeypatch) :
+
+    cache = ParseCache(cache_dir=str(tmp_path), max_mb=0)
+    _fill(cache, 5)
+
+    assert len(cache._entries()) == 5
+
+    monkeypatch.setattr(parsing, "get_parse_cache", lambda : cache)
+
+    jobs = [parsing.ParseJob("GS", dt.date(2026, 1, 5), "HV")]
+    summary = parsing.parse_jobs(jobs, {"GS" : lambda date, fundation : []}, max_workers=1)
+
+    assert summary["ok"] == 1
+    assert cache._entries() == []
+
+
+def test_key_changes_with_size_mtime_version_and_params (tmp_path) :
+
+    path = tmp_path / "GSFX_20260105.xlsx"
+    path.write_bytes(b"DAY1")
+
+    key = ParseCache.key(str(path), "gs", 1, {"sheet" : "FX"})
+
+    assert ParseCache.key(str(path), "gs", 1, {"sheet" : "FX"}) == key
+    assert ParseCache.key(str(path), "gs", 2, {"sheet" : "FX"}) != key
+    assert ParseCache.key(str(path), "gs", 1, {"sheet" : "EQ"}) != key
+    assert ParseCache.key(str(path), "ms", 1, {"sheet" : "FX"}) != key
+
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    touched = ParseCache.key(str(path), "gs", 1, {"sheet" : "FX"})
+
+    assert touched != key
+
+    # Same mtime, other size
+    stat = os.stat(path)
+    path.write_bytes(b"DAY1+")
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    assert ParseCache.key(str(path), "gs", 1, {"sheet" : "FX"}) not in (key, touched)
+    assert ParseCache.key(str(tmp_path / "missing.xlsx"), "gs", 1) is None
+
+
+def test_load_parses_once_per_key (tmp_path) :
+
+    path = tmp_path / "report.csv"
+    path.write_bytes(b"a\n1\n")
+
+    cache = ParseCache(cache_dir=str(tmp_path / "cache"))
+    calls = []
+
+    def parse () :
+        calls.append(1)
+        return pl.read_csv(path)
+
+    first = cache.load(str(path), "saxo", 1, parse)
+    again = cache.load(str(path), "saxo", 1, parse)
+
+    assert len(calls) == 1
+    assert again.equals(first)
+
+    cache.load(str(path), "saxo", 2, parse)
+    assert len(calls) == 2
@@ -0,0 +1,70 @@
+import polars as pl
+import xlsxwriter
+
+from src.readers import apply_schema, read_excel_sheets, read_csv_typed
+
+
+SCHEMA = {"Trade Id" : pl.Utf8, "Quantity" : pl.Float64, "Trade Date" : pl.Date}
+
+
+def _workbook (path, sheets) -> str :
+
+    with xlsxwriter.Workbook(str(path)) as wb :
+
+        for name, df in sheets.items() :
+            df.write_excel(wb, worksheet=name)
+
+    return str(path)
+
+
+def test_apply_schema_reports_missing_column_and_bad_values (capsys) :
+
+    df = pl.DataFrame({"Trade Id" : ["T1", "T2"], "Quantity" : ["10", "ten"]})
+    out = apply_schema(df, SCHEMA, label="GS FX")
+
+    report = capsys.readouterr().out
+
+    assert "GS FX : missing column(s) Trade Date" in report
+    assert "1 value(s) of Quantity are not Float64" in report
+
+    assert out.schema == pl.Schema(SCHEMA)
+    assert out["Quantity"].to_list() == [10.0, None]
+    assert out["Trade Date"].null_count() == 2
+
+
+def test_apply_schema_can_leave_missing_columns_to_the_caller (capsys) :
+
+    out = apply_schema(pl.DataFrame({"Trade Id" : ["T1"]}), SCHEMA, label="UBS", fill_missing=False)
+
+    assert out.columns == ["Trade Id"]
+    assert "missing" not in capsys.readouterr().out
+
+
+def test_read_excel_sheets_reports_missing_sheet (tmp_path, capsys) :
+
+    path = _workbook(tmp_path / "GS.xlsx", {
+
+        "FX" : pl.DataFrame({"Trade Id" : ["T1"], "Quantity" : [1.0]}),
+        "EQ" : pl.DataFrame({"Trade Id" : ["T2"], "Other" : ["x"]}),
+
+    })
+
+    frames = read_excel_sheets(path, ["FX", "EQ", "Options"], columns=["Trade Id", "Quantity"])
+
+    assert "Sheet Options not found" in capsys.readouterr().out
+    assert sorted(frames) == ["EQ", "FX"]
+
+    # Columns a sheet lacks are left out, for apply_schema to report
+    assert frames["FX"].columns == ["Trade Id", "Quantity"]
+    assert frames["EQ"].columns == ["Trade Id"]
+
+
+def test_read_csv_typed_falls_back_and_reports (tmp_path, capsys) :
+
+    path = tmp_path / "saxo.csv"
+    path.write_text("Trade Id,Quantity\nT1,5\nT2,n/a\n")
+
+    out = read_csv_typed(str(path), {"Trade Id" : pl.Utf8, "Quantity" : pl.Float64}, label="SAXO")
+
+    assert out["Quantity"].to_list() == [5.0, None]
+    assert "SAXO : 1 value(s) of Quantity" in capsys.readouterr().out